@@ -0,0 +1,65 @@
+"""Image id extraction over a synthetic corpus of image URLs in which, as in
+a real listening history, the same artwork recurs many times.
+
+    python -m benchmarks.image_ids [--urls N] [--distinct N]
+"""
+import argparse
+import random
+import re
+from time import perf_counter
+
+from lastfm import image_id_from_url
+
+SIZES = ["34s", "64s", "174s", "300x300"]
+
+
+def original_image_id(url):
+    match = re.search(r"https?://.*/(?P<id>[^/.]*)\.", url)
+    return match.group("id") if match else None
+
+
+def corpus(urls, distinct, seed=0):
+    rng = random.Random(seed)
+    artwork = [
+        f"https://lastfm.freetls.fastly.net/i/u/{rng.choice(SIZES)}/"
+        f"{rng.getrandbits(128):032x}.png"
+        for _ in range(distinct)
+    ]
+    # Listening is heavily skewed towards favourite albums
+    return rng.choices(artwork, weights=[1 / (n + 1) for n in range(distinct)], k=urls)
+
+
+def time_extractor(extract, urls):
+    start = perf_counter()
+    for url in urls:
+        extract(url)
+    return perf_counter() - start
+
+
+def run(urls=1_000_000, distinct=20_000):
+    urls = corpus(urls, distinct)
+    image_id_from_url.cache_clear()
+    results = {
+        "regex": time_extractor(original_image_id, urls),
+        "cached": time_extractor(image_id_from_url, urls),
+        "uncached": time_extractor(image_id_from_url.__wrapped__, urls),
+    }
+    return {
+        name: {"seconds": seconds, "urls_per_second": len(urls) / seconds}
+        for name, seconds in results.items()
+    } | {"cache": image_id_from_url.cache_info()._asdict()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--urls", type=int, default=1_000_000)
+    parser.add_argument("--distinct", type=int, default=20_000)
+    args = parser.parse_args()
+    results = run(args.urls, args.distinct)
+    cache = results.pop("cache")
+    for name, result in results.items():
+        print(
+            f"{name:>9}: {result['seconds']:6.3f}s "
+            f"({result['urls_per_second']:,.0f} urls/s)"
+        )
+    print(f"    cache: {cache['hits']:,} hits, {cache['misses']:,} misses")
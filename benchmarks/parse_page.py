@@ -0,0 +1,59 @@
+"""Per-page CPU time and peak memory of turning a 200-track recent tracks
+page into records, as dicts and as `Scrobble` tuples.
+
+The page comes from `benchmarks.synthetic`, laid out as the API does with
+`@attr` after the tracks. `Scrobble` tuples save memory over dicts, but
+aren't any quicker to build.
+
+    python -m benchmarks.parse_page
+"""
+import json
+import tracemalloc
+from time import process_time
+
+from benchmarks.synthetic import History
+from lastfm import parse_page, process_scrobbles, process_tracks_response
+
+
+def parse_to_dicts(body):
+    page, _ = parse_page(json.loads(body))
+    return list(process_tracks_response(page))
+
+
+def parse_to_scrobbles(body):
+    page, _ = parse_page(json.loads(body))
+    return list(process_scrobbles(page))
+
+
+def cpu_per_page(parse, body, repeat):
+    start = process_time()
+    for _ in range(repeat):
+        parse(body)
+    return (process_time() - start) / repeat
+
+
+def peak_memory(parse, body):
+    tracemalloc.start()
+    parse(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def run(repeat=200):
+    body = History(200).page(1)
+    return {
+        name: {
+            "cpu_ms": cpu_per_page(parse, body, repeat) * 1000,
+            "peak_kib": peak_memory(parse, body) / 1024,
+        }
+        for name, parse in (("dicts", parse_to_dicts), ("scrobbles", parse_to_scrobbles))
+    }
+
+
+if __name__ == "__main__":
+    for case, result in run().items():
+        print(
+            f"{case:>10}: {result['cpu_ms']:6.2f} ms/page "
+            f"{result['peak_kib']:8.1f} KiB peak"
+        )
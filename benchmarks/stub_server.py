@@ -0,0 +1,80 @@
+"""A local HTTP server answering API requests from a synthetic `History`, so
+benchmarks measure this package rather than Last.fm. It runs in its own
+process so generating responses doesn't compete with the code under test for
+the GIL."""
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+
+def handler(history, requests, bytes_sent):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are written separately, which Nagle's algorithm
+        # would otherwise delay on a kept-alive connection
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            params = dict(parse_qsl(urlparse(self.path).query))
+            body = history.response(params).encode()
+            with requests.get_lock():
+                requests.value += 1
+                bytes_sent.value += len(body)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(history, requests, bytes_sent, ports):
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), handler(history, requests, bytes_sent)
+    )
+    server.daemon_threads = True
+    ports.put(server.server_port)
+    server.serve_forever()
+
+
+class StubServer:
+    """Serve `history` on a free local port for the duration of a `with`
+    block, counting requests and bytes sent."""
+
+    def __init__(self, history):
+        self.history = history
+        self._requests = multiprocessing.Value("q", 0)
+        self._bytes_sent = multiprocessing.Value("q", 0)
+        self.port = None
+        self.process = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/2.0"
+
+    @property
+    def requests(self):
+        return self._requests.value
+
+    @property
+    def bytes_sent(self):
+        return self._bytes_sent.value
+
+    def __enter__(self):
+        ports = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=serve,
+            args=(self.history, self._requests, self._bytes_sent, ports),
+            daemon=True,
+        )
+        self.process.start()
+        self.port = ports.get(timeout=30)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.join()
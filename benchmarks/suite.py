@@ -0,0 +1,326 @@
+"""Throughput of an export and the reports against a synthetic history
+served from a local stub server, written as JSON for comparing commits.
+
+    python -m benchmarks.suite [--scrobbles N ...] [--output FILE]
+                               [--compare FILE] [--normalized] [--bulk]
+
+For each history size this times ingesting every page of recent tracks,
+both building indexes afterwards and maintaining them throughout, ingesting
+one scrobble at a time for comparison, choosing artists to
+refresh, enriching artists and albums and running every report query for
+each year of the history. Each phase records rows per second, latency
+percentiles and the process' peak RSS so far.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from time import perf_counter
+
+import requests
+from sqlite_utils import Database
+
+from benchmarks.stub_server import StubServer
+from benchmarks.synthetic import END_TIMESTAMP, History
+from lastfm import (
+    ApiClient,
+    LastFM,
+    fetch_album,
+    fetch_albums_to_update,
+    fetch_artist,
+    fetch_artists_to_update,
+    fetch_concurrently,
+    process_scrobbles,
+    process_tracks_response,
+    save_albums,
+    save_artists,
+    save_recent_track,
+    save_recent_tracks,
+    transaction,
+)
+from lastfm import reports
+from lastfm.cli import ENRICHMENT_BATCH_SIZE, batched
+from lastfm.db_setup import bulk_load, create_all_tables, create_indexes
+from lastfm.reports import report_params
+from lastfm.retry import RetryPolicy
+
+REPORTS = [
+    "TOP_ARTISTS",
+    "TOP_ALBUMS",
+    "TOP_TRACKS",
+    "BLAST_ARTISTS",
+    "LOVES",
+    "MOST_LOVED",
+    "MONTHLY_TAGS",
+]
+# Scrobbles saved one at a time, to compare with batched ingestion
+UNBATCHED_SCROBBLES = 10_000
+
+
+def peak_rss_kib():
+    # ru_maxrss is in kilobytes on Linux but bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if platform.system() == "Darwin" else peak
+
+
+def percentiles(samples):
+    """Median, 90th and 99th percentile and worst of `samples`, in ms."""
+    if not samples:
+        return {}
+    samples = [sample * 1000 for sample in samples]
+    if len(samples) == 1:
+        cuts = samples * 99
+    else:
+        cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": cuts[49], "p90": cuts[89], "p99": cuts[98], "max": max(samples)}
+
+
+class Phase:
+    """Timings of one part of the benchmark."""
+
+    def __init__(self):
+        self.rows = 0
+        self.latencies = []
+        self.seconds = 0
+
+    def record(self, seconds, rows=0):
+        self.latencies.append(seconds)
+        self.rows += rows
+
+    @contextmanager
+    def time(self, rows=0):
+        """Time one operation, such as a page or a query, of `rows` rows."""
+        start = perf_counter()
+        yield
+        self.record(perf_counter() - start, rows)
+
+    def result(self):
+        return {
+            "rows": self.rows,
+            "seconds": self.seconds,
+            "rows_per_second": self.rows / self.seconds if self.seconds else None,
+            "latency_ms": percentiles(self.latencies),
+            "peak_rss_kib": peak_rss_kib(),
+        }
+
+
+@contextmanager
+def phase(results, name):
+    timings = Phase()
+    start = perf_counter()
+    yield timings
+    timings.seconds = perf_counter() - start
+    results[name] = timings.result()
+
+
+def client_for(server) -> ApiClient:
+    return {
+        "base_url": server.base_url,
+        "api_key": "benchmark",
+        "username": "benchmark",
+        "session": requests.Session(),
+        "retry_policy": RetryPolicy(backoff=0),
+    }
+
+
+def ingest(db, client, history, concurrency, timings):
+    api = LastFM(
+        client,
+        start_date=history.start_timestamp - 1,
+        end_date=END_TIMESTAMP + 1,
+        concurrency=concurrency,
+    )
+    # Each page's latency covers waiting for it as well as saving it
+    start = perf_counter()
+    for page, _ in api.fetch_recent_tracks():
+        tracks = list(process_scrobbles(page))
+        with transaction(db):
+            save_recent_tracks(db, tracks)
+        timings.record(perf_counter() - start, len(tracks))
+        start = perf_counter()
+
+
+def ingest_unbatched(db, client, history, timings):
+    api = LastFM(client, concurrency=1)
+    for page, _ in api.fetch_recent_tracks():
+        for track in process_tracks_response(page):
+            with timings.time(rows=1):
+                save_recent_track(db, track)
+        if timings.rows >= min(UNBATCHED_SCROBBLES, history.scrobbles):
+            return
+
+
+def enrich(db, fetch, save, items, concurrency, timings):
+    fetched = fetch_concurrently(fetch, items, concurrency=concurrency)
+    for batch in batched(fetched, ENRICHMENT_BATCH_SIZE):
+        with timings.time(rows=len(batch)):
+            save(db, batch)
+
+
+def years(history):
+    first = datetime.fromtimestamp(history.start_timestamp, timezone.utc).year
+    last = datetime.fromtimestamp(END_TIMESTAMP - 1, timezone.utc).year
+    return [
+        (
+            int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp()),
+            int(datetime(year + 1, 1, 1, tzinfo=timezone.utc).timestamp()),
+        )
+        for year in range(max(first, last - 4), last + 1)
+    ]
+
+
+def run(
+    scrobbles, directory, concurrency=4, limit=1000, normalized=False, bulk=False
+):
+    history = History(scrobbles)
+    results = {}
+    with StubServer(history) as server:
+        client = client_for(server)
+
+        # A first import, building indexes once loaded as export does
+        path = os.path.join(directory, f"{scrobbles}.db")
+        db = Database(path)
+        create_all_tables(db, normalized)
+        with bulk_load(db) if bulk else nullcontext():
+            with phase(results, "ingest") as timings:
+                ingest(db, client, history, concurrency, timings)
+            with phase(results, "create_indexes"):
+                create_indexes(db)
+
+        # The same import maintaining every index as it goes
+        indexed_db = Database(os.path.join(directory, f"{scrobbles}-indexed.db"))
+        create_all_tables(indexed_db, normalized)
+        with bulk_load(indexed_db) if bulk else nullcontext():
+            create_indexes(indexed_db)
+            with phase(results, "ingest_indexes_first") as timings:
+                ingest(indexed_db, client, history, concurrency, timings)
+        results["first_import_seconds"] = {
+            "indexes_last": results["ingest"]["seconds"]
+            + results["create_indexes"]["seconds"],
+            "indexes_first": results["ingest_indexes_first"]["seconds"],
+        }
+
+        unbatched_db = Database(os.path.join(directory, f"{scrobbles}-unbatched.db"))
+        create_all_tables(unbatched_db, normalized)
+        create_indexes(unbatched_db)
+        with phase(results, "ingest_unbatched") as timings:
+            ingest_unbatched(unbatched_db, client, history, timings)
+
+        with phase(results, "artists_to_update") as timings:
+            for _ in range(10):
+                start = perf_counter()
+                artists = list(fetch_artists_to_update(db, limit=limit))
+                timings.record(perf_counter() - start, len(artists))
+
+        with phase(results, "enrich_artists") as timings:
+            enrich(
+                db,
+                lambda artist: fetch_artist(client, artist["name"]),
+                lambda database, batch: save_artists(
+                    database, [(artist["name"], details) for artist, details in batch]
+                ),
+                artists,
+                concurrency,
+                timings,
+            )
+
+        with phase(results, "enrich_albums") as timings:
+            enrich(
+                db,
+                lambda album: fetch_album(client, album["name"], album["artist"]),
+                lambda database, batch: save_albums(
+                    database, [details for _, details in batch]
+                ),
+                list(fetch_albums_to_update(db, limit=limit)),
+                concurrency,
+                timings,
+            )
+
+        results["requests"] = server.requests
+        results["bytes_downloaded"] = server.bytes_sent
+
+    for query in REPORTS:
+        with phase(results, f"report_{query.lower()}") as timings:
+            for start, end in years(history):
+                began = perf_counter()
+                rows = db.execute(getattr(reports, query), report_params(start, end))
+                timings.record(perf_counter() - began, len(rows.fetchall()))
+
+    results["database_bytes"] = os.path.getsize(path)
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    """Print how rows per second changed in each phase since `previous`."""
+    for size, phases in results["histories"].items():
+        before = previous.get("histories", {}).get(size, {})
+        for name, result in phases.items():
+            if not isinstance(result, dict) or not result.get("rows_per_second"):
+                continue
+            old = before.get(name, {}).get("rows_per_second")
+            change = f"{result['rows_per_second'] / old:6.2f}x" if old else "    new"
+            print(f"{size:>9} {name:>28}: {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scrobbles", type=int, nargs="+", default=[10_000])
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--normalized", action="store_true")
+    parser.add_argument("--bulk", action="store_true")
+    parser.add_argument("--output", help="File to write the results to as JSON")
+    parser.add_argument("--compare", help="Results of an earlier run to compare to")
+    args = parser.parse_args()
+
+    results = {
+        "commit": current_commit(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "normalized": args.normalized,
+        "bulk": args.bulk,
+        "histories": {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        for scrobbles in args.scrobbles:
+            results["histories"][str(scrobbles)] = run(
+                scrobbles,
+                directory,
+                concurrency=args.concurrency,
+                limit=args.limit,
+                normalized=args.normalized,
+                bulk=args.bulk,
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
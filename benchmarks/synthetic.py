@@ -0,0 +1,166 @@
+"""Deterministic synthetic listening histories, shaped like Last.fm's API
+responses. Any page can be generated on its own, so a history of millions of
+scrobbles never has to be held in memory."""
+import hashlib
+import json
+import random
+from itertools import accumulate
+from time import gmtime, strftime
+
+PER_PAGE = 200
+# Newest scrobble in every history: 2024-01-01T00:00:00Z
+END_TIMESTAMP = 1704067200
+# Scrobbles are this far apart, less up to half of it in jitter, so
+# timestamps stay unique and in order
+SPACING = 240
+IMAGE_HOST = "https://lastfm.freetls.fastly.net/i/u"
+IMAGE_SIZES = ["34s", "64s", "174s", "300x300"]
+TAGS = [
+    "math rock", "post-rock", "emo", "indie", "jazz", "shoegaze", "ambient",
+    "post-hardcore", "electronic", "folk", "seen live", "instrumental",
+]
+
+
+def image_id(*keys):
+    return hashlib.md5(repr(keys).encode()).hexdigest()
+
+
+def images(image):
+    return [
+        {"size": size, "#text": f"{IMAGE_HOST}/{size}/{image}.png"}
+        for size in IMAGE_SIZES
+    ]
+
+
+class History:
+    """`scrobbles` listens spread over a catalogue of artists, each with a
+    few albums of tracks. Listening is skewed towards favourite artists as
+    it is in a real history."""
+
+    def __init__(self, scrobbles, artists=None, seed=0):
+        self.scrobbles = scrobbles
+        self.seed = seed
+        self.artists = artists or max(10, int(scrobbles**0.5))
+        self.weights = list(accumulate(1 / (n + 1) for n in range(self.artists)))
+        self._tracks = {}
+
+    @property
+    def total_pages(self):
+        return max(1, -(-self.scrobbles // PER_PAGE))
+
+    @property
+    def start_timestamp(self):
+        return END_TIMESTAMP - self.scrobbles * SPACING
+
+    def albums(self, artist):
+        return 1 + hash((self.seed, artist)) % 5
+
+    def tracks(self, artist, album):
+        return 8 + hash((self.seed, artist, album)) % 5
+
+    def artist_name(self, artist):
+        return f"Artist {artist}"
+
+    def album_name(self, artist, album):
+        return f"Album {artist}-{album}"
+
+    def track_json(self, artist, album, track):
+        """A recent track as JSON, lacking only its closing date field.
+        Tracks recur throughout a history so these are cached."""
+        key = (artist, album, track)
+        if key not in self._tracks:
+            artist_name = self.artist_name(artist)
+            album_name = self.album_name(artist, album)
+            recent_track = {
+                "artist": {"mbid": "", "#text": artist_name},
+                "album": {"mbid": "", "#text": album_name},
+                "image": images(image_id(self.seed, artist_name, album_name)),
+                "streamable": "0",
+                "url": f"https://www.last.fm/music/{artist}/_/{track}",
+                "name": f"Track {artist}-{album}-{track}",
+                "mbid": "",
+            }
+            self._tracks[key] = json.dumps(recent_track, separators=(",", ":"))[:-1]
+        return self._tracks[key]
+
+    def track(self, rng, index):
+        artist = rng.choices(range(self.artists), cum_weights=self.weights)[0]
+        album = rng.randrange(self.albums(artist))
+        track = rng.randrange(self.tracks(artist, album))
+        timestamp = END_TIMESTAMP - index * SPACING - rng.randrange(SPACING // 2)
+        date = strftime("%d %b %Y, %H:%M", gmtime(timestamp))
+        return (
+            f'{self.track_json(artist, album, track)},'
+            f'"date":{{"uts":"{timestamp}","#text":"{date}"}}}}'
+        )
+
+    def page(self, page):
+        """The `user.getrecenttracks` response for `page`, newest first."""
+        rng = random.Random(f"{self.seed}/{page}")
+        first = (page - 1) * PER_PAGE
+        last = min(first + PER_PAGE, self.scrobbles)
+        tracks = ",".join(self.track(rng, index) for index in range(first, last))
+        attributes = {
+            "page": str(page),
+            "perPage": str(PER_PAGE),
+            "user": "benchmark",
+            "total": str(self.scrobbles),
+            "totalPages": str(self.total_pages),
+        }
+        return (
+            f'{{"recenttracks":{{"track":[{tracks}],'
+            f'"@attr":{json.dumps(attributes, separators=(",", ":"))}}}}}'
+        )
+
+    def artist_info(self, name):
+        rng = random.Random(f"{self.seed}/{name}")
+        return {
+            "artist": {
+                "name": name,
+                "url": f"https://www.last.fm/music/{name}",
+                "image": images(image_id(self.seed, name)),
+                "tags": {
+                    "tag": [
+                        {"name": tag, "url": f"https://www.last.fm/tag/{tag}"}
+                        for tag in rng.sample(TAGS, 5)
+                    ]
+                },
+                "bio": {
+                    "summary": f"{name} are a band. " * 5,
+                    "content": f"{name} are a band. " * 50,
+                },
+                "similar": {
+                    "artist": [
+                        {
+                            "name": self.artist_name(rng.randrange(self.artists)),
+                            "url": "",
+                            "image": [],
+                        }
+                        for _ in range(5)
+                    ]
+                },
+            }
+        }
+
+    def album_info(self, name, artist):
+        return {
+            "album": {
+                "name": name,
+                "artist": artist,
+                "url": f"https://www.last.fm/music/{artist}/{name}",
+                "image": images(image_id(self.seed, artist, name)),
+            }
+        }
+
+    def response(self, params):
+        """Body of the API response to the request made with `params`."""
+        method = params.get("method")
+        if method == "user.getrecenttracks":
+            return self.page(int(params.get("page", 1)))
+        if method == "artist.getinfo":
+            body = self.artist_info(params["artist"])
+        elif method == "album.getinfo":
+            body = self.album_info(params["album"], params["artist"])
+        else:
+            body = {"error": 3, "message": "Invalid Method"}
+        return json.dumps(body, separators=(",", ":"))
@@ -0,0 +1,147 @@
+"""Latency of the yearly report page against a synthetic history, running
+its sections one after another and all at once across Datasette's read
+connections.
+
+    python -m benchmarks.year_report [--scrobbles N] [--database FILE]
+                                     [--repeat N] [--threads N]
+
+Without `--database` a history of `--scrobbles` scrobbles is imported into a
+temporary database first.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+from datetime import datetime, timezone
+from time import perf_counter
+
+from datasette.app import Datasette
+from sqlite_utils import Database
+
+from benchmarks.suite import percentiles
+from benchmarks.synthetic import END_TIMESTAMP, History
+from lastfm import parse_page, process_scrobbles, save_recent_tracks, transaction
+from lastfm.db_setup import bulk_load, create_all_tables, create_indexes
+from plugins.report_queries import (
+    fetch_blast_artists,
+    fetch_loves,
+    fetch_most_loved,
+    fetch_top_albums,
+    fetch_top_artists,
+    fetch_top_tracks,
+    fetch_year_report,
+)
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+SECTIONS = [
+    fetch_top_artists,
+    fetch_top_albums,
+    fetch_top_tracks,
+    fetch_blast_artists,
+    fetch_loves,
+    fetch_most_loved,
+]
+# One in this many scrobbles is of a loved track
+LOVED_EVERY = 50
+
+
+def import_history(path, scrobbles):
+    history = History(scrobbles)
+    db = Database(path)
+    create_all_tables(db)
+    with bulk_load(db):
+        for page in range(1, history.total_pages + 1):
+            items, _ = parse_page(json.loads(history.page(page)))
+            tracks = list(process_scrobbles(items))
+            loves = [
+                {
+                    "artist": track.artist,
+                    "song": track.song,
+                    "uts_timestamp": track.uts_timestamp,
+                    "datetime": track.datetime,
+                }
+                for track in tracks[::LOVED_EVERY]
+            ]
+            with transaction(db):
+                save_recent_tracks(db, tracks)
+                db["loves"].insert_all(loves, pk="uts_timestamp", ignore=True)
+        with transaction(db):
+            db["artist_details"].insert_all(
+                {"id": name.lower(), "name": name}
+                for name in map(history.artist_name, range(history.artists))
+            )
+        create_indexes(db)
+
+
+def report_year(path):
+    db = Database(path)
+    latest = db.execute("select max(uts_timestamp) from playlist").fetchone()[0]
+    return datetime.fromtimestamp(latest or END_TIMESTAMP - 1, timezone.utc).year
+
+
+async def time_calls(call, repeat):
+    # The first call warms the page cache and isn't counted
+    await call()
+    samples = []
+    for _ in range(repeat):
+        start = perf_counter()
+        await call()
+        samples.append(perf_counter() - start)
+    return percentiles(samples)
+
+
+async def measure(path, repeat, threads):
+    datasette = Datasette(
+        [path],
+        template_dir=os.path.join(ROOT, "templates"),
+        plugins_dir=os.path.join(ROOT, "plugins"),
+        settings={"num_sql_threads": threads, "sql_time_limit_ms": 600_000},
+    )
+    year = report_year(path)
+    start = int(datetime(year, 1, 1).timestamp())
+    end = int(datetime(year + 1, 1, 1).timestamp())
+    fetchers = [fetch(datasette) for fetch in SECTIONS]
+    report = fetch_year_report(datasette)
+
+    async def sequential():
+        for fetch in fetchers:
+            await fetch(start, end)
+
+    async def concurrent():
+        await report(start, end)
+
+    async def page():
+        response = await datasette.client.get(f"/reports/year/{year}")
+        response.raise_for_status()
+
+    return {
+        "year": year,
+        "threads": threads,
+        "sequential_ms": await time_calls(sequential, repeat),
+        "concurrent_ms": await time_calls(concurrent, repeat),
+        "page_ms": await time_calls(page, repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scrobbles", type=int, default=1_000_000)
+    parser.add_argument("--database", help="An existing export to report on")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.database
+        if not path:
+            path = os.path.join(directory, "year_report.db")
+            start = perf_counter()
+            import_history(path, args.scrobbles)
+            print(f"Imported {args.scrobbles} scrobbles in {perf_counter() - start:.1f}s")
+        results = asyncio.run(measure(path, args.repeat, args.threads))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
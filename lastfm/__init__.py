@@ -1,10 +1,25 @@
 # -*- coding: utf-8 -*-
 import datetime
-from typing import TypedDict
+import hashlib
+import json
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
+from typing import NamedTuple, NotRequired, Optional, TypedDict
+from weakref import WeakKeyDictionary
+from zoneinfo import ZoneInfo
 import requests
 import re
 from sqlite_utils import Database
-from time import sleep
+from time import monotonic, sleep
+
+from lastfm.cache import ResponseCache
+from lastfm.db_setup import DIMENSIONS, is_normalized
+from lastfm.metrics import Metrics
+from lastfm.rate_limit import TokenBucket
+from lastfm.retry import RETRYABLE_EXCEPTIONS, RetryPolicy, raise_for_error
+from lastfm.rollups import fetch_new_timestamps, save_artist_gaps, save_rollups
 
 
 class ApiClient(TypedDict):
@@ -12,6 +27,16 @@ class ApiClient(TypedDict):
     api_key: str
     session: requests.Session
     username: str
+    rate_limiter: NotRequired[TokenBucket]
+    retry_policy: NotRequired[RetryPolicy]
+    cache: NotRequired[ResponseCache]
+    metrics: NotRequired[Metrics]
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+# Seconds to wait for the API to connect or send more of a response
+REQUEST_TIMEOUT = 30
+DEFAULT_TIMEZONE = "UTC"
 
 
 class LastFM:
@@ -22,13 +47,15 @@ class LastFM:
         client: ApiClient,
         start_date=None,
         end_date=None,
+        concurrency=1,
     ):
         self.client = client
+        self.concurrency = concurrency
 
         self.start_date = convert_to_timestamp(start_date)
         self.end_date = convert_to_timestamp(end_date)
 
-    def fetch_recent_tracks(self):
+    def fetch_recent_tracks(self, start_page=1):
         """Fetch user's track history given the parametrs."""
         yield from fetch_pages(
             self.client,
@@ -38,13 +65,20 @@ class LastFM:
                 "to": self.end_date,
                 "extended": 1,
             },
+            concurrency=self.concurrency,
+            start_page=start_page,
         )
 
 
-def fetch_loved_tracks(client: ApiClient):
-    data = fetch_pages(client, "user.getlovedtracks")
+def fetch_loved_tracks(client: ApiClient, concurrency=1, since=None):
+    """Yield loves newest first. When `since` is given, stop at the first love
+    at or before that timestamp - everything after it is already stored."""
+    data = fetch_pages(client, "user.getlovedtracks", concurrency=concurrency)
     for _, (loves, metadata) in enumerate(data):
         for love in process_tracks_response(loves):
+            if since is not None and love and love["uts_timestamp"] <= since:
+                data.close()
+                return
             yield love, metadata
 
 
@@ -53,9 +87,11 @@ DATE_FORMAT = "%Y-%m-%d"
 
 def convert_to_timestamp(date):
     """Convert human-readable `date` - either `datetime.date` or `str` - to
-    Unix Timestamp."""
+    Unix Timestamp. Timestamps are passed through unchanged."""
     if date is None:
         return None
+    if isinstance(date, int):
+        return date
     if isinstance(date, datetime.date):
         return int(date.timestamp())
     return int(datetime.datetime.strptime(date, DATE_FORMAT).timestamp())
@@ -66,6 +102,10 @@ def fetch_artist(client: ApiClient, name, params=None):
     response = fetch_page(
         client, "artist.getinfo", params={"artist": name, "autocorrect": "0"} | params
     )
+    return parse_artist(response)
+
+
+def parse_artist(response):
     artist = response.get("artist", {})
     return {
         "name": artist.get("name", ""),
@@ -91,6 +131,10 @@ def fetch_album(client: ApiClient, name: str, artist: str):
         "album.getinfo",
         params={"album": name, "artist": artist, "autocorrect": 0},
     )
+    return parse_album(response)
+
+
+def parse_album(response):
     album = response.get("album", {})
     return {
         "name": album.get("name", ""),
@@ -100,43 +144,170 @@ def fetch_album(client: ApiClient, name: str, artist: str):
     }
 
 
-def fetch_pages(client: ApiClient, method, params=None, wait=0):
-    page = 1
+def fetch_concurrently(fetch, items, concurrency=1):
+    """Yield `(item, fetch(item))` for each of `items`, in the order results
+    arrive, with up to `concurrency` calls to `fetch` in flight."""
+    if concurrency <= 1:
+        for item in items:
+            yield item, fetch(item)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        items = iter(items)
+        pending = {
+            executor.submit(fetch, item): item for item in islice(items, concurrency)
+        }
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                for following in islice(items, 1):
+                    pending[executor.submit(fetch, following)] = following
+                yield item, future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def fetch_pages(
+    client: ApiClient,
+    method,
+    params=None,
+    wait=0,
+    concurrency=1,
+    start_page=1,
+):
+    """Yield `(items, metadata)` for every page of `method` from `start_page`
+    onwards, in page order.
+
+    Once the first page reveals `totalPages`, up to `concurrency` of the
+    remaining pages are requested at a time. Use the client's
+    `rate_limiter` to cap the overall request rate."""
     params = params or {}
-    while True:
+
+    def fetch(page):
         sleep(wait)
-        content = fetch_page(client, method, {"page": page, "limit": 200} | params)
-        root_name = next(iter(content.keys()), "")
-        root = content.get(root_name, {})
-        item_name = next((key for key in root.keys() if key != "@attr"), "")
-        metadata = root.get("@attr", {})
-        data = root.get(item_name, None)
-        yield data, metadata
-        total_pages = int(metadata.get("totalPages", 0))
-        page += 1
-        if page > total_pages:
-            break
+        page_params = {"page": page, "limit": 200} | params
+        return parse_page(fetch_page(client, method, page_params))
+
+    data, metadata = fetch(start_page)
+    yield data, metadata
+    pages = range(start_page + 1, int(metadata.get("totalPages", 0)) + 1)
+    if concurrency <= 1:
+        for page in pages:
+            yield fetch(page)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        pending = []
+        for page in pages:
+            pending.append(executor.submit(fetch, page))
+            if len(pending) >= concurrency:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def parse_page(content):
+    """Split a paged response into its list of items and `@attr` block."""
+    root_name = next(iter(content.keys()), "")
+    root = content.get(root_name, {})
+    item_name = next((key for key in root.keys() if key != "@attr"), "")
+    metadata = root.get("@attr", {})
+    return root.get(item_name, None), metadata
 
 
 def fetch_page(client: ApiClient, method, params=None):
-    params = params or {}
-    default_params = {
+    params = api_params(client, method, params)
+    cached = cached_response(client, method, params)
+    if cached is not None:
+        return cached
+    tries = 0
+    while True:
+        tries += 1
+        sleep(rate_limit_delay(client, method))
+        started = monotonic()
+        try:
+            response = client["session"].get(
+                client["base_url"], params=params, timeout=REQUEST_TIMEOUT
+            )
+        except RETRYABLE_EXCEPTIONS:
+            delay = retry_delay(client, tries)
+            if delay is None:
+                raise
+        else:
+            record_request(client, started, response)
+            delay = retry_delay(client, tries, response)
+            if delay is None:
+                return read_response(client, method, params, response)
+        sleep(delay)
+
+
+# The steps of a request shared by `fetch_page` and its coroutine version in
+# `lastfm.async_client`, which differ only in how they wait and send it
+
+
+def api_params(client, method, params=None):
+    """Query string of a call to `method`, including what every call needs."""
+    return (params or {}) | {
         "api_key": client["api_key"],
         "method": method,
         "user": client["username"],
         "extended": 1,
         "format": "json",
     }
-    tries = 0
-    while True:
-        tries += 1
-        response = client["session"].get(
-            client["base_url"], params=(params | default_params)
-        )
-        if response.status_code == 200 or tries >= 5:
-            break
-    response.raise_for_status()
-    return response.json()
+
+
+def cached_response(client, method, params):
+    """The cached response to a call, if the client has a cache holding it."""
+    cache = client.get("cache", None)
+    cached = cache.get(method, params) if cache else None
+    if cached is not None and client.get("metrics", None):
+        client["metrics"].record_cache_hit()
+    return cached
+
+
+def rate_limit_delay(client, method):
+    """Take a rate limit token for `method`, returning the seconds to wait
+    before making the request."""
+    rate_limiter = client.get("rate_limiter", None)
+    if not rate_limiter:
+        return 0
+    waited = rate_limiter.reserve(method)
+    if client.get("metrics", None):
+        client["metrics"].record_rate_limit_wait(waited)
+    return waited
+
+
+def record_request(client, started, response):
+    if client.get("metrics", None):
+        client["metrics"].record_request(monotonic() - started, len(response.content))
+
+
+def retry_delay(client, tries, response=None):
+    """Seconds to wait before trying again after attempt number `tries` got
+    `response` - or failed without one - or None to give up and use it."""
+    retry_policy = client.get("retry_policy", DEFAULT_RETRY_POLICY)
+    if tries >= retry_policy.max_attempts:
+        return None
+    if response is not None and not retry_policy.should_retry(response):
+        return None
+    if client.get("metrics", None):
+        client["metrics"].record_retry()
+    return retry_policy.delay(tries, response)
+
+
+def read_response(client, method, params, response):
+    """Decode the final response to a call, caching it when it succeeded."""
+    raise_for_error(response)
+    content = response.json()
+    cache = client.get("cache", None)
+    if cache:
+        cache.set(method, params, content)
+    return content
 
 
 def process_tracks_response(page):
@@ -161,23 +332,256 @@ def process_tracks_response(page):
         yield item
 
 
+class Scrobble(NamedTuple):
+    """Compact record of a single listen - a plain tuple, without the
+    per-instance dict of the full API response."""
+
+    artist: str
+    song: str
+    album: Optional[str]
+    uts_timestamp: int
+    datetime: Optional[str]
+    image_id: Optional[str]
+
+
+def process_scrobbles(page):
+    """Yield a `Scrobble` for each song within page, skipping now playing
+    and any other song without a date."""
+    for song in page or ():
+        if "@attr" in song and song["@attr"].get("nowplaying"):
+            continue
+        date = song.get("date", None)
+        if not date:
+            continue
+        artist = song.get("artist", {})
+        yield Scrobble(
+            artist.get("name", None) or artist.get("#text", ""),
+            song.get("name", None),
+            song.get("album", {}).get("#text", None),
+            int(date["uts"]),
+            date["#text"],
+            extract_image_id(song),
+        )
+
+
+def as_scrobble(recent_track):
+    if isinstance(recent_track, Scrobble):
+        return recent_track
+    return Scrobble(
+        recent_track["artist"],
+        recent_track["song"],
+        recent_track.get("album", None),
+        recent_track["uts_timestamp"],
+        recent_track.get("datetime", None),
+        recent_track.get("image_id", None),
+    )
+
+
+IMAGE_ID_PATTERN = re.compile(r"https?://.*/(?P<id>[^/.]*)\.")
+
+
 def extract_image_id(item):
     images = item.get("image", [])
     image = images[0].get("#text", "") if images else ""
-    match = re.search(r"https?://.*/(?P<id>[^/.]*)\.", image)
+    return image_id_from_url(image) if image else None
+
+
+@lru_cache(maxsize=8192)
+def image_id_from_url(url):
+    """The image hash from a Last.fm image URL - the file name without its
+    extension. The same artwork recurs thousands of times through a listening
+    history, so results are memoised."""
+    head, _, name = url.rpartition("/")
+    image_id, extension, _ = name.partition(".")
+    # Plain string splitting covers every URL Last.fm returns; anything
+    # unusual falls back to the full pattern
+    scheme = "https://" if url.startswith("https://") else "http://"
+    if extension and url.startswith(scheme) and len(head) >= len(scheme):
+        return image_id
+    match = IMAGE_ID_PATTERN.search(url)
     return match.group("id") if match else None
 
 
+_open_transactions = set()
+
+# Integer keys of the artists, tracks and albums already looked up per database
+_dimension_keys = WeakKeyDictionary()
+
+
+@contextmanager
+def transaction(db: Database):
+    """Run the enclosed writes as a single transaction. Nested calls join the
+    outermost one, so batches can be combined without committing early."""
+    if id(db.conn) in _open_transactions:
+        yield
+        return
+    if not db.conn.in_transaction:
+        db.execute("begin")
+    _open_transactions.add(id(db.conn))
+    try:
+        yield
+    except BaseException:
+        db.conn.rollback()
+        _dimension_keys.pop(db, None)
+        raise
+    else:
+        db.conn.commit()
+    finally:
+        _open_transactions.discard(id(db.conn))
+
+
 def save_recent_track(db: Database, recent_track):
-    scrobble_columns = ("artist", "song", "album", "uts_timestamp", "datetime")
-    db["playlist"].upsert(
-        {k: v for k, v in recent_track.items() if k in scrobble_columns},
-        pk="uts_timestamp",
+    save_recent_tracks(db, [recent_track])
+
+
+def save_recent_tracks(db: Database, recent_tracks):
+    """Save a batch of scrobbles, typically one page from `fetch_pages`.
+
+    First and last listen dates are aggregated per artist, track and album
+    before writing so every table is written with a single `executemany`
+    inside one transaction."""
+    scrobbles = {}
+    artists = {}
+    tracks = {}
+    albums = {}
+    for recent_track in recent_tracks:
+        if not recent_track:
+            continue
+        scrobble = as_scrobble(recent_track)
+        timestamp = scrobble.uts_timestamp
+        artist = scrobble.artist
+        scrobbles[timestamp] = scrobble
+        aggregate_listen(artists, artist, {"artist": artist}, timestamp)
+        track = aggregate_listen(
+            tracks,
+            (scrobble.song, artist),
+            {"song": scrobble.song, "artist": artist, "image_id": None},
+            timestamp,
+        )
+        if scrobble.image_id:
+            track["image_id"] = scrobble.image_id
+        if scrobble.album:
+            aggregate_listen(
+                albums,
+                (scrobble.album, artist),
+                {"album": scrobble.album, "artist": artist},
+                timestamp,
+            )
+
+    zone = ZoneInfo(fetch_timezone(db))
+    with transaction(db):
+        new_timestamps = fetch_new_timestamps(db, scrobbles.keys())
+        new_scrobbles = [
+            scrobble._asdict()
+            for timestamp, scrobble in scrobbles.items()
+            if timestamp in new_timestamps
+        ]
+        save_rollups(db, new_scrobbles)
+        if is_normalized(db):
+            save_normalized_scrobbles(db, scrobbles.values(), zone)
+        else:
+            db.conn.executemany(
+                "insert into playlist (artist, song, album, uts_timestamp, datetime,"
+                "       local_year, local_month, local_day, local_hour)"
+                "   values (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                "   on conflict(uts_timestamp)"
+                "       do update set artist = excluded.artist,"
+                "           song = excluded.song,"
+                "           album = excluded.album,"
+                "           datetime = excluded.datetime",
+                [
+                    (*scrobble[:5], *local_time(scrobble.uts_timestamp, zone))
+                    for scrobble in scrobbles.values()
+                ],
+            )
+        save_artist_gaps(db, new_scrobbles)
+        db.conn.executemany(
+            "insert into artist_history (id, name, discovered, last_listened)"
+            "   values (lower(:artist), :artist, :discovered, :last_listened)"
+            "on conflict(id)"
+            "   do update set discovered = min(:discovered, discovered),"
+            "       last_listened = max(:last_listened, last_listened)",
+            artists.values(),
+        )
+        db.conn.executemany(
+            "insert into track_details"
+            "       (name, artist, discovered, last_listened, image_id)"
+            "   values (:song, :artist, :discovered, :last_listened, :image_id)"
+            "   on conflict(name, artist)"
+            "       do update set discovered = min(:discovered, discovered),"
+            "           last_listened = max(:last_listened, last_listened),"
+            "           image_id = ifnull(:image_id, image_id)",
+            tracks.values(),
+        )
+        db.conn.executemany(
+            "insert into album_details (id, artist_id, name, artist, discovered, last_listened)"
+            "   values (lower(:album), lower(:artist), :album, :artist, :discovered, :last_listened)"
+            "   on conflict(id, artist_id)"
+            "       do update set discovered = min(:discovered, discovered),"
+            "          last_listened = max(:last_listened, last_listened)",
+            albums.values(),
+        )
+
+
+def save_normalized_scrobbles(db: Database, scrobbles, zone):
+    """Save scrobbles as keys into the artists, tracks and albums tables. A
+    missing artist or song is keyed as '', as `normalize_playlist` does."""
+    rows = []
+    for scrobble in scrobbles:
+        artist_id = dimension_key(db, "artists", (scrobble.artist or "",))
+        track_id = dimension_key(db, "tracks", (artist_id, scrobble.song or ""))
+        album_id = None
+        if scrobble.album:
+            album_id = dimension_key(db, "albums", (artist_id, scrobble.album))
+        rows.append(
+            (
+                scrobble.uts_timestamp,
+                track_id,
+                album_id,
+                *local_time(scrobble.uts_timestamp, zone),
+            )
+        )
+    db.conn.executemany(
+        "insert into scrobbles (uts_timestamp, track_id, album_id,"
+        "       local_year, local_month, local_day, local_hour)"
+        "   values (?, ?, ?, ?, ?, ?, ?)"
+        "   on conflict(uts_timestamp)"
+        "       do update set track_id = excluded.track_id,"
+        "           album_id = excluded.album_id",
+        rows,
     )
-    save_artist_listen_date(db, recent_track)
-    save_track_listen_date(db, recent_track)
-    save_track_details(db, recent_track)
-    save_album_listen_date(db, recent_track)
+
+
+def dimension_key(db: Database, table, values):
+    """Integer key of the row in `table` identified by `values`, inserting it
+    if it's new. Keys are remembered so each is only looked up once."""
+    keys = _dimension_keys.setdefault(db, {})
+    key = keys.get((table, values))
+    if key is None:
+        columns = DIMENSIONS[table]
+        where = " and ".join(f"{column} = ?" for column in columns)
+        row = db.execute(f"select id from {table} where {where}", values).fetchone()
+        if row:
+            key = row[0]
+        else:
+            key = db.execute(
+                f"insert into {table} ({', '.join(columns)})"
+                f"   values ({', '.join('?' * len(columns))})",
+                values,
+            ).lastrowid
+        keys[(table, values)] = key
+    return key
+
+
+def aggregate_listen(listens, key, record, timestamp):
+    """Fold a listen at `timestamp` into the first/last listen dates held
+    for `key`."""
+    listen = listens.setdefault(
+        key, record | {"discovered": timestamp, "last_listened": timestamp}
+    )
+    listen["discovered"] = min(listen["discovered"], timestamp)
+    listen["last_listened"] = max(listen["last_listened"], timestamp)
+    return listen
 
 
 def save_love(db: Database, love):
@@ -198,17 +602,55 @@ def save_artist_listen_date(db: Database, artist_listen):
     )
 
 
+def save_artists(db: Database, artists, timestamp=0):
+    """Save the details, tags and similar artists fetched for a batch of
+    `(name, artist_details)` pairs in one transaction. Tags and similar
+    artists are only rewritten for artists whose details changed.
+
+    Returns the number of artists that changed."""
+    changed = []
+    with transaction(db):
+        for name, artist_details in artists:
+            if save_artist_details(db, artist_details, timestamp=timestamp):
+                changed.append((name, artist_details))
+        save_all_artist_tags(
+            db, [(name, artist_details["tags"]) for name, artist_details in changed]
+        )
+        save_all_similar_artists(
+            db,
+            [(name, artist_details["similar"]) for name, artist_details in changed],
+        )
+    return len(changed)
+
+
+def content_hash(details):
+    """Fingerprint of a fetched payload, to tell whether it has changed since
+    it was last saved."""
+    payload = json.dumps(details, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
 EMPTY_ARTIST = {"image_id": None, "url": None, "wiki": None, "summary": None}
 
 
 def save_artist_details(db: Database, artist_details, timestamp=0):
-    with db.conn:
+    """Save `artist_details` unless they are identical to the last details
+    saved, in which case only `last_updated` moves on.
+
+    Returns whether anything besides `last_updated` was written."""
+    artist_details = EMPTY_ARTIST | {
+        "timestamp": timestamp,
+        "content_hash": content_hash(artist_details),
+    } | artist_details
+    with transaction(db):
+        if touch_unchanged(db, "artist_details", "id = lower(:name)", artist_details):
+            return False
         db.execute(
             (
                 "insert into artist_details (id, name, image_id, url, wiki,"
-                "                            summary, last_updated)"
+                "                            summary, last_updated, content_hash)"
                 "   values (lower(:name), :name, :image_id, :url, :wiki,"
-                "           :summary, :timestamp)"
+                "           :summary, :timestamp, :content_hash)"
                 "   on conflict(id)"
                 "       do update set"
                 "           image_id ="
@@ -223,25 +665,92 @@ def save_artist_details(db: Database, artist_details, timestamp=0):
                 "           summary ="
                 "               case when ifnull(:summary, '') = '' then "
                 "                   summary else :summary end,"
-                "           last_updated = :timestamp"
+                "           last_updated = :timestamp,"
+                "           content_hash = :content_hash"
             ),
-            EMPTY_ARTIST | {"timestamp": timestamp} | artist_details,
+            artist_details,
         )
+    return True
+
+
+def touch_unchanged(db: Database, table, where, details):
+    """Move `last_updated` on for the row matching `where` if it was saved
+    from an identical payload. Returns whether it was."""
+    cursor = db.execute(
+        f"update {table} set last_updated = :timestamp"
+        f"   where {where} and content_hash = :content_hash",
+        details,
+    )
+    return cursor.rowcount > 0
 
 
 def save_artist_tags(db: Database, artist: str, tags):
-    for tag in tags:
-        db["artist_tags"].upsert(
-            tag | {"id": artist.lower(), "name": tag["name"].lower()}, pk=["id", "name"]
+    save_all_artist_tags(db, [(artist, tags)])
+
+
+def save_all_artist_tags(db: Database, artist_tags):
+    """Replace the tags of every artist in a batch of `(artist, tags)` pairs,
+    so tags Last.fm no longer lists don't linger."""
+    with transaction(db):
+        db.conn.executemany(
+            "delete from artist_tags where id = ?",
+            [(artist.lower(),) for artist, _ in artist_tags],
+        )
+        db.conn.executemany(
+            "insert or replace into artist_tags (id, name, url, weight)"
+            "   values (?, ?, ?, ?)",
+            [
+                (artist.lower(), tag["name"].lower(), tag.get("url"), weight)
+                for artist, tags in artist_tags
+                for tag, weight in zip(tags, tag_weights(tags))
+            ],
         )
 
 
+def tag_weights(tags):
+    """How strongly each of an artist's tags applies to them, out of 100.
+    Last.fm lists tags most applied first, only counting them for some
+    methods, so without a count the weight falls with position."""
+    return [
+        int(tag["count"]) if "count" in tag else max(100 - 20 * position, 10)
+        for position, tag in enumerate(tags)
+    ]
+
+
+def save_albums(db: Database, albums, timestamp=0):
+    """Save the details fetched for a batch of albums in one transaction.
+
+    Returns the number of albums that changed."""
+    changed = 0
+    with transaction(db):
+        for album_details in albums:
+            changed += save_album_details(db, album_details, timestamp=timestamp)
+    return changed
+
+
 def save_album_details(db: Database, album_details, timestamp=0):
-    with db.conn:
+    """Save `album_details` unless they are identical to the last details
+    saved, in which case only `last_updated` moves on.
+
+    Returns whether anything besides `last_updated` was written."""
+    album_details = {
+        "image_id": None,
+        "url": None,
+        "timestamp": timestamp,
+        "content_hash": content_hash(album_details),
+    } | album_details
+    with transaction(db):
+        if touch_unchanged(
+            db,
+            "album_details",
+            "id = lower(:name) and artist_id = lower(:artist)",
+            album_details,
+        ):
+            return False
         db.execute(
             (
-                "insert into album_details (id, artist_id, name, artist, image_id, url, last_updated)"
-                "   values (lower(:name), lower(:artist), :name, :artist, :image_id, :url, :timestamp)"
+                "insert into album_details (id, artist_id, name, artist, image_id, url, last_updated, content_hash)"
+                "   values (lower(:name), lower(:artist), :name, :artist, :image_id, :url, :timestamp, :content_hash)"
                 "on conflict(id, artist_id)"
                 "   do update set image_id ="
                 "       case when ifnull(:image_id, '') = '' then "
@@ -249,10 +758,12 @@ def save_album_details(db: Database, album_details, timestamp=0):
                 "   url ="
                 "       case when ifnull(:url, '') = '' then "
                 "           url else :url end,"
-                "   last_updated = :timestamp"
+                "   last_updated = :timestamp,"
+                "   content_hash = :content_hash"
             ),
-            {"image_id": None, "url": None, "timestamp": timestamp} | album_details,
+            album_details,
         )
+    return True
 
 
 def fetch_artists_to_update(db: Database, cutoff=99999999999, limit=None):
@@ -264,12 +775,90 @@ def fetch_artists_to_update(db: Database, cutoff=99999999999, limit=None):
         "   order by (ifnull(ad.last_updated, 0) - ifnull(ah.last_listened,0)) asc"
     )
 
-    if limit:
+    if limit is not None:
         query += " limit :limit"
 
     return db.query(query, {"cutoff": cutoff, "limit": limit})
 
 
+def local_time(timestamp, zone):
+    """Year, month, day and hour of `timestamp` in the time zone `zone`."""
+    date = datetime.datetime.fromtimestamp(timestamp, zone)
+    return date.year, date.month, date.day, date.hour
+
+
+def fetch_timezone(db: Database):
+    """Name of the time zone scrobbles are bucketed into local time in."""
+    if not db["_settings"].exists():
+        return DEFAULT_TIMEZONE
+    row = db.execute("select value from _settings where name = 'timezone'").fetchone()
+    return row[0] if row else DEFAULT_TIMEZONE
+
+
+def save_timezone(db: Database, timezone):
+    """Bucket scrobbles into local time in `timezone`, re-bucketing those
+    already saved if it has changed. Scrobbles saved before the local time
+    columns existed are filled in either way."""
+    zone = ZoneInfo(timezone)
+    table = "scrobbles" if is_normalized(db) else "playlist"
+    with transaction(db):
+        where = "" if timezone != fetch_timezone(db) else " where local_year is null"
+        db.execute(
+            "insert or replace into _settings (name, value) values ('timezone', ?)",
+            [timezone],
+        )
+        timestamps = [
+            timestamp
+            for (timestamp,) in db.execute(f"select uts_timestamp from {table}{where}")
+        ]
+        db.conn.executemany(
+            f"update {table} set local_year = ?, local_month = ?,"
+            "   local_day = ?, local_hour = ?"
+            "   where uts_timestamp = ?",
+            [(*local_time(timestamp, zone), timestamp) for timestamp in timestamps],
+        )
+
+
+def fetch_last_timestamp(db: Database, table="playlist"):
+    """Timestamp of the newest scrobble or love already stored in `table`."""
+    if table == "playlist" and is_normalized(db):
+        table = "scrobbles"
+    if not db[table].exists():
+        return None
+    [(timestamp,)] = db.execute(f"select max(uts_timestamp) from [{table}]")
+    return timestamp
+
+
+def fetch_sync_state(db: Database, method):
+    """The last completed page of an unfinished sync of `method`, along with
+    the time window it was fetching."""
+    return next(
+        db.query("select * from _sync_state where method = :method", {"method": method}),
+        None,
+    )
+
+
+def save_sync_state(db: Database, sync_state):
+    """Record a completed page. Call inside the same `transaction` as the
+    page's writes so the two are committed together."""
+    db.execute(
+        "insert into _sync_state"
+        "       (method, from_timestamp, to_timestamp, page, total_pages)"
+        "   values (:method, :from_timestamp, :to_timestamp, :page, :total_pages)"
+        "   on conflict(method)"
+        "       do update set from_timestamp = :from_timestamp,"
+        "           to_timestamp = :to_timestamp,"
+        "           page = :page,"
+        "           total_pages = :total_pages",
+        sync_state,
+    )
+
+
+def clear_sync_state(db: Database, method):
+    with transaction(db):
+        db.execute("delete from _sync_state where method = :method", {"method": method})
+
+
 def fetch_albums_to_update(db: Database, cutoff=99999999999, limit=None):
     query = (
         "select * from album_details "
@@ -277,37 +866,15 @@ def fetch_albums_to_update(db: Database, cutoff=99999999999, limit=None):
         "   order by (last_updated - last_listened) asc"
     )
 
-    if limit:
+    if limit is not None:
         query += " limit :limit"
 
     return db.query(query, {"cutoff": cutoff, "limit": limit})
 
 
-def save_track_listen_date(db, recent_track):
-    db.execute(
-        "insert into track_details (name, artist, discovered, last_listened)"
-        "   values (:song, :artist, :uts_timestamp, :uts_timestamp)"
-        "   on conflict(name, artist)"
-        "       do update set discovered = min(:uts_timestamp, discovered),"
-        "           last_listened = max(:uts_timestamp, last_listened)",
-        recent_track,
-    )
-
-
-def save_track_details(db: Database, recent_track):
-    if recent_track.get("image_id", None):
-        db.execute(
-            "insert into track_details (name, artist, image_id)"
-            "   values (:song, :artist, :image_id)"
-            "   on conflict(name, artist)"
-            "       do update set image_id = :image_id",
-            recent_track,
-        )
-
-
 def save_album_listen_date(db: Database, recent_track):
     if recent_track.get("album", None):
-        with db.conn:
+        with transaction(db):
             db.execute(
                 "insert into album_details (id, artist_id, name, artist, discovered, last_listened)"
                 "   values (lower(:album), lower(:artist), :album, :artist, :uts_timestamp, :uts_timestamp)"
@@ -319,12 +886,23 @@ def save_album_listen_date(db: Database, recent_track):
 
 
 def save_similar_artists(db: Database, artist: str, similar_artists):
-    for idx, similar in enumerate(similar_artists):
-        db["similar_artists"].upsert(
-            {
-                "id": artist.lower(),
-                "similar_id": similar["name"].lower(),
-                "position": idx + 1,
-            },
-            pk=["id", "position"]
+    save_all_similar_artists(db, [(artist, similar_artists)])
+
+
+def save_all_similar_artists(db: Database, similar_artists):
+    """Replace the similar artists of every artist in a batch of
+    `(artist, similar_artists)` pairs."""
+    with transaction(db):
+        db.conn.executemany(
+            "delete from similar_artists where id = ?",
+            [(artist.lower(),) for artist, _ in similar_artists],
+        )
+        db.conn.executemany(
+            "insert or replace into similar_artists (id, similar_id, position)"
+            "   values (?, ?, ?)",
+            [
+                (artist.lower(), similar["name"].lower(), position)
+                for artist, similar_list in similar_artists
+                for position, similar in enumerate(similar_list, start=1)
+            ],
         )
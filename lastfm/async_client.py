@@ -0,0 +1,157 @@
+"""Coroutine versions of `fetch_page`, `fetch_pages`, `fetch_artist`,
+`fetch_album` and `fetch_concurrently`, so history sync and enrichment can
+share one event loop. Requires httpx."""
+import asyncio
+from collections import deque
+from itertools import islice
+from time import monotonic
+from typing import NotRequired, TypedDict
+
+import httpx
+
+from lastfm import (
+    api_params,
+    cached_response,
+    parse_album,
+    parse_artist,
+    parse_page,
+    rate_limit_delay,
+    read_response,
+    record_request,
+    retry_delay,
+)
+from lastfm.cache import ResponseCache
+from lastfm.metrics import Metrics
+from lastfm.rate_limit import TokenBucket
+from lastfm.retry import RetryPolicy
+
+
+class AsyncApiClient(TypedDict):
+    base_url: str
+    api_key: str
+    session: httpx.AsyncClient
+    username: str
+    semaphore: asyncio.Semaphore
+    rate_limiter: NotRequired[TokenBucket]
+    retry_policy: NotRequired[RetryPolicy]
+    cache: NotRequired[ResponseCache]
+    metrics: NotRequired[Metrics]
+
+
+def async_api_client(
+    api_key,
+    username,
+    concurrency=4,
+    base_url="https://ws.audioscrobbler.com/2.0",
+) -> AsyncApiClient:
+    """A client making at most `concurrency` requests at a time over a pool
+    of kept-alive connections. Close `session` when done with it."""
+    return {
+        "base_url": base_url,
+        "api_key": api_key,
+        "username": username,
+        "session": httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=concurrency, max_keepalive_connections=concurrency
+            ),
+            timeout=30,
+        ),
+        "semaphore": asyncio.Semaphore(concurrency),
+    }
+
+
+async def fetch_page(client: AsyncApiClient, method, params=None):
+    params = api_params(client, method, params)
+    cached = cached_response(client, method, params)
+    if cached is not None:
+        return cached
+    tries = 0
+    while True:
+        tries += 1
+        await asyncio.sleep(rate_limit_delay(client, method))
+        try:
+            async with client["semaphore"]:
+                started = monotonic()
+                response = await client["session"].get(
+                    client["base_url"], params=params
+                )
+        except httpx.TransportError:
+            delay = retry_delay(client, tries)
+            if delay is None:
+                raise
+        else:
+            record_request(client, started, response)
+            delay = retry_delay(client, tries, response)
+            if delay is None:
+                return read_response(client, method, params, response)
+        await asyncio.sleep(delay)
+
+
+async def fetch_pages(
+    client: AsyncApiClient,
+    method,
+    params=None,
+    concurrency=1,
+    start_page=1,
+):
+    """Yield `(items, metadata)` for every page of `method` from `start_page`
+    onwards, in page order, requesting up to `concurrency` pages ahead."""
+    params = params or {}
+
+    async def fetch(page):
+        page_params = {"page": page, "limit": 200} | params
+        return parse_page(await fetch_page(client, method, page_params))
+
+    data, metadata = await fetch(start_page)
+    yield data, metadata
+    pages = iter(range(start_page + 1, int(metadata.get("totalPages", 0)) + 1))
+    pending = deque(
+        asyncio.ensure_future(fetch(page)) for page in islice(pages, concurrency)
+    )
+    try:
+        while pending:
+            result = await pending.popleft()
+            for page in islice(pages, 1):
+                pending.append(asyncio.ensure_future(fetch(page)))
+            yield result
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def fetch_artist(client: AsyncApiClient, name, params=None):
+    params = params or {}
+    response = await fetch_page(
+        client, "artist.getinfo", params={"artist": name, "autocorrect": "0"} | params
+    )
+    return parse_artist(response)
+
+
+async def fetch_album(client: AsyncApiClient, name: str, artist: str):
+    response = await fetch_page(
+        client,
+        "album.getinfo",
+        params={"album": name, "artist": artist, "autocorrect": 0},
+    )
+    return parse_album(response)
+
+
+async def fetch_concurrently(fetch, items, concurrency=1):
+    """Yield `(item, await fetch(item))` for each of `items` as the results
+    arrive, with at most `concurrency` in flight."""
+    items = iter(items)
+    pending = {
+        asyncio.ensure_future(fetch(item)): item
+        for item in islice(items, concurrency)
+    }
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                item = pending.pop(task)
+                for following in islice(items, 1):
+                    pending[asyncio.ensure_future(fetch(following))] = following
+                yield item, task.result()
+    finally:
+        for task in pending:
+            task.cancel()
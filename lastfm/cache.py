@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from time import time
+
+from sqlite_utils import Database
+
+DAY = 24 * 60 * 60
+
+# Seconds a cached response stays fresh. Methods not listed are never cached,
+# so scrobble and love history is always fetched live.
+DEFAULT_TTLS = {
+    "artist.getinfo": 30 * DAY,
+    "album.getinfo": 90 * DAY,
+}
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+class ResponseCache:
+    """Local cache of API responses, stored compressed in a SQLite database
+    inside `path` and keyed by method and parameters.
+
+    Responses expire after the TTL for their method. Once the cache grows
+    beyond `max_size` bytes the least recently used responses are evicted."""
+
+    def __init__(self, path, ttls=None, max_size=DEFAULT_MAX_SIZE):
+        os.makedirs(path, exist_ok=True)
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # Shared by the enrichment worker threads, serialised by `lock`
+        self.db = Database(
+            sqlite3.connect(
+                os.path.join(path, "responses.db"), check_same_thread=False
+            )
+        )
+        self.db["responses"].create(
+            {
+                "key": str,
+                "method": str,
+                "body": bytes,
+                "size": int,
+                "created": float,
+                "accessed": float,
+            },
+            pk="key",
+            if_not_exists=True,
+        )
+        self.db["responses"].create_index(["accessed"], if_not_exists=True)
+        # Bytes of responses held, kept up to date so `set` only looks for
+        # responses to evict once the cache is full
+        self.size = self.db.execute(
+            "select ifnull(sum(size), 0) from responses"
+        ).fetchone()[0]
+
+    def get(self, method, params):
+        ttl = self.ttls.get(method)
+        if ttl is None:
+            return None
+        key = cache_key(method, params)
+        with self.lock:
+            row = self.db.execute(
+                "select body, created from responses where key = ?", [key]
+            ).fetchone()
+            if row is None or row[1] + ttl < time():
+                self.misses += 1
+                return None
+            with self.db.conn:
+                self.db.execute(
+                    "update responses set accessed = ? where key = ?", [time(), key]
+                )
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def set(self, method, params, content):
+        if method not in self.ttls or "error" in content:
+            return
+        body = zlib.compress(json.dumps(content).encode("utf-8"))
+        now = time()
+        key = cache_key(method, params)
+        with self.lock, self.db.conn:
+            replaced = self.db.execute(
+                "select size from responses where key = ?", [key]
+            ).fetchone()
+            self.db.execute(
+                "insert or replace into responses"
+                "       (key, method, body, size, created, accessed)"
+                "   values (?, ?, ?, ?, ?, ?)",
+                [key, method, body, len(body), now, now],
+            )
+            self.size += len(body) - (replaced[0] if replaced else 0)
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        """Delete the least recently used responses until the cache fits in
+        `max_size` again."""
+        evicted = []
+        for key, size in self.db.execute(
+            "select key, size from responses order by accessed"
+        ):
+            if self.size <= self.max_size:
+                break
+            evicted.append(key)
+            self.size -= size
+        self.db.execute(
+            "delete from responses where key in (select value from json_each(?))",
+            [json.dumps(evicted)],
+        )
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def cache_key(method, params):
+    # The API key doesn't change the response, so rotating it keeps the cache
+    params = {k: str(v) for k, v in params.items() if k != "api_key"}
+    key = json.dumps([method, params], sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
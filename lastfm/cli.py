@@ -2,29 +2,83 @@
 import click
 import requests
 import datetime
-from itertools import chain
+import json
+from contextlib import nullcontext
+from itertools import chain, islice
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from sqlite_utils import Database
 from lastfm import (
     DATE_FORMAT,
     LastFM,
+    clear_sync_state,
+    convert_to_timestamp,
     fetch_album,
     fetch_albums_to_update,
     fetch_artist,
     fetch_artists_to_update,
+    fetch_concurrently,
+    fetch_last_timestamp,
     fetch_loved_tracks,
-    process_tracks_response,
-    save_album_details,
-    save_artist_details,
-    save_artist_tags,
+    fetch_sync_state,
+    fetch_timezone,
+    process_scrobbles,
+    save_albums,
+    save_artists,
     save_love,
-    save_recent_track,
-    save_similar_artists,
+    save_recent_tracks,
+    save_sync_state,
+    save_timezone,
+    transaction,
 )
-from lastfm.db_setup import create_indexes, create_all_tables
+from lastfm.cache import ResponseCache
+from lastfm.db_setup import (
+    INDEX_PROFILES,
+    bulk_load,
+    create_all_tables,
+    create_indexes,
+    fetch_index_profile,
+    index_sizes,
+    rollup_table,
+)
+from lastfm.metrics import Metrics
+from lastfm.rate_limit import TokenBucket
+from lastfm.reports import analyze_reports
+from lastfm.rollups import rebuild_artist_gaps, rebuild_rollups
 
 
 formats = [DATE_FORMAT]
 
+RECENT_TRACKS = "user.getrecenttracks"
+
+ENRICHMENT_BATCH_SIZE = 50
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def parse_rate_weights(ctx, param, value):
+    weights = {}
+    for weight in value:
+        method, _, cost = weight.partition("=")
+        try:
+            weights[method] = float(cost)
+        except ValueError:
+            raise click.BadParameter(f"expected METHOD=COST, got {weight!r}")
+    return weights
+
+
+def validate_timezone(ctx, param, timezone):
+    if timezone is None:
+        return None
+    try:
+        ZoneInfo(timezone)
+    except (ValueError, ZoneInfoNotFoundError):
+        raise click.BadParameter(f"unknown time zone {timezone!r}")
+    return timezone
+
 
 @click.group()
 @click.version_option()
@@ -42,69 +96,320 @@ def cli():
 @click.option("--user", type=click.STRING, required=True)
 @click.option("--start_date", type=click.DateTime(formats))
 @click.option("--end_date", type=click.DateTime(formats))
-def export_playlist(api, database, user, start_date=None, end_date=None):
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of API requests to make at the same time",
+)
+@click.option(
+    "--rate_limit",
+    type=click.FloatRange(min=0, min_open=True),
+    default=5,
+    show_default=True,
+    help="Maximum API requests per second",
+)
+@click.option(
+    "--burst",
+    type=click.FloatRange(min=1),
+    default=1,
+    show_default=True,
+    help="Requests allowed in a burst after a quiet period",
+)
+@click.option(
+    "--rate_weight",
+    type=click.STRING,
+    multiple=True,
+    callback=parse_rate_weights,
+    help="Rate limit cost of an API method, as METHOD=COST. Can be repeated",
+)
+@click.option(
+    "--limit",
+    type=click.IntRange(min=0),
+    default=1000,
+    show_default=True,
+    help="Maximum number of artists and albums to refresh. 0 skips refreshing",
+)
+@click.option(
+    "--cache_dir",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="Directory to cache artist and album details in between runs",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Only fetch scrobbles and loves newer than those already saved",
+)
+@click.option(
+    "--normalized",
+    is_flag=True,
+    help="Store scrobbles as integer keys into artist, track and album tables",
+)
+@click.option(
+    "--metrics_file",
+    type=click.Path(file_okay=True, dir_okay=False),
+    help="File to keep up to date with request and database metrics as JSON",
+)
+@click.option(
+    "--bulk",
+    is_flag=True,
+    help="Tune SQLite for a large import, building indexes once it's loaded",
+)
+@click.option(
+    "--timezone",
+    type=click.STRING,
+    callback=validate_timezone,
+    help="Time zone to group scrobbles by local time in, such as Europe/London."
+    " Defaults to the last one used, or UTC",
+)
+@click.option(
+    "--indexes",
+    type=click.Choice(INDEX_PROFILES),
+    help="Indexes to build. covering speeds up the reports at the cost of a"
+    " larger database and slower imports. Defaults to the last one used",
+)
+def export_playlist(
+    api,
+    database,
+    user,
+    start_date=None,
+    end_date=None,
+    concurrency=4,
+    rate_limit=5,
+    burst=1,
+    rate_weight=None,
+    limit=1000,
+    cache_dir=None,
+    incremental=False,
+    normalized=False,
+    metrics_file=None,
+    bulk=False,
+    timezone=None,
+    indexes=None,
+):
     """
     Export user's lastfm playlist
     """
     if not isinstance(database, Database):
         database = Database(database)
 
-    create_all_tables(database)
-    create_indexes(database)
+    # Older databases need their rollups and artist gaps filling in once
+    missing_rollups = not database[rollup_table("artist", "daily")].exists()
+    missing_gaps = not database["artist_gaps"].exists()
+    create_all_tables(database, normalized)
+    # Loading a first import without indexes then building them in one pass
+    # is much faster than maintaining them row by row
+    defer_indexes = bulk or fetch_last_timestamp(database) is None
+    if not defer_indexes:
+        create_indexes(database, indexes)
+    if missing_rollups and database["playlist"].count:
+        rebuild_rollups(database)
+    if missing_gaps and database["playlist"].count:
+        rebuild_artist_gaps(database)
+    save_timezone(database, timezone or fetch_timezone(database))
 
     client: ApiClient = {
         "base_url": "https://ws.audioscrobbler.com/2.0",
         "api_key": api,
         "username": user,
         "session": requests.Session(),
+        "rate_limiter": TokenBucket(rate_limit, burst=burst, weights=rate_weight),
+        "metrics": Metrics(metrics_file),
     }
+    metrics = client["metrics"]
+    if cache_dir:
+        client["cache"] = ResponseCache(cache_dir)
 
-    api = LastFM(client=client, start_date=start_date, end_date=end_date)
+    start_timestamp = convert_to_timestamp(start_date)
+    end_timestamp = convert_to_timestamp(end_date)
+    first_page = 1
+    sync_state = fetch_sync_state(database, RECENT_TRACKS)
+    if (
+        sync_state
+        and start_timestamp in (None, sync_state["from_timestamp"])
+        and end_timestamp in (None, sync_state["to_timestamp"])
+    ):
+        start_timestamp = sync_state["from_timestamp"]
+        end_timestamp = sync_state["to_timestamp"]
+        first_page = sync_state["page"] + 1
+    else:
+        if incremental:
+            latest_scrobble = fetch_last_timestamp(database, "playlist")
+            if latest_scrobble and (
+                start_timestamp is None or start_timestamp < latest_scrobble
+            ):
+                start_timestamp = latest_scrobble
+        # Pin the end of the window so page numbers stay stable if the
+        # import is interrupted and resumed later
+        end_timestamp = end_timestamp or int(datetime.datetime.now().timestamp())
 
-    data = api.fetch_recent_tracks()
-    with click.progressbar(length=0, label="Fetching recent tracks") as bar:
-        for _, (page, metadata) in enumerate(data):
-            bar.length = int(metadata["total"])
-            for track in process_tracks_response(page):
-                save_recent_track(database, track)
-                bar.update(1)
+    loves_since = fetch_last_timestamp(database, "loves") if incremental else None
+
+    api = LastFM(
+        client=client,
+        start_date=start_timestamp,
+        end_date=end_timestamp,
+        concurrency=concurrency,
+    )
+
+    with bulk_load(database) if bulk else nullcontext():
+        data = api.fetch_recent_tracks(start_page=first_page)
+        with metrics.phase("recent_tracks"), click.progressbar(
+            length=0, label="Fetching recent tracks"
+        ) as bar:
+            for page_number, (page, metadata) in enumerate(data, start=first_page):
+                bar.length = int(metadata["total"])
+                tracks = list(process_scrobbles(page))
+                with metrics.writing(len(tracks)), transaction(database):
+                    save_sync_state(
+                        database,
+                        {
+                            "method": RECENT_TRACKS,
+                            "from_timestamp": start_timestamp,
+                            "to_timestamp": end_timestamp,
+                            "page": page_number,
+                            "total_pages": int(metadata.get("totalPages", 0)),
+                        },
+                    )
+                    save_recent_tracks(database, tracks)
+                bar.update(len(tracks))
+        clear_sync_state(database, RECENT_TRACKS)
+        if defer_indexes:
+            with metrics.phase("indexes"):
+                create_indexes(database, indexes)
 
-    loves = fetch_loved_tracks(client)
-    with click.progressbar(length=0, label="Fetching loves") as bar:
+    loves = fetch_loved_tracks(client, concurrency=concurrency, since=loves_since)
+    with metrics.phase("loves"), click.progressbar(
+        length=0, label="Fetching loves"
+    ) as bar:
         for _, (love, metadata) in enumerate(loves):
             bar.length = int(metadata["total"])
-            save_love(database, love)
+            with metrics.writing(1):
+                save_love(database, love)
             bar.update(1)
 
-    artists = fetch_artists_to_update(database, limit=1000)
-    with click.progressbar(length=1000, label="Fetching artists") as bar:
-        for _, artist in enumerate(artists):
-            artist_details = fetch_artist(api.client, artist["name"])
-            save_artist_details(
-                database,
-                artist_details,
-                timestamp=int(datetime.datetime.now().timestamp()),
-            )
-            save_artist_tags(
-                database, artist["name"],
-                artist_details["tags"]
-            )
-            save_similar_artists(
-                database, artist["name"],
-                artist_details["similar"]
-            )
-            bar.update(1)
+    artists = list(fetch_artists_to_update(database, limit=limit))
+    artists_changed = 0
+    with metrics.phase("artists"), click.progressbar(
+        length=len(artists), label="Fetching artists"
+    ) as bar:
+        fetched = fetch_concurrently(
+            lambda artist: fetch_artist(api.client, artist["name"]),
+            artists,
+            concurrency=concurrency,
+        )
+        for batch in batched(fetched, ENRICHMENT_BATCH_SIZE):
+            with metrics.writing(len(batch)):
+                artists_changed += save_artists(
+                    database,
+                    [
+                        (artist["name"], artist_details)
+                        for artist, artist_details in batch
+                    ],
+                    timestamp=int(datetime.datetime.now().timestamp()),
+                )
+            bar.update(len(batch))
 
-    albums = fetch_albums_to_update(database, limit=1000)
-    with click.progressbar(length=1000, label="Fetching albums") as bar:
-        for _, album in enumerate(albums):
-            album_details = fetch_album(api.client, album["name"], album["artist"])
-            save_album_details(
-                database,
-                album_details,
-                timestamp=int(datetime.datetime.now().timestamp()),
-            )
-            bar.update(1)
+    albums = list(fetch_albums_to_update(database, limit=limit))
+    albums_changed = 0
+    with metrics.phase("albums"), click.progressbar(
+        length=len(albums), label="Fetching albums"
+    ) as bar:
+        fetched = fetch_concurrently(
+            lambda album: fetch_album(api.client, album["name"], album["artist"]),
+            albums,
+            concurrency=concurrency,
+        )
+        for batch in batched(fetched, ENRICHMENT_BATCH_SIZE):
+            with metrics.writing(len(batch)):
+                albums_changed += save_albums(
+                    database,
+                    [album_details for _, album_details in batch],
+                    timestamp=int(datetime.datetime.now().timestamp()),
+                )
+            bar.update(len(batch))
+
+    click.echo(f"Artists: {artists_changed} of {len(artists)} changed")
+    click.echo(f"Albums: {albums_changed} of {len(albums)} changed")
+    for method, stats in client["rate_limiter"].stats().items():
+        click.echo(
+            f"{method}: {stats['requests']} requests, "
+            f"waited {stats['waited']:.1f}s for the rate limit"
+        )
+    if cache_dir:
+        stats = client["cache"].stats()
+        click.echo(f"Cache: {stats['hits']} hits, {stats['misses']} misses")
+    metrics.save()
+    click.echo(json.dumps(metrics.summary(), indent=2))
+
+
+@cli.command("rebuild-rollups")
+@click.argument(
+    "database",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, allow_dash=False),
+    required=True,
+)
+def rebuild_rollups_command(database):
+    """
+    Recalculate the daily and monthly listen rollups and the gaps between
+    listens of each artist from the playlist
+    """
+    database = Database(database)
+    create_all_tables(database)
+    rebuild_rollups(database)
+    rebuild_artist_gaps(database)
+
+
+@cli.command("analyze-indexes")
+@click.argument(
+    "database",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, allow_dash=False),
+    required=True,
+)
+@click.option(
+    "--year",
+    type=click.IntRange(min=1970),
+    help="Year to run the reports over. Defaults to that of the latest scrobble",
+)
+@click.option(
+    "--indexes",
+    type=click.Choice(INDEX_PROFILES),
+    help="Switch to these indexes before analyzing",
+)
+@click.option(
+    "--repeat",
+    type=click.IntRange(min=1),
+    default=3,
+    show_default=True,
+    help="Times to run each report, keeping the fastest",
+)
+def analyze_indexes_command(database, year=None, indexes=None, repeat=3):
+    """
+    Show the query plan and timing of each report, and the size of each index
+    """
+    database = Database(database)
+    create_all_tables(database)
+    if indexes:
+        create_indexes(database, indexes)
+    if year is None:
+        latest = fetch_last_timestamp(database) or datetime.datetime.now().timestamp()
+        year = datetime.datetime.fromtimestamp(latest, datetime.timezone.utc).year
+    start = int(datetime.datetime(year, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+    end = int(
+        datetime.datetime(year + 1, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+    )
+    for name, analysis in analyze_reports(database, start, end, repeat).items():
+        click.echo(f"{name}: {analysis['seconds'] * 1000:.1f}ms")
+        for step in analysis["plan"]:
+            click.echo(f"  {step}")
+    click.echo(f"Indexes ({fetch_index_profile(database)}):")
+    sizes = index_sizes(database)
+    for table, name, size in sizes:
+        size = "unknown size" if size is None else f"{size / 1024:.0f}KB"
+        click.echo(f"  {table}.{name}: {size}")
+    if all(size is not None for _, _, size in sizes):
+        click.echo(f"Total: {sum(size for _, _, size in sizes) / 1024:.0f}KB")
 
 
 if __name__ == "__main__":
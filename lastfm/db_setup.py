@@ -1,15 +1,162 @@
+import sqlite3
+from contextlib import contextmanager
 from typing import no_type_check
 from sqlite_utils import Database
 
+# Settings for large imports, trading durability of the last few commits on
+# power loss for far fewer fsyncs. WAL keeps the database consistent.
+BULK_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -256 * 1024,
+    "mmap_size": 1024 * 1024 * 1024,
+    "temp_store": "memory",
+}
 
-def create_indexes(db: Database):
-    db["playlist"].create_index(["artist"], if_not_exists=True)
-    db["playlist"].create_index(["artist", "song"], if_not_exists=True)
-    db["playlist"].create_index(["artist", "album"], if_not_exists=True)
-    db["playlist"].create_index(["uts_timestamp"], if_not_exists=True)
 
+# Scrobble times in the local time zone, to group reports by
+LOCAL_TIME_COLUMNS = ("local_year", "local_month", "local_day", "local_hour")
 
-def create_scrobbles_table(db: Database):
+# Tags left out of the monthly tags report until the stoplist is edited
+DEFAULT_TAG_STOPLIST = (
+    "seen live",
+    "indie",
+    "rock",
+    "pop",
+    "post rock",
+    "electronic",
+    "indie rock",
+)
+
+
+def add_missing_column(db: Database, table, column, column_type, default=None):
+    """Bring tables created by older versions up to date."""
+    if column not in db[table].columns_dict:
+        db[table].add_column(column, column_type, not_null_default=default)
+
+
+@contextmanager
+def bulk_load(db: Database):
+    """Apply `BULK_PRAGMAS` while importing, then update the query planner's
+    statistics and put the previous settings back."""
+    previous = {
+        name: db.execute(f"pragma {name}").fetchone()[0] for name in BULK_PRAGMAS
+    }
+    for name, value in BULK_PRAGMAS.items():
+        db.execute(f"pragma {name} = {value}")
+    try:
+        yield
+        db.execute("analyze")
+        db.execute("pragma optimize")
+    finally:
+        for name, value in previous.items():
+            db.execute(f"pragma {name} = {value}")
+
+
+def add_generated_column(db: Database, table, column, expression):
+    """Add a virtual column calculated from `expression`, so it can be
+    indexed and joined on like any other column."""
+    columns = [row[1] for row in db.execute(f"pragma table_xinfo([{table}])")]
+    if column not in columns:
+        db.execute(
+            f"alter table [{table}] add column [{column}] text"
+            f"   generated always as ({expression}) virtual"
+        )
+
+
+# Index sets `create_indexes` can build. "covering" adds an index holding
+# every column the reports read from the rollups and details tables, so
+# their range scans and joins never look rows up in the table itself, at the
+# cost of a larger database and slower imports
+INDEX_PROFILES = ("default", "covering")
+DEFAULT_INDEX_PROFILE = "default"
+
+COVERING_INDEXES = {
+    "artist_details": ("id", "name", "image_id"),
+    "artist_history": ("id", "discovered"),
+    "album_details": ("artist", "name", "image_id", "discovered"),
+    "track_details": ("name", "artist", "image_id", "discovered"),
+    "artist_tags": ("id", "name", "weight"),
+}
+
+
+def covering_indexes():
+    """`(table, columns)` of each index in the covering profile."""
+    for entity, keys in ROLLUPS.items():
+        for period in ROLLUP_PERIODS:
+            yield rollup_table(entity, period), ("period", *keys, "listens")
+    yield from COVERING_INDEXES.items()
+
+
+def fetch_index_profile(db: Database):
+    if not db["_settings"].exists():
+        return DEFAULT_INDEX_PROFILE
+    row = db.execute("select value from _settings where name = 'indexes'").fetchone()
+    return row[0] if row else DEFAULT_INDEX_PROFILE
+
+
+def create_indexes(db: Database, profile=None):
+    """Create the indexes the report queries rely on, and those of the
+    `profile` index set - by default the last one used - dropping the
+    covering indexes if it doesn't want them. Safe to run again to bring
+    older databases up to date."""
+    profile = profile or fetch_index_profile(db)
+    if db["album_details"].exists():
+        db["album_details"].create_index(["artist", "name"], if_not_exists=True)
+    if is_normalized(db):
+        db["scrobbles"].create_index(["track_id"], if_not_exists=True)
+        db["scrobbles"].create_index(["album_id"], if_not_exists=True)
+        db["scrobbles"].create_index(LOCAL_TIME_COLUMNS, if_not_exists=True)
+        db["artists"].create_index(["lower_name"], if_not_exists=True)
+    else:
+        db["playlist"].create_index(["artist"], if_not_exists=True)
+        db["playlist"].create_index(["artist", "song"], if_not_exists=True)
+        db["playlist"].create_index(["artist", "album"], if_not_exists=True)
+        db["playlist"].create_index(["uts_timestamp"], if_not_exists=True)
+        db["playlist"].create_index(["artist_id"], if_not_exists=True)
+        db["playlist"].create_index(LOCAL_TIME_COLUMNS, if_not_exists=True)
+        # Covers the monthly tags report
+        db["playlist"].create_index(
+            ["local_year", "local_month", "artist_id"], if_not_exists=True
+        )
+    for table, columns in covering_indexes():
+        if not db[table].exists():
+            continue
+        name = f"idx_{table}_{'_'.join(columns)}"
+        exists = name in (index.name for index in db[table].indexes)
+        if profile == "covering" and not exists:
+            db[table].create_index(columns, index_name=name)
+            # Without statistics the planner prefers the primary key to an
+            # index that starts with it
+            db.execute(f"analyze [{table}]")
+        elif profile != "covering":
+            db.execute(f"drop index if exists [{name}]")
+    if db["_settings"].exists():
+        db["_settings"].upsert({"name": "indexes", "value": profile}, pk="name")
+
+
+def index_sizes(db: Database):
+    """`(table, index, bytes)` of every index, with bytes None when SQLite
+    is built without the dbstat table to measure them with."""
+    try:
+        sizes = dict(
+            db.execute("select name, sum(pgsize) from dbstat group by name").fetchall()
+        )
+    except sqlite3.OperationalError:
+        sizes = {}
+    return [
+        (table, name, sizes.get(name))
+        for table, name in db.execute(
+            "select tbl_name, name from sqlite_master where type = 'index'"
+            "   order by tbl_name, name"
+        )
+    ]
+
+
+def create_scrobbles_table(db: Database, normalized=False):
+    if normalized or is_normalized(db):
+        create_normalized_tables(db)
+        return
     db["playlist"].create(
         {
             "artist": str,
@@ -21,6 +168,120 @@ def create_scrobbles_table(db: Database):
         pk="uts_timestamp",
         if_not_exists=True,
     )
+    # The artist_details key, for the reports to join on
+    add_generated_column(db, "playlist", "artist_id", "lower(artist)")
+    for column in LOCAL_TIME_COLUMNS:
+        add_missing_column(db, "playlist", column, int)
+
+
+# Integer keyed tables behind the normalized schema, with the columns
+# identifying each row
+DIMENSIONS = {
+    "artists": ("name",),
+    "tracks": ("artist_id", "name"),
+    "albums": ("artist_id", "name"),
+}
+
+# `playlist` rebuilt from the normalized tables, with the Last.fm formatted
+# datetime derived from the timestamp
+PLAYLIST_VIEW = """
+    select
+      ar.name as artist, t.name as song, ifnull(al.name, '') as album,
+      s.uts_timestamp,
+      strftime('%d ', s.uts_timestamp, 'unixepoch')
+        || substr('JanFebMarAprMayJunJulAugSepOctNovDec',
+                  strftime('%m', s.uts_timestamp, 'unixepoch') * 3 - 2, 3)
+        || strftime(' %Y, %H:%M', s.uts_timestamp, 'unixepoch') as datetime,
+      ar.lower_name as artist_id,
+      s.local_year, s.local_month, s.local_day, s.local_hour
+    from
+      scrobbles as s
+    join
+      tracks as t on t.id = s.track_id
+    join
+      artists as ar on ar.id = t.artist_id
+    left join
+      albums as al on al.id = s.album_id
+"""
+
+
+def is_normalized(db: Database):
+    return db["scrobbles"].exists()
+
+
+def create_normalized_tables(db: Database):
+    """Store scrobbles as integer keys into artist, track and album tables,
+    with `playlist` as a view over them. An existing `playlist` table is
+    converted."""
+    db["artists"].create(
+        {"id": int, "name": str}, pk="id", not_null={"name"}, if_not_exists=True
+    )
+    add_generated_column(db, "artists", "lower_name", "lower(name)")
+    for table in ("tracks", "albums"):
+        db[table].create(
+            {"id": int, "artist_id": int, "name": str},
+            pk="id",
+            not_null={"artist_id", "name"},
+            foreign_keys=[("artist_id", "artists", "id")],
+            if_not_exists=True,
+        )
+    for table, columns in DIMENSIONS.items():
+        db[table].create_index(columns, unique=True, if_not_exists=True)
+    db["scrobbles"].create(
+        {"uts_timestamp": int, "track_id": int, "album_id": int},
+        pk="uts_timestamp",
+        not_null={"track_id"},
+        foreign_keys=[("track_id", "tracks", "id"), ("album_id", "albums", "id")],
+        if_not_exists=True,
+    )
+    for column in LOCAL_TIME_COLUMNS:
+        add_missing_column(db, "scrobbles", column, int)
+    if "playlist" in db.table_names():
+        normalize_playlist(db)
+    if "local_year" not in db["playlist"].columns_dict:
+        db.create_view("playlist", PLAYLIST_VIEW, replace=True)
+
+
+def normalize_playlist(db: Database):
+    """Move the rows of a text keyed `playlist` table into the normalized
+    tables and drop it."""
+    from lastfm import transaction
+
+    with transaction(db):
+        db.execute(
+            "insert or ignore into artists (name)"
+            "   select distinct ifnull(artist, '') from playlist"
+        )
+        db.execute(
+            "insert or ignore into tracks (artist_id, name)"
+            "   select distinct ar.id, ifnull(p.song, '') from playlist as p"
+            "   join artists as ar on ar.name = ifnull(p.artist, '')"
+        )
+        db.execute(
+            "insert or ignore into albums (artist_id, name)"
+            "   select distinct ar.id, p.album from playlist as p"
+            "   join artists as ar on ar.name = ifnull(p.artist, '')"
+            "   where ifnull(p.album, '') != ''"
+        )
+        local_time = ", ".join(LOCAL_TIME_COLUMNS)
+        db.execute(
+            "insert or replace into scrobbles"
+            f"       (uts_timestamp, track_id, album_id, {local_time})"
+            "   select p.uts_timestamp, t.id, al.id,"
+            "       p.local_year, p.local_month, p.local_day, p.local_hour"
+            "   from playlist as p"
+            "   join artists as ar on ar.name = ifnull(p.artist, '')"
+            "   join tracks as t on t.artist_id = ar.id and t.name = ifnull(p.song, '')"
+            "   left join albums as al on al.artist_id = ar.id and al.name = p.album"
+        )
+        # Dropping the table below can't be undone, so never lose a scrobble
+        (scrobbles,) = db.execute("select count(*) from scrobbles").fetchone()
+        (playlist,) = db.execute("select count(*) from playlist").fetchone()
+        if scrobbles != playlist:
+            raise sqlite3.IntegrityError(
+                f"converted {scrobbles} of {playlist} scrobbles, keeping playlist"
+            )
+        db.execute("drop table playlist")
 
 
 def create_loves_table(db: Database):
@@ -41,12 +302,14 @@ def create_artist_table(db: Database):
             "wiki": int,
             "summary": int,
             "last_updated": int,
+            "content_hash": str,
         },
         pk="id",
         not_null={"last_updated"},
         defaults={"last_updated": 0},
         if_not_exists=True,
     )
+    add_missing_column(db, "artist_details", "content_hash", str)
 
 
 def create_artist_history_table(db: Database):
@@ -68,10 +331,27 @@ def create_artist_tags_table(db: Database):
             "id": str,
             "name": str,
             "url": str,
+            "weight": int,
         },
         pk=["id", "name"],
+        not_null={"weight"},
+        defaults={"weight": 100},
         if_not_exists=True,
     )
+    add_missing_column(db, "artist_tags", "weight", int, default=100)
+
+
+def create_tag_stoplist_table(db: Database):
+    if not db["tag_stoplist"].exists():
+        db["tag_stoplist"].insert_all(
+            [{"name": tag} for tag in DEFAULT_TAG_STOPLIST], pk="name"
+        )
+
+
+def create_settings_table(db: Database):
+    db["_settings"].create(
+        {"name": str, "value": str}, pk="name", if_not_exists=True
+    )
 
 
 def create_track_table(db: Database):
@@ -103,12 +383,14 @@ def create_album_table(db: Database):
             "discovered": int,
             "last_listened": int,
             "last_updated": int,
+            "content_hash": str,
         },
         pk=["id", "artist_id"],
         not_null={"last_updated"},
         defaults={"last_updated": 0},
         if_not_exists=True,
     )
+    add_missing_column(db, "album_details", "content_hash", str)
 
 
 def create_similar_artists_table(db: Database):
@@ -123,12 +405,70 @@ def create_similar_artists_table(db: Database):
     )
 
 
-def create_all_tables(db: Database):
-    create_scrobbles_table(db)
+# Listen counts pre-aggregated per day and per month, keyed by the playlist
+# columns identifying each kind of entity
+ROLLUPS = {
+    "artist": ("artist",),
+    "album": ("artist", "album"),
+    "track": ("artist", "song"),
+}
+
+ROLLUP_PERIODS = ("daily", "monthly")
+
+
+def rollup_table(entity, period):
+    return f"{entity}_listens_{period}"
+
+
+def create_rollup_tables(db: Database):
+    for entity, keys in ROLLUPS.items():
+        for period in ROLLUP_PERIODS:
+            db[rollup_table(entity, period)].create(
+                {"period": int} | {key: str for key in keys} | {"listens": int},
+                pk=["period", *keys],
+                if_not_exists=True,
+            )
+
+
+def create_artist_gaps_table(db: Database):
+    db["artist_gaps"].create(
+        {"listen": int, "artist": str, "previous_listen": int},
+        pk="listen",
+        if_not_exists=True,
+    )
+    db["artist_gaps"].create_index(["artist", "listen"], if_not_exists=True)
+    db["artist_spans"].create(
+        {"artist": str, "first_listen": int, "last_listen": int},
+        pk="artist",
+        if_not_exists=True,
+    )
+
+
+def create_sync_state_table(db: Database):
+    db["_sync_state"].create(
+        {
+            "method": str,
+            "from_timestamp": int,
+            "to_timestamp": int,
+            "page": int,
+            "total_pages": int,
+        },
+        pk="method",
+        if_not_exists=True,
+    )
+
+
+def create_all_tables(db: Database, normalized=False):
+    create_scrobbles_table(db, normalized)
     create_loves_table(db)
     create_artist_table(db)
     create_artist_history_table(db)
     create_track_table(db)
     create_album_table(db)
     create_artist_tags_table(db)
+    create_tag_stoplist_table(db)
     create_similar_artists_table(db)
+    create_sync_state_table(db)
+    create_settings_table(db)
+    create_rollup_tables(db)
+    create_artist_gaps_table(db)
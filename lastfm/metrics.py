@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import monotonic
+
+# Upper bounds, in seconds, of the HTTP latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def empty_phase():
+    return {
+        "seconds": 0.0,
+        "requests": 0,
+        "bytes_downloaded": 0,
+        "retries": 0,
+        "cache_hits": 0,
+        "rate_limit_wait": 0.0,
+        "http_seconds": 0.0,
+        "http_latency": [0] * (len(LATENCY_BUCKETS) + 1),
+        "db_seconds": 0.0,
+        "rows_written": 0,
+    }
+
+
+def bucket_label(index):
+    if index == len(LATENCY_BUCKETS):
+        return f">{LATENCY_BUCKETS[-1] * 1000:g}ms"
+    return f"<={LATENCY_BUCKETS[index] * 1000:g}ms"
+
+
+class Metrics:
+    """Counts requests, bytes, retries and HTTP latency along with time
+    spent writing to the database, per phase of an export, so a slow run
+    can be pinned on the network, the rate limit or SQLite.
+
+    Safe to share between threads. When given a `path` the summary is
+    rewritten there at most every `interval` seconds while running."""
+
+    def __init__(self, path=None, interval=5):
+        self.path = path
+        self.interval = interval
+        self.phases = {}
+        self.current = None
+        self.saved = 0
+        self.lock = threading.RLock()
+        self.save_lock = threading.Lock()
+
+    def _phase(self):
+        return self.phases.setdefault(self.current or "other", empty_phase())
+
+    @contextmanager
+    def phase(self, name):
+        with self.lock:
+            self.current = name
+            self._phase()
+        started = monotonic()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name]["seconds"] += monotonic() - started
+                self.current = None
+            self.save()
+
+    def record_request(self, seconds, size):
+        with self.lock:
+            phase = self._phase()
+            phase["requests"] += 1
+            phase["bytes_downloaded"] += size
+            phase["http_seconds"] += seconds
+            phase["http_latency"][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.save_periodically()
+
+    def record_retry(self):
+        with self.lock:
+            self._phase()["retries"] += 1
+
+    def record_cache_hit(self):
+        with self.lock:
+            self._phase()["cache_hits"] += 1
+
+    def record_rate_limit_wait(self, seconds):
+        with self.lock:
+            self._phase()["rate_limit_wait"] += seconds
+
+    @contextmanager
+    def writing(self, rows):
+        """Time a database write of `rows` rows."""
+        started = monotonic()
+        yield
+        with self.lock:
+            phase = self._phase()
+            phase["db_seconds"] += monotonic() - started
+            phase["rows_written"] += rows
+        self.save_periodically()
+
+    def summary(self):
+        with self.lock:
+            phases = {
+                name: phase
+                | {
+                    "http_latency": {
+                        bucket_label(index): count
+                        for index, count in enumerate(phase["http_latency"])
+                    }
+                }
+                for name, phase in self.phases.items()
+            }
+        totals = {
+            key: sum(phase[key] for phase in phases.values())
+            for key in empty_phase()
+            if key != "http_latency"
+        }
+        return {"phases": phases, "total": totals}
+
+    def save(self):
+        """Write the summary to `path`, replacing it in one step so readers
+        never see a partial file."""
+        if self.path:
+            with self.save_lock:
+                self._write()
+
+    def save_periodically(self):
+        if not self.path or monotonic() - self.saved < self.interval:
+            return
+        # Another thread already saving is as good as saving now
+        if self.save_lock.acquire(blocking=False):
+            try:
+                self._write()
+            finally:
+                self.save_lock.release()
+
+    def _write(self):
+        self.saved = monotonic()
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        os.replace(temporary, self.path)
@@ -0,0 +1,57 @@
+import threading
+from collections import defaultdict
+from time import monotonic, sleep
+
+
+class TokenBucket:
+    """Limit API calls to `rate` tokens per second across every thread
+    sharing the bucket, allowing bursts of up to `burst` tokens after a
+    quiet period.
+
+    Each call costs one token unless `weights` gives its method a different
+    cost. Time spent waiting is counted per method in `waits` and `waited`
+    to help tune the rate for maximum sustained throughput."""
+
+    def __init__(self, rate: float, burst: float = 1, weights=None):
+        self.rate = rate
+        self.burst = burst
+        self.weights = weights or {}
+        self.tokens = burst
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.waits = defaultdict(float)
+
+    def acquire(self, method=None):
+        wait = self.reserve(method)
+        if wait:
+            sleep(wait)
+        return wait
+
+    def reserve(self, method=None):
+        """Take a token for `method`, returning how long to wait before
+        using it. For callers that can't block, such as coroutines."""
+        cost = self.weights.get(method, 1)
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            # Going into debt reserves the next free slot for this caller, so
+            # waiting threads are served in the order they arrived
+            self.tokens -= cost
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.requests[method] += 1
+            self.waits[method] += wait
+        return wait
+
+    @property
+    def waited(self):
+        return sum(self.waits.values())
+
+    def stats(self):
+        return {
+            method: {"requests": self.requests[method], "waited": self.waits[method]}
+            for method in self.requests
+        }
@@ -0,0 +1,220 @@
+"""SQL behind the yearly report pages, kept free of Datasette so it can be
+tested and benchmarked directly against a database."""
+from time import perf_counter
+
+from sqlite_utils import Database
+
+from lastfm.db_setup import ROLLUPS, rollup_table
+from lastfm.rollups import REDISCOVERY_GAP, listen_ranges
+
+
+def listens(entity):
+    """Subquery counting listens of each `entity` in `[:start, :end)` from the
+    rollups, plus the scrobbles either side of the first and last whole day.
+    Takes the parameters from `report_params`."""
+    keys = ", ".join(ROLLUPS[entity])
+    present = " and ".join(f"ifnull({key}, '') != ''" for key in ROLLUPS[entity])
+    monthly = rollup_table(entity, "monthly")
+    daily = rollup_table(entity, "daily")
+    return f"""
+        select {keys}, sum(listens) as listens
+        from (
+          select {keys}, listens from {monthly}
+            where period >= :month_lo and period < :month_hi
+          union all
+          select {keys}, listens from {daily}
+            where period >= :day_lo and period < :month_lo
+          union all
+          select {keys}, listens from {daily}
+            where period >= :month_hi and period < :day_hi
+          union all
+          select {keys}, 1 from playlist
+            where uts_timestamp >= :start and uts_timestamp < :day_lo and {present}
+          union all
+          select {keys}, 1 from playlist
+            where uts_timestamp >= :day_hi and uts_timestamp < :end and {present}
+        )
+        group by {keys}
+    """
+
+
+def report_params(start_timestamp, end_timestamp):
+    return listen_ranges(start_timestamp, end_timestamp)
+
+
+TOP_ARTISTS = f"""
+    select
+      v.name, v.image_id, l.listens, discovered,
+      (discovered >= cast(:start as integer)) as new
+    from
+      ({listens("artist")}) as l
+    join
+      artist_details as v on lower(l.artist) = v.id
+    join
+      artist_history as h on lower(l.artist) = h.id
+    order by
+      listens desc
+    limit 20
+"""
+
+TOP_ALBUMS = f"""
+    select
+      l.artist, l.album as name, image_id, l.listens, discovered,
+      (discovered >= cast(:start as integer)) as new
+    from
+      ({listens("album")}) as l
+    join
+      album_details as v on l.album = v.name
+      and l.artist = v.artist
+    order by
+      listens desc
+    limit 20
+"""
+
+TOP_TRACKS = f"""
+    select
+      l.artist, name, v.image_id, l.listens, discovered,
+      (discovered >= cast(:start as integer)) as new
+    from
+      ({listens("track")}) as l
+    join
+      track_details as v on l.song = v.name
+                              and l.artist = v.artist
+    order by
+      listens desc
+    limit 20
+"""
+
+BLAST_ARTISTS = f"""
+    select
+      *, (first_listen_this_period - previous_listen) as since,
+         (first_listen_this_period - previous_listen) / 60/60/24/365 as years
+    from (
+      select
+        v.name, v.image_id,
+        (
+          select count(1) from playlist
+          where artist = g.artist and uts_timestamp < :start
+        ) as past_listens,
+        g.previous_listen,
+        (
+          select count(1) from playlist
+          where artist = g.artist and uts_timestamp >= :start
+            and uts_timestamp < :end
+        ) as current_listens,
+        g.listen as first_listen_this_period
+      from
+        artist_gaps as g
+      join
+        artist_details as v on v.id = lower(g.artist)
+      where
+        g.listen >= :start and g.listen < :end and
+        g.previous_listen < :start
+    )
+    where
+      since >= {REDISCOVERY_GAP}
+      and past_listens > 5
+      and current_listens > 5
+    order by
+      (current_listens * years * years) desc
+    limit 20
+"""
+
+LOVES = """
+    select
+      p.artist, t.image_id, p.song as name, count(1) as listens
+    from
+      playlist as p
+    join
+      loves as l on l.artist = p.artist and l.song = p.song 
+    join
+      track_details as t on t.artist = p.artist and t.name = l.song
+    where
+      l.uts_timestamp >= :start and l.uts_timestamp < :end and
+      p.uts_timestamp >= :start and p.uts_timestamp < :end
+    group by
+      p.artist, p.song
+    order by
+      listens desc
+    limit 20
+"""
+
+MOST_LOVED = """
+    select
+      l.artist as name, count(1) as loves
+    from
+      loves as l
+    where
+      l.uts_timestamp >= :start and l.uts_timestamp < :end
+    group by
+      l.artist
+    order by
+      loves desc
+    limit 1
+"""
+
+# Top tags of each local month of the period, weighting every listen by how
+# strongly each tag applies to the artist. The local years of the period's
+# first and last scrobbles bound the scan of the local time index
+MONTHLY_TAGS = """
+    select * from (select *, row_number() over (Partition by year, month order by freq desc) as rownum from (
+      select
+      t.name as tag, l.local_year as year, printf('%02d', l.local_month) as month,
+      sum(l.listens * t.weight) / 100.0 as freq
+    from
+      (
+        select artist_id, local_year, local_month, count(1) as listens
+        from playlist
+        where
+          local_year between (
+            select local_year from playlist
+            where uts_timestamp >= :start order by uts_timestamp limit 1
+          ) and (
+            select local_year from playlist
+            where uts_timestamp < :end order by uts_timestamp desc limit 1
+          ) and
+          uts_timestamp >= :start and uts_timestamp < :end
+        group by local_year, local_month, artist_id
+      ) as l
+      join artist_tags as t on t.id = l.artist_id
+    where
+      t.name not in (select name from tag_stoplist)
+    group by
+      t.name, l.local_year, l.local_month
+    order by
+      freq desc
+      )) where rownum <= 5
+"""
+
+
+REPORTS = {
+    "top_artists": TOP_ARTISTS,
+    "top_albums": TOP_ALBUMS,
+    "top_tracks": TOP_TRACKS,
+    "blast_artists": BLAST_ARTISTS,
+    "loves": LOVES,
+    "most_loved": MOST_LOVED,
+    "monthly_tags": MONTHLY_TAGS,
+}
+
+
+def query_plan(db: Database, sql, params):
+    return [row[3] for row in db.execute("explain query plan " + sql, params)]
+
+
+def analyze_reports(db: Database, start_timestamp, end_timestamp, repeat=3):
+    """The query plan of each report over `[start, end)`, and the fastest of
+    `repeat` runs of it in seconds."""
+    params = report_params(start_timestamp, end_timestamp)
+    analysis = {}
+    for name, sql in REPORTS.items():
+        timings = []
+        for _ in range(repeat):
+            started = perf_counter()
+            db.execute(sql, params).fetchall()
+            timings.append(perf_counter() - started)
+        analysis[name] = {
+            "plan": query_plan(db, sql, params),
+            "seconds": min(timings),
+        }
+    return analysis
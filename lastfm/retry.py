@@ -0,0 +1,85 @@
+import random
+from email.utils import parsedate_to_datetime
+from time import time
+
+import requests
+
+# HTTP statuses worth another attempt - everything else is returned as is
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Last.fm error codes that signal a temporary problem: 8 operation failed,
+# 11 service offline, 16 temporarily unavailable, 29 rate limit exceeded.
+# Anything else - such as 6, invalid parameters - will fail the same way again.
+RETRYABLE_ERRORS = {8, 11, 16, 29}
+
+# Failures to get any response at all, such as a dropped connection or a
+# stalled socket, which usually succeed when repeated
+RETRYABLE_EXCEPTIONS = (requests.ConnectionError, requests.Timeout)
+
+
+class LastFMError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f"Last.fm error {code}: {message}")
+        self.code = code
+        self.message = message
+
+
+class RetryPolicy:
+    """Decide whether a failed request is worth repeating, and how long to
+    wait first: the server's `Retry-After` when given, otherwise exponential
+    backoff from `backoff` seconds, capped at `max_backoff` and shortened by
+    up to `jitter` of itself so parallel callers don't retry in lockstep."""
+
+    def __init__(self, max_attempts=5, backoff=1.0, max_backoff=60.0, jitter=0.5):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+    def should_retry(self, response: requests.Response):
+        if response.status_code in RETRYABLE_STATUSES:
+            return True
+        return error_code(response) in RETRYABLE_ERRORS
+
+    def delay(self, attempt, response: requests.Response = None):
+        """Seconds to wait before another attempt, where `response` is None
+        when the last one failed without a response."""
+        headers = response.headers if response is not None else {}
+        retry_after = parse_retry_after(headers.get("Retry-After"))
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        return delay * (1 - random.uniform(0, self.jitter))
+
+
+def error_code(response: requests.Response):
+    """The Last.fm error code in the body of `response`, if any."""
+    # Only decode bodies that can be an error, not every page of results
+    if b'"error"' not in response.content[:100]:
+        return None
+    try:
+        return response.json().get("error")
+    except (ValueError, AttributeError):
+        return None
+
+
+def raise_for_error(response: requests.Response):
+    """Raise for failed HTTP statuses and for temporary Last.fm errors still
+    present after the last attempt."""
+    response.raise_for_status()
+    code = error_code(response)
+    if code in RETRYABLE_ERRORS:
+        raise LastFMError(code, response.json().get("message", ""))
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time(), 0)
+    except (TypeError, ValueError):
+        return None
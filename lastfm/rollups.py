@@ -0,0 +1,244 @@
+import json
+from collections import Counter
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from sqlite_utils import Database
+
+from lastfm.db_setup import ROLLUP_PERIODS, ROLLUPS, rollup_table
+
+DAY = 24 * 60 * 60
+# The shortest break from an artist recorded in `artist_gaps`, and so the
+# shortest the "Rediscovered" report can show
+REDISCOVERY_GAP = 2 * 365 * DAY
+
+# Each period as SQL over `uts_timestamp`, matching `period_start` below
+PERIOD_SQL = {
+    "daily": f"uts_timestamp - uts_timestamp % {DAY}",
+    "monthly": "cast(strftime('%s', uts_timestamp, 'unixepoch', 'start of month')"
+    " as integer)",
+}
+
+
+def day_start(timestamp):
+    return timestamp - timestamp % DAY
+
+
+# `period_start` passes the start of each scrobble's day, so all the scrobbles
+# of a day share one cached month
+@lru_cache(maxsize=1024)
+def month_start(timestamp):
+    date = datetime.fromtimestamp(timestamp, timezone.utc)
+    return int(
+        date.replace(day=1, hour=0, minute=0, second=0, microsecond=0).timestamp()
+    )
+
+
+def next_month_start(timestamp):
+    date = datetime.fromtimestamp(month_start(timestamp), timezone.utc)
+    if date.month == 12:
+        return int(date.replace(year=date.year + 1, month=1).timestamp())
+    return int(date.replace(month=date.month + 1).timestamp())
+
+
+def period_start(period, timestamp):
+    day = day_start(timestamp)
+    return day if period == "daily" else month_start(day)
+
+
+def rollup_keys(entity, scrobble):
+    """The values identifying `entity` in a playlist row, or None when the
+    scrobble doesn't count towards it - such as a track without an album."""
+    keys = tuple(scrobble[key] for key in ROLLUPS[entity])
+    return keys if all(keys) else None
+
+
+def fetch_new_timestamps(db: Database, timestamps):
+    """The subset of `timestamps` not yet stored in `playlist`."""
+    existing = {
+        timestamp
+        for (timestamp,) in db.execute(
+            "select uts_timestamp from playlist"
+            "   where uts_timestamp in (select value from json_each(?))",
+            [json.dumps(list(timestamps))],
+        )
+    }
+    return set(timestamps) - existing
+
+
+def save_rollups(db: Database, scrobbles):
+    """Add a batch of newly saved scrobbles - dicts or rows with `artist`,
+    `song`, `album` and `uts_timestamp` - to the listen rollups."""
+    for entity, keys in ROLLUPS.items():
+        for period in ROLLUP_PERIODS:
+            counts = Counter()
+            for scrobble in scrobbles:
+                entity_keys = rollup_keys(entity, scrobble)
+                if entity_keys:
+                    start = period_start(period, scrobble["uts_timestamp"])
+                    counts[(start, *entity_keys)] += 1
+            columns = ", ".join(["period", *keys, "listens"])
+            placeholders = ", ".join("?" * (len(keys) + 2))
+            db.conn.executemany(
+                f"insert into {rollup_table(entity, period)} ({columns})"
+                f"   values ({placeholders})"
+                f"   on conflict(period, {', '.join(keys)})"
+                "       do update set listens = listens + excluded.listens",
+                [(*key, listens) for key, listens in counts.items()],
+            )
+
+
+def save_artist_gaps(db: Database, scrobbles):
+    """Record the breaks of at least `REDISCOVERY_GAP` between consecutive
+    listens of each artist in a batch of newly saved scrobbles.
+
+    `artist_spans` holds each artist's first and last listen, so a batch
+    entirely before or after an artist's listens so far - as in a first
+    import, newest first, or an incremental export - needs nothing from
+    `playlist`. Other batches have their gaps recalculated from it."""
+    listens = {}
+    for scrobble in scrobbles:
+        artist = scrobble["artist"]
+        if artist:
+            listens.setdefault(artist, []).append(scrobble["uts_timestamp"])
+    spans = {
+        artist: (first, last)
+        for artist, first, last in db.execute(
+            "select artist, first_listen, last_listen from artist_spans"
+            "   where artist in (select value from json_each(?))",
+            [json.dumps(list(listens))],
+        )
+    }
+    gaps = []
+    for artist, timestamps in listens.items():
+        timestamps.sort()
+        first, last = spans.get(artist, (None, None))
+        if first is None:
+            neighbours = timestamps
+        elif timestamps[0] > last:
+            neighbours = [last, *timestamps]
+        elif timestamps[-1] < first:
+            neighbours = [*timestamps, first]
+        else:
+            recalculate_artist_gaps(db, artist, timestamps[0], timestamps[-1])
+            continue
+        gaps += [
+            (listen, artist, previous)
+            for previous, listen in zip(neighbours, neighbours[1:])
+            if listen - previous >= REDISCOVERY_GAP
+        ]
+    db.conn.executemany(
+        "insert or replace into artist_gaps (listen, artist, previous_listen)"
+        "   values (?, ?, ?)",
+        gaps,
+    )
+    db.conn.executemany(
+        "insert into artist_spans (artist, first_listen, last_listen)"
+        "   values (?, ?, ?)"
+        "   on conflict(artist)"
+        "       do update set"
+        "           first_listen = min(first_listen, excluded.first_listen),"
+        "           last_listen = max(last_listen, excluded.last_listen)",
+        [(artist, times[0], times[-1]) for artist, times in listens.items()],
+    )
+
+
+def recalculate_artist_gaps(db: Database, artist, first, last):
+    """Recalculate the gaps of `artist` that new listens between `first` and
+    `last`, already in `playlist`, can have changed."""
+    params = {"artist": artist, "first": first, "last": last}
+    db.execute(
+        "delete from artist_gaps"
+        "   where artist = :artist and listen > :first"
+        "   and previous_listen < :last",
+        params,
+    )
+    db.execute(
+        "insert or replace into artist_gaps (listen, artist, previous_listen)"
+        "   select listen, :artist, previous_listen from ("
+        "       select uts_timestamp as listen, lag(uts_timestamp)"
+        "           over (order by uts_timestamp) as previous_listen"
+        "       from playlist"
+        "       where artist = :artist and uts_timestamp between ifnull("
+        "           (select max(uts_timestamp) from playlist"
+        "               where artist = :artist and uts_timestamp < :first),"
+        "           :first"
+        "       ) and ifnull("
+        "           (select min(uts_timestamp) from playlist"
+        "               where artist = :artist and uts_timestamp > :last),"
+        "           :last"
+        "       )"
+        "   ) where listen - previous_listen >= :gap",
+        params | {"gap": REDISCOVERY_GAP},
+    )
+
+
+def rebuild_artist_gaps(db: Database):
+    """Recalculate `artist_gaps` and `artist_spans` from `playlist`."""
+    from lastfm import transaction
+
+    with transaction(db):
+        db.execute("delete from artist_gaps")
+        db.execute("delete from artist_spans")
+        db.execute(
+            "insert into artist_gaps (listen, artist, previous_listen)"
+            "   select listen, artist, previous_listen from ("
+            "       select uts_timestamp as listen, artist, lag(uts_timestamp)"
+            "           over (partition by artist order by uts_timestamp)"
+            "           as previous_listen"
+            "       from playlist where ifnull(artist, '') != ''"
+            "   ) where listen - previous_listen >= ?",
+            [REDISCOVERY_GAP],
+        )
+        db.execute(
+            "insert into artist_spans (artist, first_listen, last_listen)"
+            "   select artist, min(uts_timestamp), max(uts_timestamp)"
+            "   from playlist where ifnull(artist, '') != ''"
+            "   group by artist"
+        )
+
+
+def rebuild_rollups(db: Database):
+    """Recalculate every rollup from `playlist`."""
+    from lastfm import transaction
+
+    with transaction(db):
+        for entity, keys in ROLLUPS.items():
+            columns = ", ".join(keys)
+            present = " and ".join(f"ifnull({key}, '') != ''" for key in keys)
+            for period in ROLLUP_PERIODS:
+                table = rollup_table(entity, period)
+                db.execute(f"delete from {table}")
+                db.execute(
+                    f"insert into {table} (period, {columns}, listens)"
+                    f"   select {PERIOD_SQL[period]}, {columns}, count(1)"
+                    f"   from playlist where {present}"
+                    f"   group by 1, {columns}"
+                )
+
+
+def listen_ranges(start, end):
+    """Split `[start, end)` into the ranges each source of listens covers:
+    whole months from the monthly rollups, whole days around them from the
+    daily rollups and scrobbles from `playlist` at either end."""
+    start, end = int(start), int(end)
+
+    def clamp(value, low, high):
+        return max(low, min(value, high))
+
+    day_lo = clamp(day_start(start + DAY - 1), start, end)
+    day_hi = clamp(day_start(end), day_lo, end)
+    month_lo = clamp(
+        day_lo if month_start(day_lo) == day_lo else next_month_start(day_lo),
+        day_lo,
+        day_hi,
+    )
+    month_hi = clamp(month_start(day_hi), month_lo, day_hi)
+    return {
+        "start": start,
+        "end": end,
+        "day_lo": day_lo,
+        "day_hi": day_hi,
+        "month_lo": month_lo,
+        "month_hi": month_hi,
+    }
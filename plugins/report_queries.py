@@ -1,223 +1,276 @@
+import asyncio
+import os
+import re
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from weakref import WeakKeyDictionary
+
 from datasette import hookimpl
 from datasette.app import Datasette
+from datasette.database import Database
+from datasette.utils.asgi import Response
+from lastfm import reports
+from lastfm.reports import (
+    BLAST_ARTISTS,
+    LOVES,
+    MONTHLY_TAGS,
+    MOST_LOVED,
+    TOP_ALBUMS,
+    TOP_ARTISTS,
+    TOP_TRACKS,
+    report_params,
+)
 
+# Sections of the yearly report page
+YEAR_REPORT = {
+    "top_artists": TOP_ARTISTS,
+    "top_albums": TOP_ALBUMS,
+    "top_tracks": TOP_TRACKS,
+    "blast_artists": BLAST_ARTISTS,
+    "loves": LOVES,
+    "most_loved": MOST_LOVED,
+}
+YEAR_REPORT_PATH = re.compile(r"^/reports/year/\d+$")
 
-def fetch_top_artists(datasette: Datasette):
-    async def fetch(start_timestamp: int, end_timestamp:int):
-        db = datasette.get_database()
-        query = """
-            select
-              v.name, v.image_id, count(1) as listens, discovered,
-              (discovered >= cast(:start as integer)) as new
-            from
-              playlist as p
-            join
-              artist_details as v on lower(p.artist) = v.id
-            join
-              artist_history as h on lower(p.artist) = h.id
-            where
-              uts_timestamp >= :start and
-              uts_timestamp < :end 
-            group by
-              p.artist
-            order by
-              listens desc
-            limit 20
-        """
-        return (await db.execute(
-            query,
-            {"start": start_timestamp, "end": end_timestamp})
+# Report results kept per database
+DEFAULT_MAX_SIZE = 256
+
+_report_caches = WeakKeyDictionary()
+
+
+class ReportCache:
+    """Rows of report queries against one database, keyed by query and
+    period, so repeat views of a report don't run its queries again.
+
+    Everything is dropped once the database changes. `PRAGMA data_version`
+    on the cache's own connection reveals commits made by any other
+    connection, such as a nightly export. At most `max_size` results are
+    kept, evicting the least recently used."""
+
+    def __init__(self, db: Database, max_size=DEFAULT_MAX_SIZE):
+        self.conn = db.connect()
+        self.max_size = max_size
+        self.results = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            version = self.conn.execute("pragma data_version").fetchone()[0]
+            if version != self.version:
+                self.results.clear()
+                self.version = version
+            if key not in self.results:
+                self.misses += 1
+                return None
+            self.results.move_to_end(key)
+            self.hits += 1
+            return self.results[key]
+
+    def set(self, key, rows):
+        # Rows read while the database changed are dropped by the next `get`
+        with self.lock:
+            self.results[key] = rows
+            self.results.move_to_end(key)
+            while len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.results),
+                "max_size": self.max_size,
+            }
+
+
+def report_cache(datasette: Datasette):
+    """The `ReportCache` of `datasette`'s database, or None if it is in
+    memory."""
+    db = datasette.get_database()
+    if db.is_memory:
+        return None
+    if datasette not in _report_caches:
+        _report_caches[datasette] = ReportCache(db)
+    return _report_caches[datasette]
+
+
+async def fetch_report(datasette: Datasette, sql, start_timestamp, end_timestamp):
+    cache = report_cache(datasette)
+    key = (sql, start_timestamp, end_timestamp)
+    rows = cache.get(key) if cache else None
+    if rows is None:
+        rows = (await datasette.get_database().execute(
+            sql,
+            report_params(start_timestamp, end_timestamp))
         ).rows
+        if cache:
+            cache.set(key, rows)
+    return rows
+
+
+def fetch_top_artists(datasette: Datasette):
+    async def fetch(start_timestamp: int, end_timestamp: int):
+        return await fetch_report(datasette, TOP_ARTISTS, start_timestamp, end_timestamp)
     return fetch
 
 
 def fetch_top_albums(datasette: Datasette):
-    async def fetch(start_timestamp: int, end_timestamp:int):
-        db = datasette.get_database()
-        query = """
-            select
-              p.artist, p.album as name, image_id, count(1) as listens, discovered,
-              (discovered >= cast(:start as integer)) as new
-            from
-              playlist as p
-            join
-              album_details as v on p.album = v.name
-              and p.artist = v.artist
-            where
-              uts_timestamp >= :start and
-              uts_timestamp < :end 
-            group by
-              p.artist, p.album
-            order by
-              listens desc
-            limit 20
-        """
-        return (await db.execute(
-            query,
-            {"start": start_timestamp, "end": end_timestamp})
-        ).rows
+    async def fetch(start_timestamp: int, end_timestamp: int):
+        return await fetch_report(datasette, TOP_ALBUMS, start_timestamp, end_timestamp)
     return fetch
 
 
 def fetch_top_tracks(datasette: Datasette):
-    async def fetch(start_timestamp: int, end_timestamp:int):
-        db = datasette.get_database()
-        query = """
-            select
-              p.artist, name, v.image_id, count(1) as listens, discovered,
-              (discovered >= cast(:start as integer)) as new
-            from
-              playlist as p
-            join
-              track_details as v on p.song = v.name
-                                      and p.artist = v.artist
-            where
-              uts_timestamp >= :start and
-              uts_timestamp < :end 
-            group by
-              p.artist, p.song
-            order by
-              listens desc
-            limit 20
-        """
-        return (await db.execute(
-            query,
-            {"start": start_timestamp, "end": end_timestamp})
-        ).rows
+    async def fetch(start_timestamp: int, end_timestamp: int):
+        return await fetch_report(datasette, TOP_TRACKS, start_timestamp, end_timestamp)
     return fetch
 
 
 def fetch_blast_artists(datasette: Datasette):
-    async def fetch(start_timestamp: int, end_timestamp:int):
-        db = datasette.get_database()
-        query = """
-          select
-            *, (first_listen_this_period - previous_listen) as since,
-               (first_listen_this_period - previous_listen) / 60/60/24/365 as years
-          from (
-            select
-              v.name, v.image_id, count(1) as past_listens,
-              max(p1.uts_timestamp) as previous_listen, current_listens,
-              first_listen_this_period
-            from
-              playlist as p1
-            join (
-                select
-                  artist, count(1) as current_listens,
-                  min(p2.uts_timestamp) as first_listen_this_period
-                from
-                  playlist as p2
-                where
-                  uts_timestamp >= :start and
-                  uts_timestamp < :end 
-                group by
-                  artist
-              ) as this_p
-              on p1.artist = this_p.artist
-            join 
-              artist_details as v on v.id = lower(p1.artist)
-            where
-              p1.uts_timestamp < :start
-            and
-              current_listens > 5
-            group by
-            p1.artist
-          )
-          where
-            since >= (365 * 24 * 60 * 60 * 2)
-            and past_listens > 5
-          order by
-            (current_listens * years * years) desc
-          limit 20
-        """
-        return (await db.execute(
-            query,
-            {"start": start_timestamp, "end": end_timestamp})
-        ).rows
+    async def fetch(start_timestamp: int, end_timestamp: int):
+        return await fetch_report(datasette, BLAST_ARTISTS, start_timestamp, end_timestamp)
     return fetch
 
 
 def fetch_loves(datasette: Datasette):
-    async def fetch(start_timestamp: int, end_timestamp:int):
-        db = datasette.get_database()
-        query = """
-            select
-              p.artist, t.image_id, p.song as name, count(1) as listens
-            from
-              playlist as p
-            join
-              loves as l on l.artist = p.artist and l.song = p.song 
-            join
-              track_details as t on t.artist = p.artist and t.name = l.song
-            where
-              l.uts_timestamp >= :start and l.uts_timestamp < :end and
-              p.uts_timestamp >= :start and p.uts_timestamp < :end
-            group by
-              p.artist, p.song
-            order by
-              listens desc
-            limit 20
-        """
-        return (await db.execute(
-            query,
-            {"start": start_timestamp, "end": end_timestamp})
-        ).rows
+    async def fetch(start_timestamp: int, end_timestamp: int):
+        return await fetch_report(datasette, LOVES, start_timestamp, end_timestamp)
     return fetch
 
 
 def fetch_most_loved(datasette: Datasette):
-    async def fetch(start_timestamp: int, end_timestamp:int):
-        db = datasette.get_database()
-        query = """
-            select
-              l.artist as name, count(1) as loves
-            from
-              loves as l
-            where
-              l.uts_timestamp >= :start and l.uts_timestamp < :end
-            group by
-              l.artist
-            order by
-              loves desc
-            limit 1
-        """
-        return (await db.execute(
-            query,
-            {"start": start_timestamp, "end": end_timestamp})
-        ).rows
+    async def fetch(start_timestamp: int, end_timestamp: int):
+        return await fetch_report(datasette, MOST_LOVED, start_timestamp, end_timestamp)
     return fetch
 
 
 def fetch_monthly_tags(datasette: Datasette):
     async def fetch(start_timestamp: int, end_timestamp: int):
-        db = datasette.get_database()
-        query = """
-            select * from (select *, row_number() over (Partition by month order by freq desc) as rownum from (
-              select
-              t.name as tag, strftime ('%m', DATETIME(p.uts_timestamp, 'unixepoch')) month,
-              count(1) as freq
-            from
-              playlist as p
-              join artist_tags as t on t.id = lower(p.artist)
-            where
-              p.uts_timestamp >= :start
-              and
-              p.uts_timestamp < :end
-              and
-              tag not in ("seen live", "indie", "rock", "pop", "post rock", "electronic", "indie rock")
-            group by
-              t.name, month
-            order by
-              freq desc
-              )) where rownum <= 5
-        """
-        return (await db.execute(
-            query,
-            {"start": start_timestamp, "end": end_timestamp})
-        ).rows
+        return await fetch_report(datasette, MONTHLY_TAGS, start_timestamp, end_timestamp)
+    return fetch
+
+
+def fetch_year_report(datasette: Datasette):
+    async def fetch(start_timestamp: int, end_timestamp: int):
+        """Every section of the yearly report, run at the same time across
+        Datasette's read connections rather than one after another."""
+        results = await asyncio.gather(
+            *(
+                fetch_report(datasette, sql, start_timestamp, end_timestamp)
+                for sql in YEAR_REPORT.values()
+            )
+        )
+        return dict(zip(YEAR_REPORT, results))
     return fetch
 
 
+def file_version(path):
+    """Modification time in nanoseconds and size of the database and its
+    write-ahead log, which between them change on every commit."""
+    version = []
+    for name in (path, f"{path}-wal"):
+        try:
+            stat = os.stat(name)
+        except FileNotFoundError:
+            version += [0, 0]
+        else:
+            version += [stat.st_mtime_ns, stat.st_size]
+    return version
+
+
+def code_version(datasette: Datasette):
+    """Latest modification time in nanoseconds of the templates, plugins and
+    report queries that render a page, so deploying a change to any of them
+    changes the page's version too."""
+    paths = [reports.__file__]
+    for directory in (datasette.template_dir, datasette.plugins_dir):
+        for root, dirs, files in os.walk(directory or ()):
+            dirs[:] = [name for name in dirs if name != "__pycache__"]
+            paths += [os.path.join(root, name) for name in files]
+    return max(os.stat(path).st_mtime_ns for path in paths)
+
+
+def not_modified(headers, etag, last_modified):
+    if b"if-none-match" in headers:
+        return etag.encode() in headers[b"if-none-match"].split(b", ")
+    if b"if-modified-since" in headers:
+        try:
+            since = parsedate_to_datetime(headers[b"if-modified-since"].decode())
+        except (TypeError, ValueError):
+            return False
+        return since >= parsedate_to_datetime(last_modified)
+    return False
+
+
+def add_caching_headers(datasette: Datasette, app):
+    """Give each yearly report page an ETag and Last-Modified from the
+    database file and the code rendering it, answering conditional requests
+    for an unchanged database and code with 304 Not Modified."""
+
+    async def wrapped(scope, receive, send):
+        db = datasette.get_database()
+        if (
+            scope["type"] != "http"
+            or db.is_memory
+            or not YEAR_REPORT_PATH.match(scope["path"])
+        ):
+            return await app(scope, receive, send)
+
+        version = file_version(db.path)
+        code = code_version(datasette)
+        etag = '"' + "-".join(f"{n:x}" for n in [*version, code]) + '"'
+        last_modified = formatdate(
+            max(version[0], version[2], code) / 1e9, usegmt=True
+        )
+        caching_headers = [
+            (b"etag", etag.encode()),
+            (b"last-modified", last_modified.encode()),
+            # Revalidate every time, as the next export can come at any time
+            (b"cache-control", b"no-cache"),
+        ]
+        if not_modified(dict(scope["headers"]), etag, last_modified):
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 304,
+                    "headers": caching_headers,
+                }
+            )
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_headers(event):
+            if event["type"] == "http.response.start" and event["status"] == 200:
+                event = event | {
+                    "headers": [*event.get("headers", []), *caching_headers]
+                }
+            await send(event)
+
+        await app(scope, receive, send_with_headers)
+
+    return wrapped
+
+
+async def report_cache_stats(datasette: Datasette):
+    cache = report_cache(datasette)
+    return Response.json(cache.stats() if cache else {})
+
+
+@hookimpl
+def asgi_wrapper(datasette):
+    return lambda app: add_caching_headers(datasette, app)
+
+
+@hookimpl
+def register_routes():
+    return [(r"^/-/report-cache$", report_cache_stats)]
+
+
 @hookimpl
 def extra_template_vars(datasette):
     return {
@@ -228,4 +281,5 @@ def extra_template_vars(datasette):
         "fetch_loves": fetch_loves(datasette),
         "fetch_most_loved": fetch_most_loved(datasette),
         "fetch_monthly_tags": fetch_monthly_tags(datasette),
+        "fetch_year_report": fetch_year_report(datasette),
     }
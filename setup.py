@@ -29,7 +29,8 @@ setup(
     entry_points={"console_scripts": ["lastfm=lastfm.cli:cli"]},
     install_requires=["requests", "sqlite-utils"],
     extras_require={
-        "test": ["pytest"],
+        "test": ["pytest", "httpx"],
+        "async": ["httpx"],
         "docs": ["sphinx", "sphinx-rtd-theme"]
     },
     tests_require=["lastfm[test]"],
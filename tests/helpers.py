@@ -2,6 +2,7 @@ import os
 import requests
 
 from lastfm import ApiClient
+from lastfm.retry import RetryPolicy
 
 
 def load_file(filename):
@@ -17,4 +18,5 @@ def api_client() -> ApiClient:
         "api_key": "abcdefg",
         "username": "jammus",
         "session": requests.Session(),
+        "retry_policy": RetryPolicy(backoff=0),
     }
@@ -0,0 +1,218 @@
+import random
+from datetime import datetime, timezone
+
+import pytest
+from sqlite_utils import Database
+
+from lastfm import save_recent_tracks
+from lastfm.db_setup import create_all_tables, create_indexes
+from lastfm.reports import BLAST_ARTISTS, report_params
+from lastfm.rollups import rebuild_artist_gaps
+
+# The "Rediscovered" report as it was before `artist_gaps`, joining
+# `playlist` against itself
+PLAYLIST_BLAST_ARTISTS = """
+    select
+      *, (first_listen_this_period - previous_listen) as since,
+         (first_listen_this_period - previous_listen) / 60/60/24/365 as years
+    from (
+      select
+        v.name, v.image_id, count(1) as past_listens,
+        max(p1.uts_timestamp) as previous_listen, current_listens,
+        first_listen_this_period
+      from
+        playlist as p1
+      join (
+          select
+            artist, count(1) as current_listens,
+            min(p2.uts_timestamp) as first_listen_this_period
+          from
+            playlist as p2
+          where
+            uts_timestamp >= :start and
+            uts_timestamp < :end
+          group by
+            artist
+        ) as this_p
+        on p1.artist = this_p.artist
+      join
+        artist_details as v on v.id = lower(p1.artist)
+      where
+        p1.uts_timestamp < :start
+      and
+        current_listens > 5
+      group by
+      p1.artist
+    )
+    where
+      since >= (365 * 24 * 60 * 60 * 2)
+      and past_listens > 5
+    order by
+      (current_listens * years * years) desc
+    limit 20
+"""
+
+ARTISTS = ["Nyos", "TTNG", "Tide", "Told Slant", "Covet", "Giraffes? Giraffes!"]
+YEAR = 365 * 24 * 60 * 60
+HISTORY_START = int(datetime(2010, 1, 1, tzinfo=timezone.utc).timestamp())
+HISTORY_END = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+
+
+def history(seed):
+    """Scrobbles of artists listened to in bursts, with breaks of up to a
+    few years between them."""
+    rng = random.Random(seed)
+    scrobbles = {}
+    for artist in ARTISTS:
+        timestamp = HISTORY_START + rng.randrange(YEAR)
+        while timestamp < HISTORY_END:
+            for _ in range(rng.randrange(1, 30)):
+                timestamp += rng.randrange(60, 86400 * 20)
+                scrobbles[timestamp] = {
+                    "artist": artist,
+                    "song": "Nest",
+                    "album": "",
+                    "uts_timestamp": timestamp,
+                }
+            timestamp += rng.randrange(0, 5 * YEAR)
+    return list(scrobbles.values())
+
+
+def save_in_random_batches(db: Database, scrobbles, rng):
+    scrobbles = scrobbles[:]
+    rng.shuffle(scrobbles)
+    while scrobbles:
+        size = rng.randrange(1, 200)
+        save_recent_tracks(db, scrobbles[:size])
+        scrobbles = scrobbles[size:]
+
+
+@pytest.fixture(scope="module", params=[False, True], ids=["text", "normalized"])
+def db(request):
+    database = Database(memory=True)
+    create_all_tables(database, normalized=request.param)
+    create_indexes(database)
+    save_in_random_batches(database, history(3), random.Random(3))
+    for artist in ARTISTS:
+        database["artist_details"].insert({"id": artist.lower(), "name": artist})
+    return database
+
+
+def gaps(db: Database):
+    return list(db.query("select * from artist_gaps order by listen"))
+
+
+def report_ranges():
+    rng = random.Random(11)
+    ranges = [
+        (
+            int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp()),
+            int(datetime(year + 1, 1, 1, tzinfo=timezone.utc).timestamp()),
+        )
+        for year in range(2010, 2024)
+    ]
+    for _ in range(30):
+        start = rng.randrange(HISTORY_START, HISTORY_END)
+        ranges.append((start, start + rng.randrange(86400, 3 * YEAR)))
+    return ranges
+
+
+def ranked(rows):
+    # Order within ties of the ranking isn't defined, so compare each
+    # ranking position's set of rows
+    ranks = {}
+    for row in rows:
+        rank = row["current_listens"] * row["years"] * row["years"]
+        ranks.setdefault(rank, set()).add(tuple(row.values()))
+    return ranks
+
+
+@pytest.mark.parametrize("start, end", report_ranges())
+def test_matches_playlist_report(db: Database, start, end):
+    params = report_params(start, end)
+    expected = list(db.query(PLAYLIST_BLAST_ARTISTS, params))
+    actual = list(db.query(BLAST_ARTISTS, params))
+
+    assert ranked(actual) == ranked(expected)
+
+
+def test_history_has_rediscoveries(db: Database):
+    found = [
+        start
+        for start, end in report_ranges()
+        if list(db.query(BLAST_ARTISTS, report_params(start, end)))
+    ]
+
+    assert len(found) > 5
+
+
+def spans(db: Database):
+    return list(db.query("select * from artist_spans order by artist"))
+
+
+def test_saving_in_any_order_matches_rebuilding(db: Database):
+    saved = gaps(db), spans(db)
+
+    rebuild_artist_gaps(db)
+
+    assert (gaps(db), spans(db)) == saved
+    assert saved[0]
+
+
+@pytest.mark.parametrize("newest_first", [True, False], ids=["import", "sync"])
+def test_saving_pages_in_order_matches_rebuilding(newest_first):
+    db = Database(memory=True)
+    create_all_tables(db)
+    scrobbles = sorted(
+        history(5), key=lambda scrobble: scrobble["uts_timestamp"], reverse=newest_first
+    )
+    for page in range(0, len(scrobbles), 200):
+        save_recent_tracks(db, scrobbles[page:page + 200])
+    saved = gaps(db), spans(db)
+
+    rebuild_artist_gaps(db)
+
+    assert (gaps(db), spans(db)) == saved
+
+
+def test_records_only_long_breaks():
+    db = Database(memory=True)
+    create_all_tables(db)
+    day = 86400
+    save_recent_tracks(
+        db,
+        [
+            {"artist": "TTNG", "song": "Nest", "album": "", "uts_timestamp": t}
+            for t in [HISTORY_START, HISTORY_START + day, HISTORY_START + 3 * YEAR]
+        ],
+    )
+
+    assert gaps(db) == [
+        {
+            "listen": HISTORY_START + 3 * YEAR,
+            "artist": "TTNG",
+            "previous_listen": HISTORY_START + day,
+        }
+    ]
+
+
+def test_listens_within_a_gap_split_it():
+    db = Database(memory=True)
+    create_all_tables(db)
+
+    def save(*timestamps):
+        save_recent_tracks(
+            db,
+            [
+                {"artist": "TTNG", "song": "Nest", "album": "", "uts_timestamp": t}
+                for t in timestamps
+            ],
+        )
+
+    save(HISTORY_START, HISTORY_START + 5 * YEAR)
+    save(HISTORY_START + 2 * YEAR + 10)
+
+    assert [(gap["previous_listen"], gap["listen"]) for gap in gaps(db)] == [
+        (HISTORY_START, HISTORY_START + 2 * YEAR + 10),
+        (HISTORY_START + 2 * YEAR + 10, HISTORY_START + 5 * YEAR),
+    ]
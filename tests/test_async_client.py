@@ -0,0 +1,231 @@
+import asyncio
+import json
+from urllib.parse import parse_qsl, urlparse
+
+import pytest
+
+from lastfm.async_client import (
+    async_api_client,
+    fetch_album,
+    fetch_artist,
+    fetch_concurrently,
+    fetch_page,
+    fetch_pages,
+)
+from lastfm.metrics import Metrics
+from lastfm.retry import RetryPolicy
+from tests.helpers import load_file
+
+
+class StubServer:
+    """A minimal HTTP/1.1 server on the running event loop. `respond` maps
+    each request's query parameters to a status and body, or to None to drop
+    the connection instead of answering."""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+        self.connections = 0
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.server.close()
+
+    @property
+    def base_url(self):
+        port = self.server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/2.0"
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        while request_line := await reader.readline():
+            while (await reader.readline()) not in (b"\r\n", b""):
+                pass
+            params = dict(parse_qsl(urlparse(request_line.split()[1].decode()).query))
+            self.requests.append(params)
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+            # Give other requests a chance to arrive
+            await asyncio.sleep(0.01)
+            self.in_flight -= 1
+            response = self.respond(params)
+            if response is None:
+                break
+            status, body = response
+            body = body.encode()
+            writer.write(
+                f"HTTP/1.1 {status} OK\r\nContent-Length: {len(body)}\r\n"
+                "Content-Type: application/json\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        writer.close()
+
+
+def client_for(server, concurrency=4):
+    client = async_api_client(
+        "abcdefg", "jammus", concurrency=concurrency, base_url=server.base_url
+    )
+    return client | {"retry_policy": RetryPolicy(backoff=0)}
+
+
+def paged_response(params, total_pages=5):
+    page = int(params.get("page", 1))
+    return 200, json.dumps(
+        {
+            "recenttracks": {
+                "track": [{"name": f"Track {page}"}],
+                "@attr": {"page": str(page), "totalPages": str(total_pages)},
+            }
+        }
+    )
+
+
+def run(test):
+    return asyncio.run(test())
+
+
+def test_fetches_page_with_default_params():
+    async def test():
+        async with StubServer(lambda params: (200, "{}")) as server:
+            client = client_for(server)
+            await fetch_page(client, "user.getrecenttracks", {"page": 2})
+            await client["session"].aclose()
+        return server.requests[0]
+
+    params = run(test)
+
+    assert params["method"] == "user.getrecenttracks"
+    assert params["api_key"] == "abcdefg"
+    assert params["user"] == "jammus"
+    assert params["format"] == "json"
+    assert params["page"] == "2"
+
+
+def test_retries_rate_limited_requests():
+    responses = iter([(429, '{"error": 29}'), (200, '{"success": true}')])
+
+    async def test():
+        async with StubServer(lambda params: next(responses)) as server:
+            client = client_for(server) | {"metrics": Metrics()}
+            response = await fetch_page(client, "user.getrecenttracks")
+            await client["session"].aclose()
+        return response, client["metrics"].summary()["total"]
+
+    response, metrics = run(test)
+
+    assert response == {"success": True}
+    assert metrics["requests"] == 2
+    assert metrics["retries"] == 1
+
+
+def test_retries_dropped_connections():
+    responses = iter([None, (200, '{"success": true}')])
+
+    async def test():
+        async with StubServer(lambda params: next(responses)) as server:
+            client = client_for(server)
+            response = await fetch_page(client, "user.getrecenttracks")
+            await client["session"].aclose()
+        return response, len(server.requests)
+
+    assert run(test) == ({"success": True}, 2)
+
+
+def test_yields_every_page_in_order():
+    async def test():
+        async with StubServer(paged_response) as server:
+            client = client_for(server)
+            pages = [
+                items[0]["name"]
+                async for items, _ in fetch_pages(
+                    client, "user.getrecenttracks", concurrency=3
+                )
+            ]
+            await client["session"].aclose()
+        return pages
+
+    assert run(test) == [f"Track {page}" for page in range(1, 6)]
+
+
+def test_reuses_connections():
+    async def test():
+        async with StubServer(paged_response) as server:
+            client = client_for(server, concurrency=1)
+            async for _ in fetch_pages(client, "user.getrecenttracks"):
+                pass
+            await client["session"].aclose()
+        return server
+
+    server = run(test)
+
+    assert len(server.requests) == 5
+    assert server.connections == 1
+
+
+def test_limits_requests_in_flight_across_callers():
+    async def test():
+        async with StubServer(paged_response) as server:
+            client = client_for(server, concurrency=2)
+
+            async def sync_history():
+                async for _ in fetch_pages(
+                    client,
+                    "user.getrecenttracks",
+                    concurrency=4,
+                ):
+                    pass
+
+            async def enrich():
+                async for _ in fetch_concurrently(
+                    lambda name: fetch_artist(client, name), ["A", "B", "C"], 3
+                ):
+                    pass
+
+            await asyncio.gather(sync_history(), enrich())
+            await client["session"].aclose()
+        return server
+
+    server = run(test)
+
+    assert len(server.requests) == 8
+    assert server.most_in_flight == 2
+
+
+def test_fetches_artist_and_album_details():
+    def respond(params):
+        if params["method"] == "artist.getinfo":
+            return 200, load_file("sample_artist_response.json")
+        return 200, load_file("sample_album_response.json")
+
+    async def test():
+        async with StubServer(respond) as server:
+            client = client_for(server)
+            artist = await fetch_artist(client, "Melt-Banana")
+            album = await fetch_album(client, "Fetch", "Melt-Banana")
+            await client["session"].aclose()
+        return artist, album
+
+    artist, album = run(test)
+
+    assert artist["name"] == "Melt-Banana"
+    assert artist["similar"]
+    assert album["name"]
+
+
+def test_yields_results_as_they_complete():
+    async def fetch(delay):
+        await asyncio.sleep(delay)
+        return delay * 10
+
+    async def test():
+        return [
+            result async for result in fetch_concurrently(fetch, [0.05, 0.01, 0.03], 3)
+        ]
+
+    assert run(test) == [(0.01, 0.1), (0.03, 0.3), (0.05, 0.5)]
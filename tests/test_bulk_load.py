@@ -0,0 +1,46 @@
+import pytest
+from sqlite_utils import Database
+
+from lastfm import save_recent_tracks
+from lastfm.db_setup import bulk_load, create_all_tables
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / "lastfm.db"))
+    create_all_tables(database)
+    return database
+
+
+def pragma(db: Database, name):
+    return db.execute(f"pragma {name}").fetchone()[0]
+
+
+def test_switches_to_wal_without_full_syncs_while_loading(db: Database):
+    with bulk_load(db):
+        assert pragma(db, "journal_mode") == "wal"
+        assert pragma(db, "synchronous") == 1
+
+
+def test_restores_previous_settings_afterwards(db: Database):
+    before = {name: pragma(db, name) for name in ("journal_mode", "synchronous", "cache_size")}
+
+    with bulk_load(db):
+        save_recent_tracks(db, [{"artist": "Nyos", "song": "Nest", "uts_timestamp": 1}])
+
+    assert {name: pragma(db, name) for name in before} == before
+
+
+def test_restores_previous_settings_after_a_failure(db: Database):
+    with pytest.raises(RuntimeError):
+        with bulk_load(db):
+            raise RuntimeError()
+
+    assert pragma(db, "journal_mode") == "delete"
+
+
+def test_analyzes_tables_once_loaded(db: Database):
+    with bulk_load(db):
+        save_recent_tracks(db, [{"artist": "Nyos", "song": "Nest", "uts_timestamp": 1}])
+
+    assert "sqlite_stat1" in db.table_names()
@@ -0,0 +1,102 @@
+import pytest
+
+from lastfm.cache import ResponseCache, cache_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(str(tmp_path), ttls={"artist.getinfo": 60})
+
+
+def test_returns_none_for_uncached_responses(cache):
+    assert cache.get("artist.getinfo", {"artist": "Nyos"}) is None
+
+
+def test_returns_cached_response(cache):
+    cache.set("artist.getinfo", {"artist": "Nyos"}, {"artist": {"name": "Nyos"}})
+
+    assert cache.get("artist.getinfo", {"artist": "Nyos"}) == {
+        "artist": {"name": "Nyos"}
+    }
+
+
+def test_keys_by_method_and_params(cache):
+    cache.set("artist.getinfo", {"artist": "Nyos"}, {"artist": {"name": "Nyos"}})
+
+    assert cache.get("artist.getinfo", {"artist": "TTNG"}) is None
+
+
+def test_ignores_api_key_and_param_order():
+    assert cache_key("artist.getinfo", {"artist": "Nyos", "api_key": "a"}) == (
+        cache_key("artist.getinfo", {"api_key": "b", "artist": "Nyos"})
+    )
+
+
+def test_does_not_cache_methods_without_ttl(cache):
+    cache.set("user.getrecenttracks", {"page": 1}, {"recenttracks": {}})
+
+    assert cache.get("user.getrecenttracks", {"page": 1}) is None
+
+
+def test_does_not_cache_errors(cache):
+    cache.set("artist.getinfo", {"artist": "Nobody"}, {"error": 6})
+
+    assert cache.get("artist.getinfo", {"artist": "Nobody"}) is None
+
+
+def test_expires_responses_after_ttl(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path), ttls={"artist.getinfo": 60})
+    monkeypatch.setattr("lastfm.cache.time", lambda: 1000)
+    cache.set("artist.getinfo", {"artist": "Nyos"}, {"artist": {}})
+
+    monkeypatch.setattr("lastfm.cache.time", lambda: 1061)
+
+    assert cache.get("artist.getinfo", {"artist": "Nyos"}) is None
+
+
+def test_persists_between_instances(tmp_path):
+    ResponseCache(str(tmp_path)).set(
+        "album.getinfo", {"album": "Elf Titled"}, {"album": {}}
+    )
+
+    assert ResponseCache(str(tmp_path)).get(
+        "album.getinfo", {"album": "Elf Titled"}
+    ) == {"album": {}}
+
+
+def test_evicts_least_recently_used_responses_beyond_max_size(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path), ttls={"artist.getinfo": 60})
+    for now, name in enumerate(["Nyos", "TTNG", "Tide"]):
+        monkeypatch.setattr("lastfm.cache.time", lambda: now)
+        cache.set("artist.getinfo", {"artist": name}, {"artist": {"name": name}})
+    monkeypatch.setattr("lastfm.cache.time", lambda: 3)
+    cache.get("artist.getinfo", {"artist": "Nyos"})
+    size = next(cache.db.query("select max(size) as size from responses"))["size"]
+
+    cache.max_size = size * 2
+    monkeypatch.setattr("lastfm.cache.time", lambda: 4)
+    cache.set("artist.getinfo", {"artist": "Toe"}, {"artist": {"name": "Toe"}})
+
+    assert cache.get("artist.getinfo", {"artist": "Nyos"}) is not None
+    assert cache.get("artist.getinfo", {"artist": "Toe"}) is not None
+    assert cache.get("artist.getinfo", {"artist": "TTNG"}) is None
+    assert cache.get("artist.getinfo", {"artist": "Tide"}) is None
+
+
+def test_keeps_track_of_its_size(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttls={"artist.getinfo": 60})
+    for name in ["Nyos", "TTNG", "Nyos"]:
+        cache.set("artist.getinfo", {"artist": name}, {"artist": {"name": name}})
+    size = next(cache.db.query("select sum(size) as size from responses"))["size"]
+
+    assert cache.size == size
+    assert ResponseCache(str(tmp_path)).size == size
+
+
+def test_counts_hits_and_misses(cache):
+    cache.get("artist.getinfo", {"artist": "Nyos"})
+    cache.set("artist.getinfo", {"artist": "Nyos"}, {"artist": {}})
+    cache.get("artist.getinfo", {"artist": "Nyos"})
+    cache.get("artist.getinfo", {"artist": "Nyos"})
+
+    assert cache.stats() == {"hits": 2, "misses": 1}
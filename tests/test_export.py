@@ -0,0 +1,296 @@
+import datetime
+import json
+
+import httpretty
+import pytest
+from click.testing import CliRunner
+from sqlite_utils import Database
+
+from lastfm import convert_to_timestamp, save_love, save_recent_tracks
+from lastfm.cli import cli
+from lastfm.db_setup import create_all_tables
+from tests.helpers import load_file
+
+API_URL = "https://ws.audioscrobbler.com/2.0"
+
+# The newest scrobble of the stub's recent tracks
+LATEST = 1700000000
+
+
+class StubApi:
+    """Answers every call `export` makes, with `pages` pages of recent
+    tracks, and records the parameters of each request. Recent tracks pages
+    listed in `failing_pages` fail with a client error, which isn't
+    retried."""
+
+    def __init__(self, pages=3, failing_pages=()):
+        self.pages = pages
+        self.failing_pages = set(failing_pages)
+        self.requests = []
+        self.bodies = {
+            "user.getlovedtracks": load_file("sample_loves_dump.json"),
+            "artist.getinfo": load_file("sample_artist_response.json"),
+            "album.getinfo": load_file("sample_album_response.json"),
+        }
+
+    def respond(self, request, uri, headers):
+        params = {name: values[0] for name, values in request.querystring.items()}
+        self.requests.append(params)
+        method = params["method"]
+        if method != "user.getrecenttracks":
+            return [200, headers, self.bodies[method].encode()]
+        page = int(params["page"])
+        if page in self.failing_pages:
+            return [400, headers, "{}"]
+        return [200, headers, json.dumps(self.recent_tracks(page))]
+
+    def recent_tracks(self, page):
+        tracks = [
+            {
+                "artist": {"#text": "Nyos"},
+                "album": {"#text": "Nyos"},
+                "name": f"Track {page}-{i}",
+                "image": [],
+                "date": {"uts": str(LATEST - page * 10 - i), "#text": ""},
+            }
+            for i in range(2)
+        ]
+        return {
+            "recenttracks": {
+                "track": tracks,
+                "@attr": {
+                    "page": str(page),
+                    "totalPages": str(self.pages),
+                    "total": str(self.pages * len(tracks)),
+                },
+            }
+        }
+
+    def calls(self, method):
+        return [params for params in self.requests if params["method"] == method]
+
+
+@pytest.fixture
+def api():
+    stub = StubApi()
+    httpretty.enable()
+    httpretty.register_uri(httpretty.GET, API_URL, body=stub.respond)
+    yield stub
+    httpretty.disable()
+    httpretty.reset()
+
+
+@pytest.fixture
+def database(tmp_path):
+    return str(tmp_path / "lastfm.db")
+
+
+def export(database, *options):
+    return CliRunner().invoke(
+        cli,
+        ["export", "abcdefg", database, "--user", "jammus"]
+        + ["--concurrency", "1", "--rate_limit", "1000"]
+        + list(options),
+    )
+
+
+def saved_database(database, scrobbles=(), loves=()):
+    db = Database(database)
+    create_all_tables(db)
+    save_recent_tracks(
+        db,
+        [
+            {"artist": "Nyos", "song": "Nest", "uts_timestamp": timestamp}
+            for timestamp in scrobbles
+        ],
+    )
+    for timestamp in loves:
+        save_love(db, {"artist": "Nyos", "song": "Nest", "uts_timestamp": timestamp})
+    return db
+
+
+def test_incremental_export_starts_from_latest_scrobble(api, database):
+    saved_database(database, scrobbles=[1600000000, 1650000000])
+
+    result = export(database, "--incremental")
+
+    assert result.exit_code == 0, result.output
+    assert api.calls("user.getrecenttracks")[0]["from"] == "1650000000"
+
+
+def test_incremental_export_keeps_a_later_start_date(api, database):
+    saved_database(database, scrobbles=[1600000000])
+
+    result = export(database, "--incremental", "--start_date", "2023-01-01")
+
+    assert result.exit_code == 0, result.output
+    first = api.calls("user.getrecenttracks")[0]
+    assert first["from"] == str(convert_to_timestamp("2023-01-01"))
+
+
+def test_incremental_export_ignores_an_earlier_start_date(api, database):
+    saved_database(database, scrobbles=[1650000000])
+
+    result = export(database, "--incremental", "--start_date", "2020-01-01")
+
+    assert result.exit_code == 0, result.output
+    assert api.calls("user.getrecenttracks")[0]["from"] == "1650000000"
+
+
+def test_incremental_export_stops_at_loves_already_saved(api, database):
+    # The third love on the first page of the loves fixture
+    saved_database(database, scrobbles=[1600000000], loves=[1725509868])
+
+    result = export(database, "--incremental")
+
+    assert result.exit_code == 0, result.output
+    assert len(api.calls("user.getlovedtracks")) == 1
+    assert Database(database)["loves"].count == 3
+
+
+def test_resumes_an_interrupted_export_after_the_last_saved_page(api, database):
+    api.pages = 5
+    api.failing_pages = {3}
+
+    interrupted = export(database, "--start_date", "2023-01-01")
+    api.failing_pages = set()
+    api.requests = []
+    resumed = export(database)
+
+    assert interrupted.exit_code != 0
+    assert resumed.exit_code == 0, resumed.output
+    requested = api.calls("user.getrecenttracks")
+    assert [params["page"] for params in requested] == ["3", "4", "5"]
+    assert {(params["from"], params["to"]) for params in requested} == {
+        (str(convert_to_timestamp("2023-01-01")), requested[0]["to"])
+    }
+    assert Database(database)["playlist"].count == 10
+
+
+def test_pins_the_end_of_an_interrupted_export(api, database, monkeypatch):
+    api.failing_pages = {2}
+    export(database)
+    pinned = api.calls("user.getrecenttracks")[0]["to"]
+    api.failing_pages = set()
+    api.requests = []
+
+    class Later(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.datetime(2030, 1, 1, tzinfo=tz)
+
+    monkeypatch.setattr(datetime, "datetime", Later)
+    resumed = export(database)
+
+    assert resumed.exit_code == 0, resumed.output
+    assert [
+        (params["page"], params["to"]) for params in api.calls("user.getrecenttracks")
+    ] == [("2", pinned), ("3", pinned)]
+
+
+def test_starts_again_when_the_window_changes(api, database):
+    api.failing_pages = {2}
+    export(database, "--start_date", "2023-01-01")
+    api.failing_pages = set()
+    api.requests = []
+
+    resumed = export(database, "--start_date", "2022-01-01")
+
+    assert resumed.exit_code == 0, resumed.output
+    requested = api.calls("user.getrecenttracks")
+    assert [params["page"] for params in requested] == ["1", "2", "3"]
+    assert requested[0]["from"] == str(convert_to_timestamp("2022-01-01"))
+
+
+def test_forgets_the_interrupted_export_once_finished(api, database):
+    api.failing_pages = {2}
+    export(database)
+    api.failing_pages = set()
+    export(database)
+    api.requests = []
+
+    export(database)
+
+    assert api.calls("user.getrecenttracks")[0]["page"] == "1"
+
+
+def playlist_indexes_while_saving(monkeypatch):
+    """Record the `playlist` indexes present as each page of recent tracks
+    is saved."""
+    seen = []
+
+    def save(db, tracks):
+        seen.append({index.name for index in db["playlist"].indexes})
+        save_recent_tracks(db, tracks)
+
+    monkeypatch.setattr("lastfm.cli.save_recent_tracks", save)
+    return seen
+
+
+def test_indexes_a_first_import_once_it_is_loaded(api, database, monkeypatch):
+    seen = playlist_indexes_while_saving(monkeypatch)
+
+    result = export(database)
+
+    assert result.exit_code == 0, result.output
+    assert seen == [set(), set(), set()]
+    assert "idx_playlist_uts_timestamp" in {
+        index.name for index in Database(database)["playlist"].indexes
+    }
+
+
+def test_indexes_an_existing_database_before_saving(api, database, monkeypatch):
+    saved_database(database, scrobbles=[1600000000])
+    seen = playlist_indexes_while_saving(monkeypatch)
+
+    result = export(database)
+
+    assert result.exit_code == 0, result.output
+    assert len(seen) == 3
+    assert all("idx_playlist_uts_timestamp" in indexes for indexes in seen)
+
+
+def test_bulk_export_indexes_once_loaded(api, database, monkeypatch):
+    saved_database(database, scrobbles=[1600000000])
+    seen = playlist_indexes_while_saving(monkeypatch)
+
+    result = export(database, "--bulk")
+
+    assert result.exit_code == 0, result.output
+    assert seen == [set(), set(), set()]
+
+
+def test_bulk_export_tunes_sqlite_only_for_the_recent_tracks(
+    api, database, monkeypatch
+):
+    synchronous = []
+
+    def save(db, love):
+        synchronous.append(db.execute("pragma synchronous").fetchone()[0])
+        save_love(db, love)
+
+    monkeypatch.setattr("lastfm.cli.save_love", save)
+
+    result = export(database, "--bulk")
+
+    assert result.exit_code == 0, result.output
+    # Back to FULL from bulk_load's NORMAL
+    assert set(synchronous) == {2}
+
+
+def test_failed_bulk_export_is_not_analyzed(api, database):
+    api.failing_pages = {2}
+
+    result = export(database, "--bulk")
+
+    assert result.exit_code != 0
+    assert "sqlite_stat1" not in Database(database).table_names()
+
+
+def test_a_limit_of_zero_refreshes_no_artists_or_albums(api, database):
+    result = export(database, "--limit", "0")
+
+    assert result.exit_code == 0, result.output
+    assert api.calls("artist.getinfo") == []
+    assert api.calls("album.getinfo") == []
+    assert "Artists: 0 of 0 changed" in result.output
@@ -0,0 +1,61 @@
+import re
+
+import pytest
+
+from lastfm import extract_image_id, image_id_from_url
+
+ORIGINAL_PATTERN = r"https?://.*/(?P<id>[^/.]*)\."
+
+
+def original_image_id(url):
+    match = re.search(ORIGINAL_PATTERN, url)
+    return match.group("id") if match else None
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "https://lastfm.freetls.fastly.net/i/u/34s/fb0529f082462f505cd0902734c174c8.png",
+        "https://lastfm.freetls.fastly.net/i/u/300x300/2a96cbd8b46e442fc41c2b86b821562f.jpg",
+        "http://userserve-ak.last.fm/serve/64s/1234.gif",
+        "https://lastfm.freetls.fastly.net/i/u/34s/noextension",
+        "https://lastfm.freetls.fastly.net/i/u/a.b/noextension",
+        "https://lastfm.freetls.fastly.net/i/u/34s/archive.tar.gz",
+        "https://lastfm.freetls.fastly.net/i/u/34s/.png",
+        "https://image.png",
+        "https://host.example/image.png",
+        "ftp://lastfm.freetls.fastly.net/i/u/34s/abc.png",
+        "see https://lastfm.freetls.fastly.net/i/u/34s/abc.png",
+        "https:/lastfm/abc.png",
+        "not a url",
+        "",
+    ],
+)
+def test_matches_original_pattern(url):
+    assert image_id_from_url(url) == original_image_id(url)
+
+
+def test_memoises_repeated_urls():
+    url = "https://lastfm.freetls.fastly.net/i/u/34s/0123456789abcdef.png"
+    image_id_from_url(url)
+    hits = image_id_from_url.cache_info().hits
+
+    image_id_from_url(url)
+
+    assert image_id_from_url.cache_info().hits == hits + 1
+
+
+def test_extracts_id_of_first_image():
+    item = {
+        "image": [
+            {"size": "small", "#text": "https://lastfm.freetls.fastly.net/i/u/34s/abc.png"},
+            {"size": "large", "#text": "https://lastfm.freetls.fastly.net/i/u/300/def.png"},
+        ]
+    }
+
+    assert extract_image_id(item) == "abc"
+
+
+def test_no_image_gives_no_id():
+    assert extract_image_id({}) is None
+    assert extract_image_id({"image": [{"#text": ""}]}) is None
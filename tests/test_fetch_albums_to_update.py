@@ -96,3 +96,8 @@ def test_accepts_a_limit(db):
     assert len(albums) == 2
     assert albums[0]["name"] == "Tiny Moving Parts"
     assert albums[1]["name"] == "Next"
+
+
+@pytest.mark.usefixtures("db_with_album_listens")
+def test_a_limit_of_zero_fetches_nothing(db):
+    assert list(fetch_albums_to_update(db, limit=0)) == []
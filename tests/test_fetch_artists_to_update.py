@@ -78,3 +78,8 @@ def test_accepts_a_limit(db):
     assert len(artists) == 2
     assert artists[0]["name"] == "Tiny Moving Parts"
     assert artists[1]["name"] == "Try Science"
+
+
+@pytest.mark.usefixtures("db_with_artist_listens")
+def test_a_limit_of_zero_fetches_nothing(db):
+    assert list(fetch_artists_to_update(db, limit=0)) == []
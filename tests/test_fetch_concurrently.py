@@ -0,0 +1,56 @@
+import threading
+from time import sleep
+
+import pytest
+
+from lastfm import fetch_concurrently
+
+
+def test_yields_every_item_with_its_result():
+    results = dict(fetch_concurrently(lambda n: n * n, range(20), concurrency=4))
+
+    assert results == {n: n * n for n in range(20)}
+
+
+def test_fetches_in_order_without_concurrency():
+    results = list(fetch_concurrently(lambda n: n * n, [3, 1, 2]))
+
+    assert results == [(3, 9), (1, 1), (2, 4)]
+
+
+def test_runs_up_to_concurrency_fetches_at_once():
+    running = 0
+    most_running = 0
+    lock = threading.Lock()
+
+    def fetch(item):
+        nonlocal running, most_running
+        with lock:
+            running += 1
+            most_running = max(most_running, running)
+        sleep(0.01)
+        with lock:
+            running -= 1
+        return item
+
+    list(fetch_concurrently(fetch, range(20), concurrency=3))
+
+    assert most_running == 3
+
+
+def test_yields_results_as_they_complete():
+    def fetch(item):
+        sleep(item)
+        return item
+
+    results = [item for item, _ in fetch_concurrently(fetch, [0.2, 0.01], 2)]
+
+    assert results == [0.01, 0.2]
+
+
+def test_raises_fetch_errors():
+    def fetch(item):
+        raise ValueError(item)
+
+    with pytest.raises(ValueError):
+        list(fetch_concurrently(fetch, range(5), concurrency=2))
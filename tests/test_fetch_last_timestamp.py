@@ -0,0 +1,40 @@
+import pytest
+from sqlite_utils import Database
+
+from lastfm import fetch_last_timestamp
+from lastfm.db_setup import create_loves_table, create_scrobbles_table
+
+
+@pytest.fixture
+def db():
+    database = Database(memory=True)
+    create_scrobbles_table(database)
+    create_loves_table(database)
+    return database
+
+
+def test_returns_none_when_nothing_is_saved(db: Database):
+    assert fetch_last_timestamp(db) is None
+
+
+def test_returns_none_when_table_does_not_exist():
+    assert fetch_last_timestamp(Database(memory=True)) is None
+
+
+def test_returns_newest_scrobble_timestamp(db: Database):
+    db["playlist"].insert_all(
+        [
+            {"artist": "Nyos", "uts_timestamp": 1725597832},
+            {"artist": "Nyos", "uts_timestamp": 1726597832},
+            {"artist": "Nyos", "uts_timestamp": 1724597832},
+        ]
+    )
+
+    assert fetch_last_timestamp(db) == 1726597832
+
+
+def test_reads_from_requested_table(db: Database):
+    db["playlist"].insert({"artist": "Nyos", "uts_timestamp": 1726597832})
+    db["loves"].insert({"artist": "Nyos", "uts_timestamp": 1625597832})
+
+    assert fetch_last_timestamp(db, "loves") == 1625597832
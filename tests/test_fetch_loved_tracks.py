@@ -38,3 +38,23 @@ def test_returns_loves_metadata():
     _, metadata = next(fetch_loved_tracks(api_client()))
 
     assert metadata["total"] == "793"
+
+
+@httprettified
+def test_stops_at_first_love_already_saved():
+    response_body = load_file("sample_loves_dump.json")
+    httpretty.register_uri(
+        httpretty.GET, "http://ws.audioscrobbler.com/2.0", body=response_body
+    )
+    all_loves = [love for love, _ in fetch_loved_tracks(api_client())]
+    httpretty.reset()
+    httpretty.register_uri(
+        httpretty.GET, "http://ws.audioscrobbler.com/2.0", body=response_body
+    )
+
+    loves = list(
+        fetch_loved_tracks(api_client(), since=all_loves[3]["uts_timestamp"])
+    )
+
+    assert [love for love, _ in loves] == all_loves[:3]
+    assert len(httpretty.latest_requests()) == 1
@@ -1,8 +1,12 @@
 import pytest
 import httpretty
+import requests
 from httpretty import httprettified
 
-from lastfm import fetch_page
+from lastfm import REQUEST_TIMEOUT, fetch_page
+from lastfm.cache import ResponseCache
+from lastfm.metrics import Metrics
+from lastfm.retry import LastFMError, RetryPolicy
 from tests.helpers import api_client
 
 
@@ -105,3 +109,173 @@ def test_retries_failed_requests_5_times():
         fetch_page(api_client(), "user.getrecenttracks", {"page": 20, "user": "jammus"})
 
     assert len(httpretty.latest_requests()) == 5
+
+
+@httprettified
+def test_does_not_retry_client_errors():
+    httpretty.register_uri(
+        httpretty.GET, "http://ws.audioscrobbler.com/2.0", status=404
+    )
+    with pytest.raises(Exception):
+        fetch_page(api_client(), "user.getrecenttracks")
+
+    assert len(httpretty.latest_requests()) == 1
+
+
+@httprettified
+def test_retries_rate_limited_requests_until_they_succeed():
+    httpretty.register_uri(
+        httpretty.GET,
+        "http://ws.audioscrobbler.com/2.0",
+        responses=[
+            httpretty.Response(body='{"error": 29}', status=429),
+            httpretty.Response(body='{"error": 29}', status=429),
+            httpretty.Response(body='{"success": true}'),
+        ],
+    )
+
+    response = fetch_page(api_client(), "user.getrecenttracks")
+
+    assert response["success"] is True
+    assert len(httpretty.latest_requests()) == 3
+
+
+@httprettified
+def test_retries_temporary_lastfm_errors_returned_with_success_status():
+    httpretty.register_uri(
+        httpretty.GET,
+        "http://ws.audioscrobbler.com/2.0",
+        responses=[
+            httpretty.Response(body='{"error": 16, "message": "Try again"}'),
+            httpretty.Response(body='{"success": true}'),
+        ],
+    )
+
+    response = fetch_page(api_client(), "user.getrecenttracks")
+
+    assert response["success"] is True
+    assert len(httpretty.latest_requests()) == 2
+
+
+@httprettified
+def test_raises_when_temporary_lastfm_errors_persist():
+    httpretty.register_uri(
+        httpretty.GET,
+        "http://ws.audioscrobbler.com/2.0",
+        body='{"error": 11, "message": "Service offline"}',
+    )
+
+    with pytest.raises(LastFMError) as error:
+        fetch_page(api_client(), "user.getrecenttracks")
+
+    assert error.value.code == 11
+    assert len(httpretty.latest_requests()) == 5
+
+
+@httprettified
+def test_returns_permanent_lastfm_errors_without_retrying():
+    httpretty.register_uri(
+        httpretty.GET,
+        "http://ws.audioscrobbler.com/2.0",
+        body='{"error": 6, "message": "The artist you supplied could not be found"}',
+    )
+
+    response = fetch_page(api_client(), "artist.getinfo")
+
+    assert response["error"] == 6
+    assert len(httpretty.latest_requests()) == 1
+
+
+@httprettified
+def test_retries_up_to_policy_max_attempts():
+    httpretty.register_uri(
+        httpretty.GET, "http://ws.audioscrobbler.com/2.0", status=503
+    )
+    client = api_client() | {"retry_policy": RetryPolicy(max_attempts=2, backoff=0)}
+
+    with pytest.raises(Exception):
+        fetch_page(client, "user.getrecenttracks")
+
+    assert len(httpretty.latest_requests()) == 2
+
+
+@httprettified
+def test_serves_cached_responses_without_a_request(tmp_path):
+    httpretty.register_uri(
+        httpretty.GET, "http://ws.audioscrobbler.com/2.0", body='{"artist": {}}'
+    )
+    client = api_client() | {"cache": ResponseCache(str(tmp_path))}
+
+    fetch_page(client, "artist.getinfo", {"artist": "Nyos"})
+    response = fetch_page(client, "artist.getinfo", {"artist": "Nyos"})
+
+    assert response == {"artist": {}}
+    assert len(httpretty.latest_requests()) == 1
+
+
+@httprettified
+def test_records_requests_and_retries_in_metrics():
+    httpretty.register_uri(
+        httpretty.GET,
+        "http://ws.audioscrobbler.com/2.0",
+        responses=[
+            httpretty.Response(body='{"error": 29}', status=429),
+            httpretty.Response(body='{"success": true}'),
+        ],
+    )
+    metrics = Metrics()
+
+    with metrics.phase("recent_tracks"):
+        fetch_page(api_client() | {"metrics": metrics}, "user.getrecenttracks")
+
+    phase = metrics.summary()["phases"]["recent_tracks"]
+    assert phase["requests"] == 2
+    assert phase["retries"] == 1
+    assert phase["bytes_downloaded"] == len('{"error": 29}{"success": true}')
+
+
+class FlakySession:
+    """Raise each of `failures` in turn, then make the request."""
+
+    def __init__(self, *failures):
+        self.failures = list(failures)
+        self.session = requests.Session()
+        self.timeouts = []
+
+    def get(self, url, **kwargs):
+        self.timeouts.append(kwargs.get("timeout"))
+        if self.failures:
+            raise self.failures.pop(0)
+        return self.session.get(url, **kwargs)
+
+
+@httprettified
+def test_retries_dropped_connections_and_timeouts():
+    httpretty.register_uri(
+        httpretty.GET, "http://ws.audioscrobbler.com/2.0", body='{"success": true}'
+    )
+    session = FlakySession(requests.ConnectionError(), requests.Timeout())
+
+    response = fetch_page(api_client() | {"session": session}, "user.getrecenttracks")
+
+    assert response["success"] is True
+    assert len(session.timeouts) == 3
+
+
+def test_raises_connection_errors_that_persist():
+    session = FlakySession(*[requests.ConnectionError()] * 5)
+
+    with pytest.raises(requests.ConnectionError):
+        fetch_page(api_client() | {"session": session}, "user.getrecenttracks")
+
+    assert len(session.timeouts) == 5
+
+
+@httprettified
+def test_requests_time_out():
+    httpretty.register_uri(httpretty.GET, "http://ws.audioscrobbler.com/2.0")
+    session = FlakySession()
+
+    fetch_page(api_client() | {"session": session}, "user.getrecenttracks")
+
+    assert session.timeouts == [REQUEST_TIMEOUT]
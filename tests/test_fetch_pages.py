@@ -1,3 +1,4 @@
+import json
 import httpretty
 from httpretty import httprettified
 
@@ -98,3 +99,78 @@ def test_works_with_loved_tracks():
     loves, metadata = data[0]
     assert loves[0].get("name") == "SynthFlood"
     assert metadata["total"] == "793"
+
+
+def paged_response(total_pages):
+    def respond(request, uri, response_headers):
+        page = request.querystring["page"][0]
+        body = json.dumps(
+            {
+                "recenttracks": {
+                    "track": [{"name": f"Track {page}"}],
+                    "@attr": {"page": page, "totalPages": str(total_pages)},
+                }
+            }
+        )
+        return [200, response_headers, body]
+
+    return respond
+
+
+@httprettified
+def test_fetches_remaining_pages_concurrently_in_page_order():
+    httpretty.register_uri(
+        httpretty.GET, "http://ws.audioscrobbler.com/2.0", body=paged_response(12)
+    )
+
+    data = list(fetch_pages(api_client(), "user.getrecenttracks", concurrency=4))
+
+    assert len(httpretty.latest_requests()) == 12
+    assert [tracks[0]["name"] for tracks, _ in data] == [
+        f"Track {page}" for page in range(1, 13)
+    ]
+
+
+@httprettified
+def test_concurrent_fetch_requests_every_page_once():
+    httpretty.register_uri(
+        httpretty.GET, "http://ws.audioscrobbler.com/2.0", body=paged_response(9)
+    )
+
+    list(fetch_pages(api_client(), "user.getrecenttracks", concurrency=3))
+
+    pages = sorted(
+        int(request.querystring["page"][0])
+        for request in httpretty.latest_requests()
+    )
+    assert pages == list(range(1, 10))
+
+
+@httprettified
+def test_stopping_early_does_not_fetch_every_page():
+    httpretty.register_uri(
+        httpretty.GET, "http://ws.audioscrobbler.com/2.0", body=paged_response(50)
+    )
+
+    data = fetch_pages(api_client(), "user.getrecenttracks", concurrency=2)
+    next(data)
+    next(data)
+    data.close()
+
+    assert len(httpretty.latest_requests()) < 50
+
+
+@httprettified
+def test_starts_from_requested_page():
+    httpretty.register_uri(
+        httpretty.GET, "http://ws.audioscrobbler.com/2.0", body=paged_response(6)
+    )
+
+    data = list(fetch_pages(api_client(), "user.getrecenttracks", start_page=4))
+
+    assert [tracks[0]["name"] for tracks, _ in data] == [
+        "Track 4",
+        "Track 5",
+        "Track 6",
+    ]
+    assert len(httpretty.latest_requests()) == 3
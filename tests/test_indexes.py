@@ -0,0 +1,122 @@
+import pytest
+from sqlite_utils import Database
+
+from lastfm import save_recent_tracks
+from lastfm.db_setup import (
+    create_all_tables,
+    create_indexes,
+    fetch_index_profile,
+    index_sizes,
+)
+from lastfm.reports import REPORTS, analyze_reports, query_plan, report_params
+
+START = 1672531200
+END = 1704067200
+
+COVERED_TABLES = (
+    "artist_details",
+    "artist_history",
+    "album_details",
+    "track_details",
+    "artist_tags",
+    "listens_daily",
+    "listens_monthly",
+)
+
+
+@pytest.fixture(params=[False, True], ids=["text", "normalized"])
+def db(request):
+    database = Database(memory=True)
+    create_all_tables(database, normalized=request.param)
+    scrobbles = [
+        {
+            "artist": f"Artist {i % 70}",
+            "song": f"Song {i % 13}",
+            "album": f"Album {i % 5}",
+            "uts_timestamp": START + i * 60 * 60,
+        }
+        for i in range(300)
+    ]
+    save_recent_tracks(database, scrobbles)
+    database["loves"].insert_all(
+        {key: love[key] for key in ("artist", "song", "uts_timestamp")}
+        for love in scrobbles[::10]
+    )
+    for i in range(70):
+        database["artist_details"].insert(
+            {"id": f"artist {i}", "name": f"Artist {i}", "last_updated": 0}
+        )
+        database["artist_tags"].insert_all(
+            {"id": f"artist {i}", "name": tag} for tag in ("math rock", "emo", "jazz")
+        )
+    return database
+
+
+def table_lookups(db: Database, sql):
+    """Steps reading rows of the covered tables through an index that
+    doesn't hold every column the query needs."""
+    return [
+        step
+        for step in query_plan(db, sql, report_params(START, END))
+        if " USING INDEX " in step and any(table in step for table in COVERED_TABLES)
+    ]
+
+
+def covering_index_names(db: Database):
+    return {
+        name for _, name, _ in index_sizes(db) if name.endswith(("_listens", "_image_id"))
+    }
+
+
+@pytest.mark.parametrize("report", REPORTS)
+def test_covering_indexes_avoid_table_lookups(db: Database, report):
+    create_indexes(db, "covering")
+
+    assert table_lookups(db, REPORTS[report]) == []
+
+
+def test_default_indexes_leave_table_lookups(db: Database):
+    create_indexes(db)
+
+    assert table_lookups(db, REPORTS["top_tracks"]) != []
+
+
+def test_default_profile_drops_covering_indexes(db: Database):
+    create_indexes(db, "covering")
+    assert covering_index_names(db)
+
+    create_indexes(db, "default")
+
+    assert covering_index_names(db) == set()
+
+
+def test_remembers_index_profile(db: Database):
+    assert fetch_index_profile(db) == "default"
+
+    create_indexes(db, "covering")
+    create_indexes(db)
+
+    assert fetch_index_profile(db) == "covering"
+    assert covering_index_names(db)
+
+
+def test_index_sizes_cover_every_index(db: Database):
+    create_indexes(db, "covering")
+
+    sizes = index_sizes(db)
+
+    assert {name for _, name, _ in sizes} == {
+        index.name for table in db.tables for index in table.indexes
+    }
+    assert all(size is None or size > 0 for _, _, size in sizes)
+
+
+def test_analyzes_every_report(db: Database):
+    create_indexes(db)
+
+    analysis = analyze_reports(db, START, END, repeat=2)
+
+    assert list(analysis) == list(REPORTS)
+    for report in analysis.values():
+        assert report["plan"]
+        assert report["seconds"] >= 0
@@ -2,7 +2,14 @@ import os
 import json
 import pytest
 import datetime
-from lastfm import DATE_FORMAT, LastFM, convert_to_timestamp, process_tracks_response
+from lastfm import (
+    DATE_FORMAT,
+    LastFM,
+    Scrobble,
+    convert_to_timestamp,
+    process_scrobbles,
+    process_tracks_response,
+)
 
 
 def load_json(filename):
@@ -92,3 +99,47 @@ def test_track_image_id_hash_with_all_other_details_stripped(recenttracks_page):
     data = process_tracks_response(recenttracks_page)
     track = next(data)
     assert track.get("image_id", None) == "fb0529f082462f505cd0902734c174c8"
+
+
+def test_convert_to_timestamp_passes_through_timestamps():
+    assert convert_to_timestamp(1726597832) == 1726597832
+
+
+def test_process_scrobbles_matches_process_tracks_response(recenttracks_page):
+    scrobbles = list(process_scrobbles(recenttracks_page))
+    tracks = list(process_tracks_response(recenttracks_page))
+
+    assert [scrobble._asdict() for scrobble in scrobbles] == [
+        {"album": None, "image_id": None} | track for track in tracks
+    ]
+
+
+def test_process_scrobbles_returns_compact_records(recenttracks_page):
+    scrobble = next(process_scrobbles(recenttracks_page))
+
+    assert isinstance(scrobble, Scrobble)
+    assert not hasattr(scrobble, "__dict__")
+    assert scrobble.artist == "Lera Lynn"
+    assert scrobble.uts_timestamp == 1603622207
+    assert scrobble.image_id == "fb0529f082462f505cd0902734c174c8"
+
+
+def test_process_scrobbles_skips_now_playing_tracks(
+    recenttracks_with_now_playing_page,
+):
+    scrobble = next(process_scrobbles(recenttracks_with_now_playing_page))
+
+    assert scrobble.artist == "Colossal Squid"
+
+
+def test_process_scrobbles_skips_tracks_without_a_date(recenttracks_page):
+    undated = {key: value for key, value in recenttracks_page[0].items() if key != "date"}
+
+    scrobbles = list(process_scrobbles([undated] + recenttracks_page[1:]))
+
+    assert len(scrobbles) == len(recenttracks_page) - 1
+    assert scrobbles[0].uts_timestamp == int(recenttracks_page[1]["date"]["uts"])
+
+
+def test_process_scrobbles_of_empty_page_yields_nothing():
+    assert list(process_scrobbles(None)) == []
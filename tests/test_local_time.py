@@ -0,0 +1,95 @@
+from datetime import datetime, timezone
+
+import pytest
+from sqlite_utils import Database
+
+from lastfm import fetch_timezone, save_recent_tracks, save_timezone
+from lastfm.db_setup import create_all_tables
+
+# 2024-03-31T23:30:00Z, already April in Berlin
+END_OF_MARCH = int(datetime(2024, 3, 31, 23, 30, tzinfo=timezone.utc).timestamp())
+
+
+@pytest.fixture(params=[False, True], ids=["text", "normalized"])
+def db(request):
+    database = Database(memory=True)
+    create_all_tables(database, normalized=request.param)
+    return database
+
+
+def save(db: Database, *timestamps):
+    save_recent_tracks(
+        db,
+        [
+            {"artist": "TTNG", "song": "Nest", "album": "", "uts_timestamp": timestamp}
+            for timestamp in timestamps
+        ],
+    )
+
+
+def local_times(db: Database):
+    return [
+        tuple(row)
+        for row in db.execute(
+            "select local_year, local_month, local_day, local_hour from playlist"
+            "   order by uts_timestamp"
+        )
+    ]
+
+
+def test_buckets_scrobbles_in_utc_by_default(db: Database):
+    save(db, END_OF_MARCH)
+
+    assert fetch_timezone(db) == "UTC"
+    assert local_times(db) == [(2024, 3, 31, 23)]
+
+
+def test_buckets_scrobbles_in_the_saved_timezone(db: Database):
+    save_timezone(db, "Europe/Berlin")
+
+    save(db, END_OF_MARCH)
+
+    assert fetch_timezone(db) == "Europe/Berlin"
+    assert local_times(db) == [(2024, 4, 1, 1)]
+
+
+def test_changing_timezone_rebuckets_saved_scrobbles(db: Database):
+    save(db, END_OF_MARCH, END_OF_MARCH - 86400 * 60)
+
+    save_timezone(db, "America/New_York")
+
+    assert local_times(db) == [(2024, 1, 31, 18), (2024, 3, 31, 19)]
+
+
+def test_fills_in_scrobbles_saved_without_local_time(db: Database):
+    save(db, END_OF_MARCH)
+    table = "scrobbles" if db["scrobbles"].exists() else "playlist"
+    db.execute(f"update {table} set local_year = null, local_month = null")
+
+    save_timezone(db, "UTC")
+
+    assert local_times(db) == [(2024, 3, 31, 23)]
+
+
+def test_adds_local_time_to_existing_databases():
+    db = Database(memory=True)
+    db["playlist"].insert(
+        {"artist": "TTNG", "song": "Nest", "album": "", "uts_timestamp": END_OF_MARCH},
+        pk="uts_timestamp",
+    )
+
+    create_all_tables(db)
+    save_timezone(db, "UTC")
+
+    assert local_times(db) == [(2024, 3, 31, 23)]
+
+
+def test_normalizing_keeps_local_time():
+    db = Database(memory=True)
+    create_all_tables(db)
+    save_timezone(db, "Europe/Berlin")
+    save(db, END_OF_MARCH)
+
+    create_all_tables(db, normalized=True)
+
+    assert local_times(db) == [(2024, 4, 1, 1)]
@@ -0,0 +1,108 @@
+import json
+import threading
+
+from lastfm.metrics import Metrics
+
+
+def test_counts_requests_per_phase():
+    metrics = Metrics()
+
+    with metrics.phase("artists"):
+        metrics.record_request(0.02, 100)
+        metrics.record_request(0.3, 50)
+    with metrics.phase("albums"):
+        metrics.record_request(0.02, 10)
+
+    phases = metrics.summary()["phases"]
+    assert phases["artists"]["requests"] == 2
+    assert phases["artists"]["bytes_downloaded"] == 150
+    assert phases["albums"]["requests"] == 1
+
+
+def test_buckets_http_latency():
+    metrics = Metrics()
+
+    with metrics.phase("artists"):
+        metrics.record_request(0.005, 0)
+        metrics.record_request(0.01, 0)
+        metrics.record_request(0.3, 0)
+        metrics.record_request(30, 0)
+
+    latency = metrics.summary()["phases"]["artists"]["http_latency"]
+    assert latency["<=10ms"] == 2
+    assert latency["<=500ms"] == 1
+    assert latency[">10000ms"] == 1
+    assert sum(latency.values()) == 4
+
+
+def test_times_database_writes():
+    metrics = Metrics()
+
+    with metrics.phase("recent_tracks"):
+        with metrics.writing(200):
+            pass
+        with metrics.writing(150):
+            pass
+
+    phase = metrics.summary()["phases"]["recent_tracks"]
+    assert phase["rows_written"] == 350
+    assert phase["db_seconds"] >= 0
+
+
+def test_totals_every_phase():
+    metrics = Metrics()
+
+    with metrics.phase("loves"):
+        metrics.record_retry()
+    with metrics.phase("artists"):
+        metrics.record_retry()
+        metrics.record_cache_hit()
+
+    total = metrics.summary()["total"]
+    assert total["retries"] == 2
+    assert total["cache_hits"] == 1
+
+
+def test_records_outside_a_phase_as_other():
+    metrics = Metrics()
+
+    metrics.record_rate_limit_wait(1.5)
+
+    assert metrics.summary()["phases"]["other"]["rate_limit_wait"] == 1.5
+
+
+def test_counts_from_many_threads():
+    metrics = Metrics()
+
+    def record():
+        for _ in range(1000):
+            metrics.record_request(0.01, 1)
+
+    with metrics.phase("artists"):
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert metrics.summary()["phases"]["artists"]["requests"] == 4000
+
+
+def test_writes_summary_to_file_after_each_phase(tmp_path):
+    path = tmp_path / "metrics.json"
+    metrics = Metrics(str(path))
+
+    with metrics.phase("loves"):
+        metrics.record_request(0.01, 10)
+
+    assert json.loads(path.read_text())["phases"]["loves"]["requests"] == 1
+
+
+def test_keeps_file_up_to_date_while_running(tmp_path):
+    path = tmp_path / "metrics.json"
+    metrics = Metrics(str(path), interval=0)
+
+    with metrics.phase("recent_tracks"):
+        with metrics.writing(200):
+            pass
+        assert json.loads(path.read_text())["total"]["rows_written"] == 200
@@ -0,0 +1,113 @@
+from datetime import datetime, timezone
+
+import pytest
+from sqlite_utils import Database
+
+from lastfm import save_all_artist_tags, save_recent_tracks, save_timezone
+from lastfm.db_setup import create_all_tables, create_indexes
+from lastfm.reports import MONTHLY_TAGS, report_params
+
+START = int(datetime(2023, 1, 1, tzinfo=timezone.utc).timestamp())
+END = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+
+
+@pytest.fixture(params=[False, True], ids=["text", "normalized"])
+def db(request):
+    database = Database(memory=True)
+    create_all_tables(database, normalized=request.param)
+    create_indexes(database)
+    save_all_artist_tags(
+        database,
+        [
+            ("Nyos", [{"name": "math rock"}, {"name": "instrumental"}]),
+            ("TTNG", [{"name": "math rock"}, {"name": "emo"}, {"name": "indie"}]),
+        ],
+    )
+    return database
+
+
+def listen(artist, *date):
+    timestamp = int(datetime(*date, tzinfo=timezone.utc).timestamp())
+    return {"artist": artist, "song": "Nest", "album": "", "uts_timestamp": timestamp}
+
+
+def monthly_tags(db: Database, start=START, end=END):
+    return [
+        (row["month"], row["tag"], row["freq"])
+        for row in db.query(MONTHLY_TAGS, report_params(start, end))
+    ]
+
+
+def test_weights_listens_by_tag(db: Database):
+    save_recent_tracks(
+        db,
+        [
+            listen("Nyos", 2023, 3, 1, 12),
+            listen("Nyos", 2023, 3, 2, 12),
+            listen("TTNG", 2023, 3, 3, 12),
+        ],
+    )
+
+    assert monthly_tags(db) == [
+        ("03", "math rock", 3.0),
+        ("03", "instrumental", 1.6),
+        ("03", "emo", 0.8),
+    ]
+
+
+def test_leaves_out_tags_in_the_stoplist(db: Database):
+    save_recent_tracks(db, [listen("TTNG", 2023, 3, 3, 12)])
+    db["tag_stoplist"].delete("indie")
+    db["tag_stoplist"].insert({"name": "emo"})
+
+    assert monthly_tags(db) == [("03", "math rock", 1.0), ("03", "indie", 0.6)]
+
+
+def test_groups_by_local_month(db: Database):
+    save_timezone(db, "Europe/Berlin")
+    save_recent_tracks(
+        db,
+        [listen("Nyos", 2023, 3, 31, 23, 30), listen("TTNG", 2023, 3, 31, 12)],
+    )
+
+    assert sorted(monthly_tags(db)) == [
+        ("03", "emo", 0.8),
+        ("03", "math rock", 1.0),
+        ("04", "instrumental", 0.8),
+        ("04", "math rock", 1.0),
+    ]
+
+
+def test_only_counts_listens_within_the_period(db: Database):
+    save_recent_tracks(
+        db,
+        [
+            listen("Nyos", 2022, 12, 31, 23, 30),
+            listen("Nyos", 2023, 3, 14, 12),
+            listen("TTNG", 2023, 3, 15, 12),
+            listen("Nyos", 2023, 5, 1, 12),
+        ],
+    )
+    start = int(datetime(2023, 3, 15, tzinfo=timezone.utc).timestamp())
+    end = int(datetime(2023, 5, 1, tzinfo=timezone.utc).timestamp())
+
+    assert sorted(monthly_tags(db, start, end)) == [
+        ("03", "emo", 0.8),
+        ("03", "math rock", 1.0),
+    ]
+
+
+def test_keeps_the_same_month_of_different_years_apart(db: Database):
+    save_recent_tracks(
+        db, [listen("Nyos", 2022, 3, 1, 12), listen("TTNG", 2023, 3, 1, 12)]
+    )
+    start = int(datetime(2022, 1, 1, tzinfo=timezone.utc).timestamp())
+
+    rows = db.query(MONTHLY_TAGS, report_params(start, END))
+
+    assert sorted((row["year"], row["tag"]) for row in rows) == [
+        (2022, "instrumental"),
+        (2022, "math rock"),
+        (2023, "emo"),
+        (2023, "math rock"),
+    ]
@@ -0,0 +1,181 @@
+import json
+import sqlite3
+
+import pytest
+from sqlite_utils import Database
+
+from lastfm import (
+    Scrobble,
+    fetch_last_timestamp,
+    process_scrobbles,
+    save_recent_tracks,
+    transaction,
+)
+from lastfm.db_setup import create_all_tables, create_indexes, create_scrobbles_table
+from tests.helpers import load_file
+
+
+@pytest.fixture
+def db():
+    database = Database(memory=True)
+    create_all_tables(database, normalized=True)
+    create_indexes(database)
+    return database
+
+
+@pytest.fixture
+def recent_tracks():
+    page = json.loads(load_file("sample_recent_tracks_dump.json"))
+    return list(process_scrobbles(page["recenttracks"]["track"]))
+
+
+def playlist(db: Database):
+    return list(db.query("select * from playlist order by uts_timestamp"))
+
+
+def test_playlist_view_matches_playlist_table(db: Database, recent_tracks):
+    text_db = Database(memory=True)
+    create_all_tables(text_db)
+
+    save_recent_tracks(db, recent_tracks)
+    save_recent_tracks(text_db, recent_tracks)
+
+    assert playlist(db) == playlist(text_db)
+
+
+def test_stores_each_artist_and_track_once(db: Database):
+    save_recent_tracks(
+        db,
+        [
+            {"artist": "Nyos", "song": "Nest", "album": "Waiting Room", "uts_timestamp": 1},
+            {"artist": "Nyos", "song": "Nest", "album": "Waiting Room", "uts_timestamp": 2},
+            {"artist": "Nyos", "song": "Bird Fight", "album": "", "uts_timestamp": 3},
+        ],
+    )
+    save_recent_tracks(
+        db, [{"artist": "Nyos", "song": "Nest", "album": "Waiting Room", "uts_timestamp": 4}]
+    )
+
+    assert db["artists"].count == 1
+    assert db["tracks"].count == 2
+    assert db["albums"].count == 1
+    assert list(
+        db.query(
+            "select uts_timestamp, track_id, album_id from scrobbles"
+            "   order by uts_timestamp"
+        )
+    ) == [
+        {"uts_timestamp": 1, "track_id": 1, "album_id": 1},
+        {"uts_timestamp": 2, "track_id": 1, "album_id": 1},
+        {"uts_timestamp": 3, "track_id": 2, "album_id": None},
+        {"uts_timestamp": 4, "track_id": 1, "album_id": 1},
+    ]
+
+
+def test_artist_names_are_case_sensitive(db: Database):
+    save_recent_tracks(
+        db,
+        [
+            {"artist": "TTNG", "song": "Gibbon", "uts_timestamp": 1},
+            {"artist": "ttng", "song": "Gibbon", "uts_timestamp": 2},
+        ],
+    )
+
+    assert db["artists"].count == 2
+
+
+def test_stores_scrobbles_without_a_song_or_artist(db: Database):
+    save_recent_tracks(
+        db,
+        [
+            Scrobble("Nyos", None, None, 1, "", None),
+            {"artist": None, "song": "Nest", "uts_timestamp": 2},
+        ],
+    )
+
+    assert [(row["artist"], row["song"]) for row in playlist(db)] == [
+        ("Nyos", ""),
+        ("", "Nest"),
+    ]
+
+
+def test_forgets_keys_from_rolled_back_transactions(db: Database):
+    with pytest.raises(RuntimeError):
+        with transaction(db):
+            save_recent_tracks(db, [{"artist": "Nyos", "song": "Nest", "uts_timestamp": 1}])
+            raise RuntimeError()
+
+    save_recent_tracks(db, [{"artist": "Tide", "song": "Wave", "uts_timestamp": 2}])
+    save_recent_tracks(db, [{"artist": "Nyos", "song": "Nest", "uts_timestamp": 3}])
+
+    assert [(row["artist"], row["song"]) for row in playlist(db)] == [
+        ("Tide", "Wave"),
+        ("Nyos", "Nest"),
+    ]
+
+
+def test_converts_existing_playlist_table(recent_tracks):
+    db = Database(memory=True)
+    create_all_tables(db)
+    create_indexes(db)
+    save_recent_tracks(db, recent_tracks)
+    before = playlist(db)
+
+    create_scrobbles_table(db, normalized=True)
+
+    assert "playlist" in db.view_names()
+    assert playlist(db) == before
+
+
+def test_converts_scrobbles_without_a_song_or_artist():
+    db = Database(memory=True)
+    create_all_tables(db)
+    db["playlist"].insert_all(
+        [
+            {"artist": "Nyos", "song": "Nest", "album": "", "uts_timestamp": 1},
+            {"artist": "Nyos", "song": "", "album": "", "uts_timestamp": 2},
+            {"artist": None, "song": None, "album": None, "uts_timestamp": 3},
+        ]
+    )
+
+    create_scrobbles_table(db, normalized=True)
+
+    assert [row["uts_timestamp"] for row in playlist(db)] == [1, 2, 3]
+    assert [row["song"] for row in playlist(db)] == ["Nest", "", ""]
+
+
+def test_keeps_playlist_table_if_any_scrobble_is_not_converted():
+    db = Database(memory=True)
+    create_all_tables(db)
+    db["playlist"].insert_all(
+        [
+            {"artist": "Nyos", "song": "Nest", "uts_timestamp": 1},
+            {"artist": "Nyos", "song": "Nest", "uts_timestamp": 2},
+        ]
+    )
+    # Stand in for a scrobble the conversion can't match to its track
+    db["scrobbles"].create(
+        {"uts_timestamp": int, "track_id": int, "album_id": int}, pk="uts_timestamp"
+    )
+    db.execute(
+        "create trigger skip_scrobble before insert on scrobbles"
+        "   when new.uts_timestamp = 2 begin select raise(ignore); end"
+    )
+
+    with pytest.raises(sqlite3.IntegrityError):
+        create_scrobbles_table(db, normalized=True)
+
+    assert "playlist" in db.table_names()
+    assert db["playlist"].count == 2
+
+
+def test_stays_normalized_once_created(db: Database):
+    create_all_tables(db)
+
+    assert "playlist" in db.view_names()
+
+
+def test_fetches_last_timestamp(db: Database):
+    save_recent_tracks(db, [{"artist": "Nyos", "song": "Nest", "uts_timestamp": 7}])
+
+    assert fetch_last_timestamp(db) == 7
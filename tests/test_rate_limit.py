@@ -0,0 +1,70 @@
+import threading
+from time import monotonic
+
+from lastfm.rate_limit import TokenBucket
+
+
+def test_first_request_is_not_delayed():
+    bucket = TokenBucket(1)
+
+    start = monotonic()
+    bucket.acquire()
+
+    assert monotonic() - start < 0.05
+
+
+def test_spaces_requests_by_rate():
+    bucket = TokenBucket(20)
+
+    start = monotonic()
+    for _ in range(5):
+        bucket.acquire()
+
+    assert monotonic() - start >= 4 / 20
+
+
+def test_allows_bursts_up_to_burst_size():
+    bucket = TokenBucket(1, burst=5)
+
+    start = monotonic()
+    for _ in range(5):
+        bucket.acquire()
+
+    assert monotonic() - start < 0.05
+
+
+def test_limit_is_shared_between_threads():
+    bucket = TokenBucket(20)
+
+    start = monotonic()
+    threads = [threading.Thread(target=bucket.acquire) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert monotonic() - start >= 5 / 20
+
+
+def test_weighted_methods_cost_more_tokens():
+    bucket = TokenBucket(20, weights={"artist.getinfo": 3})
+
+    start = monotonic()
+    bucket.acquire("artist.getinfo")
+    bucket.acquire("artist.getinfo")
+
+    assert monotonic() - start >= 3 / 20
+
+
+def test_counts_requests_and_time_waited_per_method():
+    bucket = TokenBucket(20)
+
+    bucket.acquire("user.getrecenttracks")
+    bucket.acquire("user.getrecenttracks")
+    bucket.acquire("artist.getinfo")
+
+    stats = bucket.stats()
+    assert stats["user.getrecenttracks"]["requests"] == 2
+    assert stats["artist.getinfo"]["requests"] == 1
+    assert stats["user.getrecenttracks"]["waited"] > 0
+    assert bucket.waited == sum(method["waited"] for method in stats.values())
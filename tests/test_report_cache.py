@@ -0,0 +1,182 @@
+import asyncio
+import os
+import shutil
+from datetime import datetime, timezone
+
+import pytest
+from datasette.app import Datasette
+from sqlite_utils import Database
+
+from lastfm import save_recent_tracks
+from lastfm.db_setup import create_all_tables
+from plugins.report_queries import (
+    ReportCache,
+    fetch_top_artists,
+    fetch_year_report,
+    report_cache,
+)
+
+START = int(datetime(2023, 1, 1, tzinfo=timezone.utc).timestamp())
+END = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+
+
+def scrobbles(artist, count, offset=0):
+    return [
+        {
+            "artist": artist,
+            "song": "Nest",
+            "album": "Animals",
+            "uts_timestamp": START + offset + n * 60,
+        }
+        for n in range(count)
+    ]
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "lastfm.db")
+    db = Database(path)
+    create_all_tables(db)
+    save_recent_tracks(db, scrobbles("TTNG", 10))
+    db["artist_details"].insert({"id": "ttng", "name": "TTNG"})
+    db.conn.commit()
+    db.close()
+    return path
+
+
+@pytest.fixture
+def datasette(path):
+    return Datasette([path], template_dir="templates", plugins_dir="plugins")
+
+
+def add_scrobbles(path, count):
+    db = Database(path)
+    save_recent_tracks(db, scrobbles("TTNG", count, offset=86400))
+    db.conn.commit()
+    db.close()
+
+
+def get(datasette, url, headers=None):
+    async def fetch():
+        return await datasette.client.get(url, headers=headers or {})
+
+    return asyncio.run(fetch())
+
+
+def test_repeat_fetches_are_served_from_cache(datasette):
+    fetch = fetch_top_artists(datasette)
+
+    first = asyncio.run(fetch(START, END))
+    second = asyncio.run(fetch(START, END))
+
+    assert second is first
+    assert report_cache(datasette).stats() == {
+        "hits": 1,
+        "misses": 1,
+        "size": 1,
+        "max_size": 256,
+    }
+
+
+def test_caches_each_period_separately(datasette):
+    fetch = fetch_top_artists(datasette)
+
+    asyncio.run(fetch(START, END))
+    asyncio.run(fetch(START, END + 1))
+
+    assert report_cache(datasette).stats()["misses"] == 2
+
+
+def test_commits_by_other_connections_invalidate_the_cache(datasette, path):
+    fetch = fetch_top_artists(datasette)
+    assert asyncio.run(fetch(START, END))[0]["listens"] == 10
+
+    add_scrobbles(path, 5)
+
+    assert asyncio.run(fetch(START, END))[0]["listens"] == 15
+    assert report_cache(datasette).stats()["hits"] == 0
+
+
+def test_year_report_uses_the_cache(datasette):
+    asyncio.run(fetch_year_report(datasette)(START, END))
+    asyncio.run(fetch_year_report(datasette)(START, END))
+
+    assert report_cache(datasette).stats()["hits"] == 6
+
+
+def test_evicts_least_recently_used_results(datasette):
+    cache = ReportCache(datasette.get_database(), max_size=2)
+    cache.get("a")
+    cache.set("a", ["a"])
+    cache.set("b", ["b"])
+    cache.get("a")
+    cache.set("c", ["c"])
+
+    assert cache.get("a") == ["a"]
+    assert cache.get("b") is None
+    assert cache.get("c") == ["c"]
+
+
+def test_report_page_has_caching_headers(datasette):
+    response = get(datasette, "/reports/year/2023")
+
+    assert response.status_code == 200
+    assert response.headers["etag"]
+    assert response.headers["last-modified"]
+    assert response.headers["cache-control"] == "no-cache"
+
+
+def test_unchanged_report_page_is_not_modified(datasette):
+    response = get(datasette, "/reports/year/2023")
+
+    by_etag = get(
+        datasette, "/reports/year/2023", {"if-none-match": response.headers["etag"]}
+    )
+    by_date = get(
+        datasette,
+        "/reports/year/2023",
+        {"if-modified-since": response.headers["last-modified"]},
+    )
+
+    assert by_etag.status_code == 304
+    assert by_date.status_code == 304
+    assert by_etag.headers["etag"] == response.headers["etag"]
+
+
+def test_report_page_changes_with_the_database(datasette, path):
+    etag = get(datasette, "/reports/year/2023").headers["etag"]
+
+    add_scrobbles(path, 2000)
+    response = get(datasette, "/reports/year/2023", {"if-none-match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_report_page_changes_with_its_templates(tmp_path, path):
+    templates = tmp_path / "templates"
+    shutil.copytree("templates", templates)
+    datasette = Datasette([path], template_dir=str(templates), plugins_dir="plugins")
+    etag = get(datasette, "/reports/year/2023").headers["etag"]
+
+    template = templates / "pages" / "reports" / "year" / "{year}.html"
+    os.utime(template)
+    response = get(datasette, "/reports/year/2023", {"if-none-match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_other_pages_have_no_caching_headers(datasette):
+    response = get(datasette, "/reports")
+
+    assert "etag" not in response.headers
+
+
+def test_reports_cache_stats(datasette):
+    get(datasette, "/reports/year/2023")
+    get(datasette, "/reports/year/2023")
+
+    response = get(datasette, "/-/report-cache")
+
+    assert response.json() == {"hits": 6, "misses": 6, "size": 6, "max_size": 256}
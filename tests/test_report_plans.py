@@ -0,0 +1,86 @@
+import re
+
+import pytest
+from sqlite_utils import Database
+
+from lastfm import reports, save_recent_tracks
+from lastfm.db_setup import create_all_tables, create_indexes
+from lastfm.reports import report_params
+
+QUERIES = [
+    "TOP_ARTISTS",
+    "TOP_ALBUMS",
+    "TOP_TRACKS",
+    "BLAST_ARTISTS",
+    "LOVES",
+    "MOST_LOVED",
+    "MONTHLY_TAGS",
+]
+
+
+@pytest.fixture(params=[False, True], ids=["text", "normalized"])
+def db(request):
+    database = Database(memory=True)
+    create_all_tables(database, normalized=request.param)
+    create_indexes(database)
+    return database
+
+
+def query_plan(db: Database, query, params):
+    return [row[3] for row in db.execute("explain query plan " + query, params)]
+
+
+def full_scans(plan):
+    """Tables read in full, ignoring the subqueries the plan builds itself."""
+    subqueries = {
+        match.group(1)
+        for step in plan
+        if (match := re.match(r"(?:MATERIALIZE|CO-ROUTINE) (.+)", step))
+    }
+    return [
+        step
+        for step in plan
+        if (match := re.match(r"SCAN (\S+)$", step))
+        and match.group(1) not in subqueries
+        and not match.group(1).startswith("(subquery")
+    ]
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_report_queries_only_search_tables_by_index(db: Database, query):
+    plan = query_plan(db, getattr(reports, query), report_params(1672531200, 1704067200))
+
+    assert full_scans(plan) == []
+
+
+def test_playlist_joins_artist_details_by_index(db: Database):
+    plan = query_plan(
+        db,
+        "select count(1) from artist_details as v"
+        "   join playlist as p on p.artist_id = v.id"
+        "   where v.id = :artist",
+        {"artist": "nyos"},
+    )
+
+    assert full_scans(plan) == []
+
+
+def test_playlist_artist_id_is_lowercase_artist(db: Database):
+    save_recent_tracks(db, [{"artist": "TTNG", "song": "Gibbon", "uts_timestamp": 1}])
+
+    assert [row["artist_id"] for row in db.query("select * from playlist")] == ["ttng"]
+
+
+def test_adds_artist_id_to_existing_databases():
+    db = Database(memory=True)
+    db["playlist"].create(
+        {"artist": str, "song": str, "album": str, "uts_timestamp": int},
+        pk="uts_timestamp",
+    )
+    db["playlist"].insert({"artist": "Nyos", "song": "Nest", "uts_timestamp": 1})
+
+    create_all_tables(db)
+    create_indexes(db)
+
+    assert db.execute("select artist_id from playlist").fetchall() == [("nyos",)]
+    assert ["artist_id"] in [index.columns for index in db["playlist"].indexes]
@@ -0,0 +1,124 @@
+import random
+from datetime import datetime, timezone
+
+import pytest
+from sqlite_utils import Database
+
+from lastfm import save_artist_tags, save_recent_tracks
+from lastfm.db_setup import create_all_tables
+from lastfm.reports import (
+    TOP_ALBUMS,
+    TOP_ARTISTS,
+    TOP_TRACKS,
+    report_params,
+)
+
+# The report queries as they were before the rollups, grouping `playlist`
+PLAYLIST_QUERIES = {
+    "top_artists": """
+        select
+          v.name, v.image_id, count(1) as listens, discovered,
+          (discovered >= cast(:start as integer)) as new
+        from
+          playlist as p
+        join
+          artist_details as v on lower(p.artist) = v.id
+        join
+          artist_history as h on lower(p.artist) = h.id
+        where
+          uts_timestamp >= :start and
+          uts_timestamp < :end
+        group by
+          p.artist
+    """,
+    "top_albums": """
+        select
+          p.artist, p.album as name, image_id, count(1) as listens, discovered,
+          (discovered >= cast(:start as integer)) as new
+        from
+          playlist as p
+        join
+          album_details as v on p.album = v.name
+          and p.artist = v.artist
+        where
+          uts_timestamp >= :start and
+          uts_timestamp < :end
+        group by
+          p.artist, p.album
+    """,
+    "top_tracks": """
+        select
+          p.artist, name, v.image_id, count(1) as listens, discovered,
+          (discovered >= cast(:start as integer)) as new
+        from
+          playlist as p
+        join
+          track_details as v on p.song = v.name
+                                  and p.artist = v.artist
+        where
+          uts_timestamp >= :start and
+          uts_timestamp < :end
+        group by
+          p.artist, p.song
+    """,
+}
+
+ROLLUP_QUERIES = {
+    "top_artists": TOP_ARTISTS,
+    "top_albums": TOP_ALBUMS,
+    "top_tracks": TOP_TRACKS,
+}
+
+ARTISTS = ["Nyos", "TTNG", "Tide", "Told Slant"]
+HISTORY_START = int(datetime(2022, 11, 1, tzinfo=timezone.utc).timestamp())
+HISTORY_END = int(datetime(2024, 3, 1, tzinfo=timezone.utc).timestamp())
+
+
+@pytest.fixture(scope="module", params=[False, True], ids=["text", "normalized"])
+def db(request):
+    rng = random.Random(13)
+    database = Database(memory=True)
+    create_all_tables(database, normalized=request.param)
+    scrobbles = [
+        {
+            "artist": rng.choice(ARTISTS),
+            "song": rng.choice(["Nest", "Gibbon", "Tsunami"]),
+            "album": rng.choice(["Animals", "Waiting Room", ""]),
+            "uts_timestamp": rng.randrange(HISTORY_START, HISTORY_END),
+        }
+        for _ in range(3000)
+    ]
+    save_recent_tracks(database, scrobbles)
+    for artist in ARTISTS:
+        database["artist_details"].insert({"id": artist.lower(), "name": artist})
+        tags = rng.sample(["math rock", "emo", "indie", "jazz"], 2)
+        save_artist_tags(database, artist, [{"name": tag} for tag in tags])
+    return database
+
+
+def normalise(rows, drop=()):
+    return sorted(tuple(value for key, value in row.items() if key not in drop) for row in rows)
+
+
+def report_ranges():
+    rng = random.Random(7)
+    ranges = [
+        (HISTORY_START, HISTORY_END),
+        (
+            int(datetime(2023, 1, 1, tzinfo=timezone.utc).timestamp()),
+            int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()),
+        ),
+    ]
+    for _ in range(10):
+        start = rng.randrange(HISTORY_START - 86400 * 10, HISTORY_END)
+        ranges.append((start, start + rng.randrange(3600, 86400 * 500)))
+    return ranges
+
+
+@pytest.mark.parametrize("report", ROLLUP_QUERIES)
+@pytest.mark.parametrize("start, end", report_ranges())
+def test_rollup_reports_match_playlist_reports(db: Database, report, start, end):
+    expected = db.query(PLAYLIST_QUERIES[report], {"start": start, "end": end})
+    actual = db.query(ROLLUP_QUERIES[report], report_params(start, end))
+
+    assert normalise(actual, drop=("rownum",)) == normalise(expected)
@@ -0,0 +1,88 @@
+import pytest
+import requests
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+from lastfm.retry import RetryPolicy, parse_retry_after
+
+
+def response(status=200, body=b"{}", headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response.headers.update(headers or {})
+    return response
+
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504])
+def test_retries_rate_limits_and_server_errors(status):
+    assert RetryPolicy().should_retry(response(status))
+
+
+@pytest.mark.parametrize("status", [200, 400, 403, 404])
+def test_does_not_retry_success_or_client_errors(status):
+    assert not RetryPolicy().should_retry(response(status))
+
+
+@pytest.mark.parametrize("code", [8, 11, 16, 29])
+def test_retries_temporary_lastfm_errors(code):
+    body = b'{"error": %d, "message": "Try again"}' % code
+    assert RetryPolicy().should_retry(response(body=body))
+
+
+@pytest.mark.parametrize("code", [2, 6, 10, 26])
+def test_does_not_retry_permanent_lastfm_errors(code):
+    body = b'{"error": %d, "message": "No"}' % code
+    assert not RetryPolicy().should_retry(response(body=body))
+
+
+def test_backs_off_exponentially():
+    policy = RetryPolicy(backoff=2, jitter=0)
+
+    assert [policy.delay(attempt, response(503)) for attempt in (1, 2, 3, 4)] == [
+        2,
+        4,
+        8,
+        16,
+    ]
+
+
+def test_backoff_is_capped():
+    policy = RetryPolicy(backoff=2, max_backoff=5, jitter=0)
+
+    assert policy.delay(10, response(503)) == 5
+
+
+def test_jitter_only_shortens_delay():
+    policy = RetryPolicy(backoff=4, jitter=0.5)
+
+    for _ in range(100):
+        assert 2 <= policy.delay(1, response(503)) <= 4
+
+
+def test_honours_retry_after_seconds():
+    policy = RetryPolicy(backoff=1)
+
+    assert policy.delay(1, response(429, headers={"Retry-After": "7"})) == 7
+
+
+def test_retry_after_is_capped_by_max_backoff():
+    policy = RetryPolicy(max_backoff=10)
+
+    assert policy.delay(1, response(429, headers={"Retry-After": "3600"})) == 10
+
+
+def test_parses_retry_after_dates():
+    later = datetime.now(timezone.utc) + timedelta(seconds=30)
+
+    assert 25 < parse_retry_after(format_datetime(later, usegmt=True)) <= 30
+
+
+def test_ignores_invalid_retry_after():
+    assert parse_retry_after("soon") is None
+
+
+def test_backs_off_after_failing_without_a_response():
+    policy = RetryPolicy(backoff=2, jitter=0)
+
+    assert policy.delay(2) == 4
@@ -0,0 +1,150 @@
+import random
+from datetime import datetime, timezone
+
+import pytest
+from sqlite_utils import Database
+
+from lastfm import save_recent_tracks
+from lastfm.db_setup import create_all_tables
+from lastfm.rollups import listen_ranges, month_start, period_start, rebuild_rollups
+
+
+@pytest.fixture
+def db():
+    database = Database(memory=True)
+    create_all_tables(database)
+    return database
+
+
+def timestamp(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp())
+
+
+def scrobble(artist, song, album, uts_timestamp):
+    return {"artist": artist, "song": song, "album": album, "uts_timestamp": uts_timestamp}
+
+
+def rollup(db, table):
+    return list(db.query(f"select * from {table} order by 1, 2, 3"))
+
+
+def test_counts_listens_per_artist_per_day(db: Database):
+    save_recent_tracks(
+        db,
+        [
+            scrobble("Nyos", "Bird Fight", "Waiting Room", timestamp(2024, 3, 1, 9)),
+            scrobble("Nyos", "Nest", "Waiting Room", timestamp(2024, 3, 1, 23)),
+            scrobble("Nyos", "Nest", "Waiting Room", timestamp(2024, 3, 2, 0)),
+            scrobble("TTNG", "Gibbon", "Animals", timestamp(2024, 3, 2, 1)),
+        ],
+    )
+
+    assert rollup(db, "artist_listens_daily") == [
+        {"period": timestamp(2024, 3, 1), "artist": "Nyos", "listens": 2},
+        {"period": timestamp(2024, 3, 2), "artist": "Nyos", "listens": 1},
+        {"period": timestamp(2024, 3, 2), "artist": "TTNG", "listens": 1},
+    ]
+
+
+def test_counts_listens_per_album_and_track_per_month(db: Database):
+    save_recent_tracks(
+        db,
+        [
+            scrobble("Nyos", "Bird Fight", "Waiting Room", timestamp(2024, 3, 1, 9)),
+            scrobble("Nyos", "Nest", "Waiting Room", timestamp(2024, 3, 31, 23)),
+            scrobble("Nyos", "Nest", "Waiting Room", timestamp(2024, 4, 1, 0)),
+        ],
+    )
+
+    assert rollup(db, "album_listens_monthly") == [
+        {
+            "period": timestamp(2024, 3, 1),
+            "artist": "Nyos",
+            "album": "Waiting Room",
+            "listens": 2,
+        },
+        {
+            "period": timestamp(2024, 4, 1),
+            "artist": "Nyos",
+            "album": "Waiting Room",
+            "listens": 1,
+        },
+    ]
+    assert [row["listens"] for row in rollup(db, "track_listens_monthly")] == [1, 1, 1]
+
+
+def test_saving_a_scrobble_again_does_not_count_it_twice(db: Database):
+    listen = scrobble("Nyos", "Nest", "Waiting Room", timestamp(2024, 3, 1, 9))
+
+    save_recent_tracks(db, [listen])
+    save_recent_tracks(db, [listen, listen])
+
+    assert [row["listens"] for row in rollup(db, "artist_listens_daily")] == [1]
+
+
+def test_scrobbles_without_an_album_are_not_counted_for_albums(db: Database):
+    save_recent_tracks(db, [scrobble("Told Slant", "Tsunami", "", timestamp(2024, 3, 1))])
+
+    assert rollup(db, "album_listens_daily") == []
+    assert len(rollup(db, "artist_listens_daily")) == 1
+
+
+def test_rebuild_matches_incremental_rollups(db: Database):
+    rng = random.Random(1)
+    scrobbles = [
+        scrobble(
+            rng.choice(["Nyos", "TTNG", "Tide"]),
+            rng.choice(["A", "B", "C"]),
+            rng.choice(["X", "Y", ""]),
+            rng.randrange(timestamp(2020, 1, 1), timestamp(2024, 1, 1)),
+        )
+        for _ in range(500)
+    ]
+    for start in range(0, 500, 50):
+        save_recent_tracks(db, scrobbles[start : start + 50])
+    tables = [table for table in db.table_names() if "_listens_" in table]
+    incremental = {table: rollup(db, table) for table in tables}
+
+    rebuild_rollups(db)
+
+    assert {table: rollup(db, table) for table in tables} == incremental
+
+
+def test_month_start_is_start_of_utc_month():
+    assert month_start(timestamp(2024, 2, 29, 23, 59)) == timestamp(2024, 2, 1)
+
+
+def test_period_start_looks_up_each_day_once():
+    month_start.cache_clear()
+
+    for minute in range(60):
+        period_start("monthly", timestamp(2024, 2, 29, 23, minute))
+
+    assert month_start.cache_info().misses == 1
+
+
+@pytest.mark.parametrize(
+    "start, end",
+    [
+        (timestamp(2023, 12, 31, 23), timestamp(2024, 12, 31, 23)),
+        (timestamp(2024, 1, 1), timestamp(2025, 1, 1)),
+        (timestamp(2024, 3, 5, 12), timestamp(2024, 3, 5, 13)),
+        (timestamp(2024, 3, 5, 12), timestamp(2024, 3, 20, 13)),
+        (timestamp(2024, 1, 31, 12), timestamp(2024, 3, 1, 0)),
+    ],
+)
+def test_listen_ranges_cover_the_period_without_overlap(start, end):
+    ranges = listen_ranges(start, end)
+
+    assert (
+        ranges["start"]
+        <= ranges["day_lo"]
+        <= ranges["month_lo"]
+        <= ranges["month_hi"]
+        <= ranges["day_hi"]
+        <= ranges["end"]
+    )
+    assert ranges["day_lo"] % 86400 == 0 or ranges["day_lo"] == ranges["day_hi"]
+    assert month_start(ranges["month_lo"]) == ranges["month_lo"] or (
+        ranges["month_lo"] == ranges["month_hi"]
+    )
@@ -168,3 +168,18 @@ def test_saving_album_details_is_case_insensitive(db: Database):
         )
     )
     assert saved_album["image_id"] == "hijklmnop"
+
+
+def test_reports_whether_album_details_changed(db: Database):
+    album = {"name": "Elf Titled", "artist": "The Advantage", "url": "https://elf"}
+
+    assert save_album_details(db, album, timestamp=2345678901) is True
+    assert save_album_details(db, album, timestamp=3456789012) is False
+    assert (
+        save_album_details(db, album | {"image_id": "abc"}, timestamp=3456789013)
+        is True
+    )
+
+    [saved] = list(db.query("select * from album_details"))
+    assert saved["image_id"] == "abc"
+    assert saved["last_updated"] == 3456789013
@@ -1,7 +1,7 @@
 import pytest
 from sqlite_utils import Database
 
-from lastfm import save_artist_details, save_artist_listen_date
+from lastfm import content_hash, save_artist_details, save_artist_listen_date
 from lastfm.db_setup import create_artist_table, create_artist_history_table
 
 
@@ -189,3 +189,33 @@ def test_does_not_overwrite_wiki_when_empty_or_null(db: Database):
 
     assert artist["wiki"] == "Full wiki for artist"
     assert artist["summary"] == "Summary wiki"
+
+
+def test_reports_whether_details_changed(db: Database):
+    details = {"name": "Nyos", "wiki": "Instrumental duo", "tags": [{"name": "math"}]}
+
+    assert save_artist_details(db, details, timestamp=2345678901) is True
+    assert save_artist_details(db, details, timestamp=3456789012) is False
+    assert (
+        save_artist_details(db, details | {"wiki": "Belfast duo"}, timestamp=3456789013)
+        is True
+    )
+
+
+def test_only_moves_last_updated_on_when_details_are_unchanged(db: Database):
+    details = {"name": "Nyos", "wiki": "Instrumental duo"}
+    save_artist_details(db, details, timestamp=2345678901)
+    db.execute("update artist_details set wiki = 'Edited by hand'")
+
+    save_artist_details(db, details, timestamp=3456789012)
+
+    [artist] = list(db.query("select * from artist_details where id = 'nyos'"))
+    assert artist["wiki"] == "Edited by hand"
+    assert artist["last_updated"] == 3456789012
+
+
+def test_stores_hash_of_saved_details(db: Database):
+    save_artist_details(db, {"name": "Nyos"}, timestamp=2345678901)
+
+    [artist] = list(db.query("select * from artist_details where id = 'nyos'"))
+    assert artist["content_hash"] == content_hash({"name": "Nyos"})
@@ -1,7 +1,7 @@
 import pytest
 from sqlite_utils import Database
 
-from lastfm import save_artist_tags
+from lastfm import save_all_artist_tags, save_artist_tags
 from lastfm.db_setup import create_artist_tags_table
 
 
@@ -22,11 +22,17 @@ def test_persists_artist_tags(db: Database):
         ],
     )
     tags = list(db.query("select * from artist_tags"))
-    assert tags[0] == {"id": "melt-banana", "name": "noise", "url": "http://noise"}
+    assert tags[0] == {
+        "id": "melt-banana",
+        "name": "noise",
+        "url": "http://noise",
+        "weight": 100,
+    }
     assert tags[1] == {
         "id": "melt-banana",
         "name": "noise rock",
         "url": "http://noise+rock",
+        "weight": 80,
     }
 
 
@@ -40,9 +46,87 @@ def test_lower_cases_tags(db: Database):
         ],
     )
     tags = list(db.query("select * from artist_tags"))
-    assert tags[0] == {"id": "melt-banana", "name": "noise", "url": "http://noise"}
+    assert tags[0] == {
+        "id": "melt-banana",
+        "name": "noise",
+        "url": "http://noise",
+        "weight": 100,
+    }
     assert tags[1] == {
         "id": "melt-banana",
         "name": "noise rock",
         "url": "http://noise+rock",
+        "weight": 80,
     }
+
+
+def test_replaces_previous_tags(db: Database):
+    save_artist_tags(
+        db,
+        "Melt-Banana",
+        [
+            {"name": "noise", "url": "http://noise"},
+            {"name": "j-rock", "url": "http://j-rock"},
+        ],
+    )
+
+    save_artist_tags(db, "Melt-Banana", [{"name": "noise", "url": "http://noise"}])
+
+    tags = list(db.query("select * from artist_tags"))
+    assert tags == [
+        {"id": "melt-banana", "name": "noise", "url": "http://noise", "weight": 100}
+    ]
+
+
+def test_saves_tags_for_batches_of_artists(db: Database):
+    save_all_artist_tags(
+        db,
+        [
+            ("Melt-Banana", [{"name": "noise", "url": "http://noise"}]),
+            ("Nyos", [{"name": "math rock", "url": "http://math+rock"}]),
+        ],
+    )
+
+    tags = list(db.query("select id, name from artist_tags order by id"))
+    assert tags == [
+        {"id": "melt-banana", "name": "noise"},
+        {"id": "nyos", "name": "math rock"},
+    ]
+
+
+def test_tags_differing_only_in_case_are_saved_once(db: Database):
+    save_artist_tags(
+        db,
+        "Melt-Banana",
+        [
+            {"name": "Noise", "url": "http://Noise"},
+            {"name": "noise", "url": "http://noise"},
+        ],
+    )
+
+    assert db["artist_tags"].count == 1
+
+
+def test_weights_tags_by_count_or_position(db: Database):
+    save_artist_tags(
+        db,
+        "Melt-Banana",
+        [{"name": "noise", "count": 57}, {"name": "japanese", "count": 12}],
+    )
+    save_artist_tags(db, "Nyos", [{"name": f"tag {n}"} for n in range(7)])
+
+    weights = [
+        row["weight"]
+        for row in db.query("select weight from artist_tags order by id, weight desc")
+    ]
+    assert weights == [57, 12, 100, 80, 60, 40, 20, 10, 10]
+
+
+def test_adds_weights_to_existing_tags():
+    db = Database(memory=True)
+    db["artist_tags"].create({"id": str, "name": str, "url": str}, pk=["id", "name"])
+    db["artist_tags"].insert({"id": "nyos", "name": "math rock", "url": None})
+
+    create_artist_tags_table(db)
+
+    assert list(db.query("select weight from artist_tags")) == [{"weight": 100}]
@@ -0,0 +1,106 @@
+import pytest
+from sqlite_utils import Database
+
+from lastfm import save_albums, save_artists
+from lastfm.db_setup import create_all_tables
+
+
+@pytest.fixture
+def db():
+    database = Database(memory=True)
+    create_all_tables(database)
+    return database
+
+
+def artist(name, tags, similar):
+    return {
+        "name": name,
+        "url": f"https://www.last.fm/music/{name}",
+        "image_id": None,
+        "summary": None,
+        "wiki": None,
+        "tags": [{"name": tag, "url": f"http://{tag}"} for tag in tags],
+        "similar": [{"name": similar_name} for similar_name in similar],
+    }
+
+
+def test_saves_details_tags_and_similar_artists_for_each_artist(db: Database):
+    save_artists(
+        db,
+        [
+            ("Melt-Banana", artist("Melt-Banana", ["noise"], ["Boredoms"])),
+            ("Nyos", artist("Nyos", ["math rock", "instrumental"], ["TTNG", "Tide"])),
+        ],
+        timestamp=2345678901,
+    )
+
+    assert db["artist_details"].count == 2
+    assert db["artist_tags"].count == 3
+    assert db["similar_artists"].count == 3
+    assert {row["last_updated"] for row in db["artist_details"].rows} == {2345678901}
+
+
+def test_saves_nothing_when_a_batch_fails(db: Database):
+    broken = {"name": "Broken"}
+
+    with pytest.raises(KeyError):
+        save_artists(
+            db,
+            [
+                ("Melt-Banana", artist("Melt-Banana", [], [])),
+                ("Broken", broken),
+            ],
+        )
+
+    assert db["artist_details"].count == 0
+
+
+def test_saves_each_album_in_batch(db: Database):
+    save_albums(
+        db,
+        [
+            {"name": "Elf Titled", "artist": "The Advantage", "url": "https://elf"},
+            {"name": "Waiting Room", "artist": "Nyos", "url": "https://waiting"},
+        ],
+        timestamp=2345678901,
+    )
+
+    albums = list(db.query("select name, last_updated from album_details"))
+    assert albums == [
+        {"name": "Elf Titled", "last_updated": 2345678901},
+        {"name": "Waiting Room", "last_updated": 2345678901},
+    ]
+
+
+def test_skips_tags_and_similar_artists_of_unchanged_artists(db: Database):
+    nyos = artist("Nyos", ["math rock"], ["TTNG"])
+    save_artists(db, [("Nyos", nyos)], timestamp=2345678901)
+    db.execute("delete from artist_tags")
+    db.conn.commit()
+
+    changed = save_artists(db, [("Nyos", nyos)], timestamp=3456789012)
+
+    assert changed == 0
+    assert db["artist_tags"].count == 0
+
+
+def test_counts_changed_artists(db: Database):
+    save_artists(db, [("Nyos", artist("Nyos", [], []))])
+
+    changed = save_artists(
+        db,
+        [
+            ("Nyos", artist("Nyos", ["math rock"], [])),
+            ("Tide", artist("Tide", [], [])),
+            ("Nyos", artist("Nyos", ["math rock"], [])),
+        ],
+    )
+
+    assert changed == 2
+
+
+def test_counts_changed_albums(db: Database):
+    album = {"name": "Elf Titled", "artist": "The Advantage"}
+    save_albums(db, [album])
+
+    assert save_albums(db, [album, album | {"url": "https://elf"}]) == 1
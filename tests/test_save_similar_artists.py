@@ -1,7 +1,7 @@
 import pytest
 from sqlite_utils import Database
 
-from lastfm import save_similar_artists
+from lastfm import save_all_similar_artists, save_similar_artists
 from lastfm.db_setup import create_similar_artists_table
 
 
@@ -48,7 +48,7 @@ def test_saves_inferred_similar_position(db: Database):
     assert similar[2]["position"] == 3
 
 
-def test_overwrites_similar_artists_at_same_position(db: Database):
+def test_replaces_previous_similar_artists(db: Database):
     save_similar_artists(
         db,
         "He Was Eaten by Owls",
@@ -69,10 +69,35 @@ def test_overwrites_similar_artists_at_same_position(db: Database):
 
     similar = list(db.query("select * from similar_artists order by position"))
 
-    assert len(similar) == 3
+    assert len(similar) == 1
     assert similar[0]["similar_id"] == "the most"
     assert similar[0]["position"] == 1
-    assert similar[1]["similar_id"] == "you break, you buy"
-    assert similar[1]["position"] == 2
-    assert similar[2]["similar_id"] == "halfsleep"
-    assert similar[2]["position"] == 3
+
+
+def test_saves_batches_of_artists(db: Database):
+    save_all_similar_artists(
+        db,
+        [
+            ("Indoor Cities", [{"name": "He Was Eaten by Owls"}]),
+            ("TTNG", [{"name": "Nyos"}, {"name": "Tide"}]),
+            ("Nyos", []),
+        ],
+    )
+
+    similar = list(
+        db.query("select id, similar_id, position from similar_artists order by id")
+    )
+
+    assert similar == [
+        {"id": "indoor cities", "similar_id": "he was eaten by owls", "position": 1},
+        {"id": "ttng", "similar_id": "nyos", "position": 1},
+        {"id": "ttng", "similar_id": "tide", "position": 2},
+    ]
+
+
+def test_leaves_other_artists_untouched(db: Database):
+    save_similar_artists(db, "TTNG", [{"name": "Nyos"}])
+
+    save_similar_artists(db, "Indoor Cities", [])
+
+    assert db["similar_artists"].count == 1
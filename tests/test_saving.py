@@ -1,11 +1,14 @@
 import pytest
 from sqlite_utils import Database
 
-from lastfm import save_recent_track
+from lastfm import Scrobble, save_recent_track, save_recent_tracks
 from lastfm.db_setup import (
     create_album_table,
     create_artist_history_table,
+    create_artist_gaps_table,
     create_artist_table,
+    create_rollup_tables,
+    create_scrobbles_table,
     create_track_table,
     create_artist_history_table,
 )
@@ -14,10 +17,13 @@ from lastfm.db_setup import (
 @pytest.fixture
 def db():
     database = Database(memory=True)
+    create_scrobbles_table(database)
     create_artist_table(database)
     create_track_table(database)
     create_album_table(database)
     create_artist_history_table(database)
+    create_rollup_tables(database)
+    create_artist_gaps_table(database)
     return database
 
 
@@ -89,6 +95,11 @@ def test_saving_a_single_recent_track_creates_record_in_playlist_table(db: Datab
         "album": "Utopian Frequencies",
         "uts_timestamp": 1725597832,
         "datetime": "06 Sep 2024, 04:43",
+        "artist_id": "65daysofstatic",
+        "local_year": 2024,
+        "local_month": 9,
+        "local_day": 6,
+        "local_hour": 4,
     }
 
 
@@ -230,3 +241,84 @@ def test_does_not_save_albums_when_no_album_name_is_given(db: Database, recent_t
     )
 
     assert len(albums) == 0
+
+
+def test_saving_a_batch_matches_saving_tracks_one_at_a_time(
+    db: Database, recent_tracks
+):
+    for recent_track in recent_tracks:
+        save_recent_track(db, recent_track)
+
+    batch_db = Database(memory=True)
+    create_scrobbles_table(batch_db)
+    create_artist_table(batch_db)
+    create_track_table(batch_db)
+    create_album_table(batch_db)
+    create_artist_history_table(batch_db)
+    create_rollup_tables(batch_db)
+    create_artist_gaps_table(batch_db)
+    save_recent_tracks(batch_db, recent_tracks)
+
+    for table in ("playlist", "artist_history", "track_details", "album_details"):
+        assert list(batch_db[table].rows) == list(db[table].rows)
+
+
+def test_saving_a_batch_keeps_existing_first_and_last_listens(
+    db: Database, recent_tracks
+):
+    save_recent_tracks(db, recent_tracks[:3])
+    save_recent_tracks(db, recent_tracks[3:])
+
+    [track] = list(
+        db.query(
+            "select * from track_details where name = :track and artist = :artist",
+            {"artist": "65daysofstatic", "track": "Retreat! Retreat!"},
+        )
+    )
+
+    assert track["discovered"] == 1725499832
+    assert track["last_listened"] == 1725599832
+
+
+def test_saving_a_batch_does_not_clear_track_image_ids(db: Database, recent_tracks):
+    save_recent_tracks(db, recent_tracks[:1])
+    save_recent_tracks(db, [recent_tracks[0] | {"image_id": None}])
+
+    [track] = list(db.query("select * from track_details where name = 'SynthFlood'"))
+
+    assert track["image_id"] == "abcdefg"
+
+
+def test_saving_a_batch_skips_empty_pages(db: Database):
+    save_recent_tracks(db, [None])
+
+    assert db["playlist"].count == 0
+
+
+def test_saving_a_batch_is_rolled_back_on_failure(db: Database, recent_tracks):
+    db["album_details"].drop()
+
+    with pytest.raises(Exception):
+        save_recent_tracks(db, recent_tracks)
+
+    assert db["playlist"].count == 0
+
+
+def test_saves_scrobble_records(db: Database):
+    save_recent_tracks(
+        db,
+        [
+            Scrobble(
+                "65daysofstatic",
+                "SynthFlood",
+                "Utopian Frequencies",
+                1725597832,
+                "06 Sep 2024, 04:43",
+                "abcdefg",
+            )
+        ],
+    )
+
+    [track] = list(db.query("select * from track_details"))
+    assert track["image_id"] == "abcdefg"
+    assert db["playlist"].count == 1
@@ -0,0 +1,91 @@
+import pytest
+from sqlite_utils import Database
+
+from lastfm import (
+    clear_sync_state,
+    fetch_sync_state,
+    save_recent_tracks,
+    save_sync_state,
+    transaction,
+)
+from lastfm.db_setup import create_all_tables
+
+
+@pytest.fixture
+def db():
+    database = Database(memory=True)
+    create_all_tables(database)
+    return database
+
+
+@pytest.fixture
+def sync_state():
+    return {
+        "method": "user.getrecenttracks",
+        "from_timestamp": 1625499833,
+        "to_timestamp": 1726597832,
+        "page": 900,
+        "total_pages": 1500,
+    }
+
+
+def test_returns_none_when_no_sync_is_in_progress(db: Database):
+    assert fetch_sync_state(db, "user.getrecenttracks") is None
+
+
+def test_returns_saved_sync_state(db: Database, sync_state):
+    save_sync_state(db, sync_state)
+
+    assert fetch_sync_state(db, "user.getrecenttracks") == sync_state
+
+
+def test_keeps_one_state_per_method(db: Database, sync_state):
+    save_sync_state(db, sync_state)
+    save_sync_state(db, sync_state | {"page": 901})
+
+    assert db["_sync_state"].count == 1
+    assert fetch_sync_state(db, "user.getrecenttracks")["page"] == 901
+
+
+def test_clearing_removes_sync_state(db: Database, sync_state):
+    save_sync_state(db, sync_state)
+
+    clear_sync_state(db, "user.getrecenttracks")
+
+    assert fetch_sync_state(db, "user.getrecenttracks") is None
+
+
+def test_state_is_committed_with_the_page(db: Database, sync_state):
+    with transaction(db):
+        save_sync_state(db, sync_state)
+        save_recent_tracks(
+            db,
+            [{"artist": "Nyos", "song": "Bird Fight", "uts_timestamp": 1725597832}],
+        )
+
+    assert fetch_sync_state(db, "user.getrecenttracks")["page"] == 900
+    assert db["playlist"].count == 1
+
+
+def test_state_is_not_saved_when_page_fails(db: Database, sync_state):
+    with transaction(db):
+        save_sync_state(db, sync_state)
+    db["album_details"].drop()
+
+    with pytest.raises(Exception):
+        with transaction(db):
+            save_sync_state(db, sync_state | {"page": 901})
+            save_recent_tracks(
+                db,
+                [
+                    {
+                        "artist": "Nyos",
+                        "song": "Bird Fight",
+                        "album": "Waiting Room",
+                        "uts_timestamp": 1725597832,
+                    }
+                ],
+            )
+
+    assert fetch_sync_state(db, "user.getrecenttracks")["page"] == 900
+    assert db["playlist"].count == 0
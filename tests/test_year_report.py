@@ -0,0 +1,68 @@
+import asyncio
+import random
+from datetime import datetime, timezone
+
+import pytest
+from datasette.app import Datasette
+from sqlite_utils import Database
+
+from lastfm import save_love, save_recent_tracks
+from lastfm.db_setup import create_all_tables, create_indexes
+from lastfm.reports import report_params
+from plugins.report_queries import YEAR_REPORT, fetch_year_report
+
+ARTISTS = ["Nyos", "TTNG", "Tide", "Told Slant"]
+START = int(datetime(2023, 1, 1, tzinfo=timezone.utc).timestamp())
+END = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+
+
+@pytest.fixture
+def datasette(tmp_path):
+    rng = random.Random(5)
+    path = str(tmp_path / "lastfm.db")
+    db = Database(path)
+    create_all_tables(db)
+    scrobbles = [
+        {
+            "artist": rng.choice(ARTISTS),
+            "song": rng.choice(["Nest", "Gibbon", "Tsunami"]),
+            "album": rng.choice(["Animals", "Waiting Room"]),
+            "uts_timestamp": rng.randrange(START - 86400 * 800, END),
+        }
+        for _ in range(2000)
+    ]
+    save_recent_tracks(db, scrobbles)
+    for scrobble in scrobbles[::20]:
+        save_love(db, scrobble)
+    for artist in ARTISTS:
+        db["artist_details"].insert({"id": artist.lower(), "name": artist})
+    for album in ["Animals", "Waiting Room"]:
+        for artist in ARTISTS:
+            db["album_details"].insert({"artist": artist, "name": album})
+    create_indexes(db)
+    db.conn.commit()
+    return Datasette([path], template_dir="templates", plugins_dir="plugins")
+
+
+def query(datasette, sql):
+    db = Database(datasette.get_database().path)
+    return db.execute(sql, report_params(START, END)).fetchall()
+
+
+def test_year_report_matches_each_section(datasette):
+    report = asyncio.run(fetch_year_report(datasette)(START, END))
+
+    assert report.keys() == YEAR_REPORT.keys()
+    for section, sql in YEAR_REPORT.items():
+        assert [tuple(row) for row in report[section]] == query(datasette, sql)
+    assert report["top_artists"]
+
+
+def test_renders_year_report_page(datasette):
+    async def fetch():
+        return await datasette.client.get("/reports/year/2023")
+
+    response = asyncio.run(fetch())
+
+    assert response.status_code == 200
+    assert "Told Slant" in response.text